@@ -91,6 +91,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# "positions" holds the latest position per bus and trip (see trips.positions).
+# With several worker processes point it at a shared Redis-compatible server:
+#   "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#   "LOCATION": "redis://127.0.0.1:6379/1",
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "positions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "positions",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
+TRIP_POSITION_CACHE = "positions"
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -132,4 +154,64 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-AUTH_USER_MODEL = 'accounts.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'accounts.User'
+
+# Trip GPS ingestion
+# Points are buffered in-process and written in one bulk insert when either limit is hit
+
+TRIP_LOCATION_BATCH_SIZE = 500
+
+TRIP_LOCATION_FLUSH_INTERVAL = 2.0  # seconds
+
+TRIP_LOCATION_MAX_PENDING = 50000  # kept for retry while the database is unavailable, oldest dropped beyond
+
+# TripLocation/TripEvent range partitions, maintained by manage_trip_partitions
+
+TRIP_PARTITION_INTERVAL = 'month'  # or 'day'
+
+TRIP_PARTITION_PREMAKE = 3  # future partitions kept ready
+
+TRIP_PARTITION_RETENTION_DAYS = None  # e.g. 400 to detach partitions older than ~13 months
+
+# Completed trips are simplified into a TripTrack (trips.tracks); raw rows are kept for a short window
+
+TRIP_TRACK_TOLERANCE_M = 5.0
+
+TRIP_RAW_LOCATION_RETENTION_DAYS = 7
+
+# Automatic pickup/drop detection (trips.geofence)
+
+TRIP_GEOFENCE_RADIUS_M = 40.0
+
+TRIP_GEOFENCE_DWELL_SECONDS = 20.0  # time the bus must stay within the radius
+
+# Offline geocoding of route stop addresses (schools.geocoding)
+
+GEOCODING_PROVIDER = 'schools.geocoding.GazetteerProvider'
+
+GEOCODING_GAZETTEER = None  # CSV path, defaults to the bundled schools/data/gazetteer.csv
+
+GEOCODE_CACHE_MAX_ENTRIES = 100000
+
+# Learned stop-to-stop travel times (trips.segments)
+
+TRIP_SEGMENT_BUCKET_MINUTES = 60  # width of the time-of-day buckets
+
+# Streaming driving rules (trips.safety), defaults for schools without SafetyThresholds
+
+TRIP_SAFETY_SPEED_LIMIT_KMH = 50.0
+
+TRIP_SAFETY_OVERSPEED_SECONDS = 15.0
+
+TRIP_SAFETY_HARSH_BRAKING_MS2 = 3.5
+
+TRIP_SAFETY_STATIONARY_MINUTES = 10.0
+
+# Daily trip scheduler (trips.materialize)
+
+TRIP_SCHEDULE = {  # for routes without a TripTemplate
+    'PICKUP': ('07:00', 45),  # local start time, duration in minutes
+    'DROP': ('14:30', 45),
+}
+
+TRIP_MATERIALIZATION_HORIZON_DAYS = 3  # days of Trip rows created ahead from the templates
@@ -0,0 +1,265 @@
+"""
+Streaming loader for JSON fixtures such as datadump.json.
+
+Django's loaddata parses the whole file and saves the objects one at a time.
+Here the JSON array is decoded one object at a time from a small read buffer
+(iter_json_array), or line by line for NDJSON fixtures, objects go through
+Django's own deserializer and are queued per model, and every `batch_size`
+objects the queues are written with one multi-row INSERT per model, parents
+before the models referencing them.
+Memory therefore depends on the batch size, not on the size of the dump.
+
+Rows are inserted raw like loaddata saves them: field values come from the
+dump as they are (auto_now fields included), parent rows of multi-table
+inheritance are separate objects of the dump, and no model signals are sent.
+Objects already stored are overwritten, matched on the smallest unique key
+of the table that includes the primary key (the primary key itself, or e.g.
+(id, timestamp) of the partitioned trip tables). The whole load is one
+transaction with constraint checks deferred to the end, then the primary key
+sequences are reset.
+"""
+import bz2
+import gzip
+import json
+import lzma
+import time
+from collections import defaultdict
+
+from django.core.management.color import no_style
+from django.core.serializers.python import Deserializer
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst fixtures
+    zstandard = None
+
+BATCH_SIZE = 1000  # objects queued across all models before a write
+READ_SIZE = 1 << 16
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open, '.lzma': lzma.open}
+if zstandard is not None:
+    OPENERS['.zst'] = zstandard.open
+
+
+def open_fixture(path):
+    for suffix, opener in OPENERS.items():
+        if path.endswith(suffix):
+            return opener(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def fixture_items(path, stream):
+    """Items of a JSON array fixture, or of an NDJSON one (one object per line, e.g. from export_school)"""
+    name = path
+    for suffix in OPENERS:
+        name = name.removesuffix(suffix)
+    if name.endswith('.ndjson'):
+        return (json.loads(line) for line in stream if line.strip())
+    return iter_json_array(stream)
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """Yield the items of the JSON array in the text `stream`, reading `read_size` characters at a time"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Skip whitespace and separators, refilling the buffer as needed
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,' + ('' if started else '['):
+                if buffer[position] == '[':
+                    started = True
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position = stream.read(read_size), 0
+            eof = not buffer
+        if position >= len(buffer):
+            if started:
+                raise ValueError('Unexpected end of fixture, the JSON array is not closed')
+            return
+        if not started:
+            raise ValueError('A fixture must be a JSON array')
+        if buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The item continues past the buffer, read more and decode it again
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+        position = end
+
+
+def dependency_order(models):
+    """`models` with every model after the models its foreign keys point to, where there is no cycle"""
+    models = list(models)
+    pending = set(models)
+    ordered = []
+    while pending:
+        ready = [
+            model for model in models if model in pending and not any(
+                field.related_model in pending and field.related_model is not model
+                for field in model._meta.concrete_fields if field.is_relation
+            )
+        ]
+        if not ready:
+            ready = [model for model in models if model in pending]  # a cycle, the deferred checks cover it
+        for model in ready:
+            pending.discard(model)
+            ordered.append(model)
+    return ordered
+
+
+class StreamLoader:
+    """
+    Queue DeserializedObjects with add() and write them in batches, call
+    finish() once the stream is done. `counts` holds the rows written per model label.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, batch_size=BATCH_SIZE):
+        self.using = using
+        self.connection = connections[using]
+        self.batch_size = batch_size
+        self.pending = defaultdict(list)  # model -> [DeserializedObject]
+        self.queued = 0
+        self.counts = defaultdict(int)
+        self.models = set()
+        self.deferred = []  # objects with forward references to fix up at the end
+        self.order = []
+        self.upsert = {}
+
+    def add(self, deserialized):
+        model = deserialized.object._meta.concrete_model
+        self.pending[model].append(deserialized)
+        self.queued += 1
+        if deserialized.deferred_fields:
+            self.deferred.append(deserialized)
+        if self.queued >= self.batch_size:
+            self.flush()
+
+    def conflict_fields(self, model):
+        """
+        Fields of the smallest unique key that includes the primary key, to
+        overwrite stored rows on, e.g. (id, timestamp) of partitioned tables;
+        None where the database cannot upsert
+        """
+        if model not in self.upsert:
+            found = None
+            if self.connection.features.supports_update_conflicts_with_target:
+                columns = {field.column: field for field in model._meta.concrete_fields}
+                with self.connection.cursor() as cursor:
+                    constraints = self.connection.introspection.get_constraints(cursor, model._meta.db_table)
+                keys = sorted(
+                    (constraint['columns'] for constraint in constraints.values()
+                     if (constraint['unique'] or constraint['primary_key'])
+                     and model._meta.pk.column in constraint['columns']
+                     and all(column in columns for column in constraint['columns'])),
+                    key=len,
+                )
+                if keys:
+                    found = [columns[column] for column in keys[0]]
+            self.upsert[model] = found
+        return self.upsert[model]
+
+    def flush(self):
+        if not self.queued:
+            return
+        if set(self.pending) - set(self.order):
+            self.order = dependency_order(set(self.order) | set(self.pending))
+        for model in self.order:
+            objects = self.pending.pop(model, None)
+            if objects:
+                self.insert(model, objects)
+        self.queued = 0
+        # With DEBUG the query log would keep the SQL of every batch
+        self.connection.queries_log.clear()
+
+    def insert(self, model, objects):
+        opts = model._meta
+        manager = model._base_manager.db_manager(self.using)
+        fields = opts.local_concrete_fields
+        with_pk = [entry.object for entry in objects if entry.object.pk is not None]
+        if with_pk:
+            options = {}
+            unique_fields = self.conflict_fields(model)
+            if unique_fields:
+                options = {
+                    'on_conflict': OnConflict.UPDATE,
+                    'update_fields': [field for field in fields if field not in unique_fields],
+                    'unique_fields': unique_fields,
+                }
+            size = self.connection.ops.bulk_batch_size(fields, with_pk) or len(with_pk)
+            for start in range(0, len(with_pk), size):
+                manager._insert(with_pk[start:start + size], fields=fields, raw=True, using=self.using, **options)
+        without_pk = [entry.object for entry in objects if entry.object.pk is None]
+        if without_pk:
+            fields = [field for field in fields if field is not opts.pk]
+            returning = [opts.pk] if self.connection.features.can_return_rows_from_bulk_insert else None
+            size = self.connection.ops.bulk_batch_size(fields, without_pk) or len(without_pk)
+            for start in range(0, len(without_pk), size):
+                batch = without_pk[start:start + size]
+                rows = manager._insert(batch, fields=fields, returning_fields=returning, raw=True, using=self.using)
+                for obj, row in zip(batch, rows or ()):
+                    obj.pk = row[0]
+        self.insert_m2m(objects)
+        self.models.add(model)
+        self.counts[opts.label] += len(objects)
+
+    def insert_m2m(self, objects):
+        through_rows = defaultdict(list)
+        for entry in objects:
+            for name, values in (entry.m2m_data or {}).items():
+                field = entry.object._meta.get_field(name)
+                through = field.remote_field.through
+                if not through._meta.auto_created or entry.object.pk is None:
+                    continue
+                source = field.m2m_field_name()
+                target = field.m2m_reverse_field_name()
+                through_rows[through].extend(
+                    through(**{f'{source}_id': entry.object.pk, f'{target}_id': value}) for value in values
+                )
+        for through, rows in through_rows.items():
+            through._base_manager.db_manager(self.using).bulk_create(rows, ignore_conflicts=True)
+            self.counts[through._meta.label] += len(rows)
+
+    def finish(self):
+        """Write what is still queued and fill in the forward references"""
+        self.flush()
+        for entry in self.deferred:
+            entry.save_deferred_fields(using=self.using)
+
+    def reset_sequences(self):
+        sequence_sql = self.connection.ops.sequence_reset_sql(no_style(), list(self.models))
+        if sequence_sql:
+            with self.connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+
+def load(paths, using=DEFAULT_DB_ALIAS, batch_size=BATCH_SIZE, ignorenonexistent=False):
+    """Load the JSON fixtures at `paths` in one transaction, returns ({model label: rows}, seconds)"""
+    started = time.perf_counter()
+    connection = connections[using]
+    loader = StreamLoader(using, batch_size)
+    with transaction.atomic(using=using):
+        with connection.constraint_checks_disabled():
+            for path in paths:
+                with open_fixture(path) as stream:
+                    for deserialized in Deserializer(
+                        fixture_items(path, stream), using=using, ignorenonexistent=ignorenonexistent,
+                        handle_forward_references=True,
+                    ):
+                        loader.add(deserialized)
+            loader.finish()
+        connection.check_constraints(table_names=[model._meta.db_table for model in loader.models])
+        loader.reset_sequences()
+    return dict(loader.counts), time.perf_counter() - started
@@ -0,0 +1,40 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres, works element-wise on NumPy arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def to_local_xy(latitudes, longitudes, origin=None):
+    """
+    Project coordinates onto a flat plane in metres around `origin` (lat, lon),
+    the first point by default. Accurate enough at city scale.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    lat0, lon0 = origin if origin is not None else (latitudes[0], longitudes[0])
+    x = np.radians(longitudes - lon0) * np.cos(np.radians(lat0)) * EARTH_RADIUS_M
+    y = np.radians(latitudes - lat0) * EARTH_RADIUS_M
+    return x, y
+
+
+def from_local_xy(x, y, origin):
+    """Inverse of to_local_xy: (latitudes, longitudes) of plane coordinates around `origin`"""
+    lat0, lon0 = origin
+    latitudes = lat0 + np.degrees(np.asarray(y, dtype=np.float64) / EARTH_RADIUS_M)
+    longitudes = lon0 + np.degrees(np.asarray(x, dtype=np.float64) / (EARTH_RADIUS_M * np.cos(np.radians(lat0))))
+    return latitudes, longitudes
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Haversine distance in metres for a single pair of points, without NumPy overhead"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(max(a, 0.0), 1.0)))
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from common.geo import haversine
+from common.spatial import GridIndex
+import numpy as np
+import resource
+import statistics
+import time
+
+# (latitude, longitude) of a few metro areas the synthetic students are spread around
+CITIES = [(17.3850, 78.4867), (19.0760, 72.8777), (12.9716, 77.5946), (28.6139, 77.2090), (13.0827, 80.2707)]
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-process spatial index on synthetic student coordinates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=1000000, help='Number of indexed points')
+        parser.add_argument('--queries', type=int, default=1000, help='Number of queries per query type')
+        parser.add_argument('--radius', type=float, default=1000, help='Radius query size in metres')
+        parser.add_argument('--cell', type=float, default=500, help='Grid cell size in metres')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+
+    def timed(self, label, count, func):
+        durations = []
+        for i in range(count):
+            started = time.perf_counter()
+            func(i)
+            durations.append(time.perf_counter() - started)
+        durations.sort()
+        self.stdout.write(
+            f'{label:<26} p50 {statistics.median(durations) * 1000:.3f} ms, '
+            f'p99 {durations[int(len(durations) * 0.99)] * 1000:.3f} ms'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            rng = np.random.default_rng(options['seed'])
+            count = options['points']
+            centres = np.array(CITIES)[rng.integers(len(CITIES), size=count)]
+            # About 15 km of spread around each city centre
+            latitudes = centres[:, 0] + rng.normal(0, 0.07, count)
+            longitudes = centres[:, 1] + rng.normal(0, 0.07, count)
+            items = list(zip(range(count), latitudes.tolist(), longitudes.tolist()))
+
+            started = time.perf_counter()
+            index = GridIndex(cell_m=options['cell']).build(items)
+            build_time = time.perf_counter() - started
+            self.stdout.write(f'Built index of {len(index):,} points in {len(index.cells):,} cells in {build_time:.2f} s')
+
+            queries = centres[:options['queries']] + rng.normal(0, 0.05, (options['queries'], 2))
+            radius = options['radius']
+            found = []
+            self.timed(
+                f'within {radius:.0f} m', len(queries),
+                lambda i: found.append(len(index.within(queries[i, 0], queries[i, 1], radius))),
+            )
+            self.stdout.write(f'{"":<26} {statistics.mean(found):.0f} points per query on average')
+            self.timed('nearest k=1', len(queries), lambda i: index.nearest(queries[i, 0], queries[i, 1]))
+            self.timed('nearest k=10', len(queries), lambda i: index.nearest(queries[i, 0], queries[i, 1], k=10))
+
+            # Full NumPy scan for reference, and to check the index results
+            scan_count = min(20, len(queries))
+            started = time.perf_counter()
+            for i in range(scan_count):
+                distances = haversine(queries[i, 0], queries[i, 1], latitudes, longitudes)
+                expected = set(np.flatnonzero(distances <= radius).tolist())
+                actual = {key for key, _ in index.within(queries[i, 0], queries[i, 1], radius)}
+                if expected != actual:
+                    raise ValueError(f'Index and full scan disagree for query {i}')
+            self.stdout.write(f'{"full scan (reference)":<26} {(time.perf_counter() - started) / scan_count * 1000:.3f} ms per query')
+
+            moves = rng.integers(count, size=options['queries'])
+            self.timed(
+                'move (remove + insert)', len(moves),
+                lambda i: index.insert(int(moves[i]), latitudes[moves[i]] + 0.01, longitudes[moves[i]]),
+            )
+
+            self.stdout.write(f'Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB')
+            self.stdout.write(self.style.SUCCESS('Spatial index benchmark finished'))
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error benchmarking spatial index: {str(e)}')
+            )
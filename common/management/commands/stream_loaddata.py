@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from common.fixtures import BATCH_SIZE, load
+import resource
+
+class Command(BaseCommand):
+    help = 'Load JSON fixtures (e.g. datadump.json) with streaming parsing and batched inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='+', help='Fixture paths, .json optionally compressed (.gz, .bz2, .xz)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Objects queued before a write')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to load into')
+        parser.add_argument(
+            '--ignorenonexistent', '-i',
+            action='store_true',
+            help='Ignore fields of the fixtures that no longer exist on the models'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            counts, elapsed = load(
+                options['fixtures'],
+                using=options['database'],
+                batch_size=options['batch_size'],
+                ignorenonexistent=options['ignorenonexistent'],
+            )
+            for label, count in sorted(counts.items()):
+                self.stdout.write(f'{label}: {count} rows')
+
+            rows = sum(counts.values())
+            # ru_maxrss is in kilobytes on Linux
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully loaded {rows} rows in {elapsed:.2f} s '
+                    f'({rows / elapsed:,.0f} rows/s, peak memory {peak_mb:.0f} MB)'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error loading fixtures: {str(e)}'))
@@ -52,3 +52,14 @@ class AddressMixin(models.Model):
 
     class Meta:
         abstract = True
+
+
+class JobCheckpoint(models.Model):
+    # Where an incremental or resumable background job got to, one row per job
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
+    state = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
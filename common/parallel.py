@@ -0,0 +1,40 @@
+"""
+Process pool helpers for jobs sharded by an id, e.g. one School per task.
+
+Workers get their own database connections: the parent closes its
+connections before the pool starts so forked workers never share them,
+and spawned workers set Django up in init_worker. This module imports no
+models so it can be loaded by a spawned worker before Django is set up.
+"""
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def init_worker():
+    """Pool initializer: set Django up when spawned and reseed `random`, forked workers share its state"""
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+    random.seed()
+
+
+def run_sharded(function, shard_ids, args=(), workers=None):
+    """
+    Call function(shard_id, *args) for every id across `workers` processes
+    (all CPUs by default, in this process when 1). `function` must be
+    importable by the workers. Yields the results as shards finish.
+    """
+    from django.db import connections
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(shard_ids) <= 1:
+        for shard_id in shard_ids:
+            yield function(shard_id, *args)
+        return
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=min(workers, len(shard_ids)), initializer=init_worker) as pool:
+        futures = [pool.submit(function, shard_id, *args) for shard_id in shard_ids]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+
+from . import spatial
+
+
+def index_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        spatial.registry.update(instance)
+
+
+def index_deleted(sender, instance, **kwargs):
+    spatial.registry.remove(instance)
+
+
+for label in spatial.INDEXED_MODELS:
+    post_save.connect(index_saved, sender=label, dispatch_uid=f'spatial_index_saved_{label}')
+    post_delete.connect(index_deleted, sender=label, dispatch_uid=f'spatial_index_deleted_{label}')
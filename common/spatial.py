@@ -0,0 +1,230 @@
+"""
+In-process spatial index over coordinates.
+
+GridIndex buckets points into cells of roughly `cell_m` metres: rows are
+fixed bands of latitude and the column width of every row is widened by
+1/cos(latitude), so cells stay close to square away from the equator.
+Radius queries only look at the cells overlapping the query circle and
+nearest-neighbour queries widen a radius query until enough points are found.
+
+`registry` keeps one GridIndex per model of INDEXED_MODELS, built on first use
+from the database and kept current by the post_save/post_delete receivers in
+common/signals.py. Bulk writes (QuerySet.update, bulk_create) skip those
+signals, call registry.reset() afterwards. Every process has its own copy.
+"""
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.apps import apps
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .geo import EARTH_RADIUS_M, haversine
+
+INDEXED_MODELS = ('schools.Student', 'schools.School', 'accounts.Parent', 'accounts.Driver')
+DEFAULT_CELL_M = 500
+METRES_PER_DEGREE = math.radians(1) * EARTH_RADIUS_M
+HALF_CIRCUMFERENCE_M = math.pi * EARTH_RADIUS_M
+MIN_COS = 1e-6
+
+
+class GridIndex:
+    """Points keyed by an id (usually a primary key) with radius and nearest-neighbour queries"""
+
+    def __init__(self, cell_m=DEFAULT_CELL_M):
+        self.cell_m = cell_m
+        self.cell_lat = cell_m / METRES_PER_DEGREE
+        self.points = {}  # key -> (latitude, longitude)
+        self.cells = defaultdict(set)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return key in self.points
+
+    def _cell_lon(self, row):
+        return self.cell_lat / max(math.cos(math.radians((row + 0.5) * self.cell_lat)), MIN_COS)
+
+    def cell(self, latitude, longitude):
+        row = math.floor(latitude / self.cell_lat)
+        return row, math.floor(longitude / self._cell_lon(row))
+
+    def build(self, items):
+        """Replace the contents with `items`, an iterable of (key, latitude, longitude)"""
+        items = list(items)
+        self.points = {}
+        self.cells = defaultdict(set)
+        if not items:
+            return self
+        keys, latitudes, longitudes = zip(*items)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        rows = np.floor(latitudes / self.cell_lat)
+        cell_lons = self.cell_lat / np.maximum(np.cos(np.radians((rows + 0.5) * self.cell_lat)), MIN_COS)
+        columns = np.floor(longitudes / cell_lons)
+
+        self.points = dict(zip(keys, zip(latitudes.tolist(), longitudes.tolist())))
+        cells = self.cells
+        for key, row, column in zip(keys, rows.astype(np.int64).tolist(), columns.astype(np.int64).tolist()):
+            cells[(row, column)].add(key)
+        return self
+
+    def insert(self, key, latitude, longitude):
+        """Add a point, or move it if the key is already indexed"""
+        if key in self.points:
+            self.remove(key)
+        latitude, longitude = float(latitude), float(longitude)
+        self.points[key] = (latitude, longitude)
+        self.cells[self.cell(latitude, longitude)].add(key)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return False
+        row, column = self.cell(*point)
+        # A point on a cell border may have been bucketed next door by the vectorized build
+        for cell in [(row, column)] + [(row + dr, column + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]:
+            keys = self.cells.get(cell)
+            if keys and key in keys:
+                keys.discard(key)
+                if not keys:
+                    del self.cells[cell]
+                break
+        return True
+
+    def _candidate_cells(self, latitude, longitude, radius_m):
+        d_lat = radius_m / METRES_PER_DEGREE
+        widest = min(abs(latitude) + d_lat, 90.0)
+        d_lon = radius_m / (METRES_PER_DEGREE * max(math.cos(math.radians(widest)), MIN_COS))
+        if d_lon >= 180:
+            ranges = [(-180.0, 180.0)]
+        else:
+            ranges = [(longitude - d_lon, longitude + d_lon)]
+            # Wrap around the antimeridian
+            if longitude - d_lon < -180:
+                ranges.append((longitude - d_lon + 360, 180.0))
+            if longitude + d_lon > 180:
+                ranges.append((-180.0, longitude + d_lon - 360))
+
+        first_row = math.floor((latitude - d_lat) / self.cell_lat)
+        last_row = math.floor((latitude + d_lat) / self.cell_lat)
+        spans = []
+        visits = 0
+        for row in range(first_row, last_row + 1):
+            cell_lon = self._cell_lon(row)
+            for low, high in ranges:
+                span = (row, math.floor(low / cell_lon), math.floor(high / cell_lon))
+                visits += span[2] - span[1] + 1
+                spans.append(span)
+            if visits > len(self.cells):
+                # Cheaper to walk the occupied cells than the empty ones in range
+                return [
+                    cell for cell in self.cells
+                    if first_row <= cell[0] <= last_row
+                ]
+        return [(row, column) for row, low, high in spans for column in range(low, high + 1)]
+
+    def within(self, latitude, longitude, radius_m):
+        """[(key, distance in metres)] of the points within `radius_m`, nearest first"""
+        cells = self.cells
+        keys = []
+        for cell in self._candidate_cells(latitude, longitude, radius_m):
+            found = cells.get(cell)
+            if found:
+                keys.extend(found)
+        if not keys:
+            return []
+        points = self.points
+        coordinates = np.array([points[key] for key in keys], dtype=np.float64)
+        distances = haversine(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+        inside = np.flatnonzero(distances <= radius_m)
+        inside = inside[np.argsort(distances[inside], kind='stable')]
+        return [(keys[i], float(distances[i])) for i in inside.tolist()]
+
+    def nearest(self, latitude, longitude, k=1, max_distance_m=None):
+        """The `k` points closest to the position as [(key, distance in metres)]"""
+        limit = min(max_distance_m or HALF_CIRCUMFERENCE_M, HALF_CIRCUMFERENCE_M)
+        radius = min(self.cell_m, limit)
+        while True:
+            found = self.within(latitude, longitude, radius)
+            # Every point within `radius` was seen, so the first k are the true nearest
+            if len(found) >= k or radius >= limit or len(found) == len(self.points):
+                return found[:k]
+            radius = min(radius * 4, limit)
+
+
+class SpatialIndexRegistry:
+    """One lazily built GridIndex per model"""
+
+    def __init__(self, cell_m=DEFAULT_CELL_M):
+        self.cell_m = cell_m
+        self.indexes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def label(model):
+        if isinstance(model, str):
+            model = apps.get_model(model)
+        return model._meta.label
+
+    def get(self, model):
+        """GridIndex of `model` (class or 'app_label.Model'), built from the database on first use"""
+        label = self.label(model)
+        index = self.indexes.get(label)
+        if index is None:
+            with self._lock:
+                index = self.indexes.get(label)
+                if index is None:
+                    index = self.indexes[label] = GridIndex(self.cell_m).build(self.load(label))
+        return index
+
+    @staticmethod
+    def load(label):
+        rows = (
+            apps.get_model(label)._default_manager
+            .filter(latitude__isnull=False, longitude__isnull=False, is_deleted=False)
+            .annotate(lat=Cast('latitude', FloatField()), lon=Cast('longitude', FloatField()))
+            .values_list('pk', 'lat', 'lon')
+        )
+        return rows.iterator(chunk_size=10000)
+
+    def update(self, instance):
+        """Reflect a saved instance, a no-op while its index has not been built"""
+        index = self.indexes.get(instance._meta.label)
+        if index is None:
+            return
+        if instance.latitude is None or instance.longitude is None or instance.is_deleted:
+            index.remove(instance.pk)
+        else:
+            index.insert(instance.pk, instance.latitude, instance.longitude)
+
+    def remove(self, instance):
+        index = self.indexes.get(instance._meta.label)
+        if index is not None:
+            index.remove(instance.pk)
+
+    def reset(self, model=None):
+        """Drop built indexes so they are rebuilt on next use"""
+        if model is None:
+            self.indexes.clear()
+        else:
+            self.indexes.pop(self.label(model), None)
+
+
+registry = SpatialIndexRegistry()
+
+
+def get_index(model):
+    return registry.get(model)
+
+
+def within(model, latitude, longitude, radius_m):
+    """Primary keys and distances of `model` rows within `radius_m` of the position"""
+    return registry.get(model).within(float(latitude), float(longitude), radius_m)
+
+
+def nearest(model, latitude, longitude, k=1, max_distance_m=None):
+    return registry.get(model).nearest(float(latitude), float(longitude), k, max_distance_m)
@@ -1,3 +1,98 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core import serializers
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from schools.models import Route, School
+from trips.models import Trip, TripLocation
+from vehicles.models import Bus
+
+from .fixtures import iter_json_array, load
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    def items(self, text, read_size=3):
+        return list(iter_json_array(io.StringIO(text), read_size=read_size))
+
+    def test_items_split_across_reads(self):
+        items = [
+            {'model': 'a.b', 'pk': n, 'fields': {'name': 'x' * n, 'list': [n, {'nested': '],'}]}} for n in range(20)
+        ]
+        text = json.dumps(items, indent=2)
+        for read_size in (1, 2, 7, 64, len(text)):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(self.items(text, read_size), items)
+
+    def test_whitespace_and_empty_arrays(self):
+        self.assertEqual(self.items(' \n[ ] '), [])
+        self.assertEqual(self.items('[1, 2 ,\n3]'), [1, 2, 3])
+        self.assertEqual(self.items(''), [])
+
+    def test_malformed_fixtures(self):
+        with self.assertRaisesMessage(ValueError, 'must be a JSON array'):
+            self.items('{"model": "a.b"}')
+        with self.assertRaisesMessage(ValueError, 'not closed'):
+            self.items('[1, 2')
+        with self.assertRaises(ValueError):
+            self.items('[{"model": "a.b",}]')
+        with self.assertRaises(ValueError):
+            self.items('[{"model": "a.b"')
+
+
+class LoadTests(TestCase):
+    def setUp(self):
+        school = School.objects.create(
+            name='Test School', contact_number='+919999999999', email='school@example.com',
+            established_date=date(2000, 1, 1),
+        )
+        bus = Bus.objects.create(
+            registration_number='KA01AB1234', school=school, capacity=40, make='Tata', model='Starbus', year=2020,
+            fuel_type='DIESEL', insurance_expiry=date(2030, 1, 1), fitness_certificate_expiry=date(2030, 1, 1),
+        )
+        route = Route.objects.create(name='Route 1', school=school, default_bus=bus)
+        trip = Trip.objects.create(school=school, route=route, bus=bus, trip_type='PICKUP', status='COMPLETED')
+        now = timezone.now().replace(microsecond=0)  # dumps keep milliseconds
+        TripLocation.objects.bulk_create([
+            TripLocation(
+                trip=trip, latitude=Decimal('12.970000') + n, longitude=Decimal('77.590000'),
+                timestamp=now - timedelta(minutes=n),
+            )
+            for n in range(3)
+        ])
+        self.objects = [school, bus, route, trip, *TripLocation.objects.order_by('pk')]
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, objects):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as output:
+            serializers.serialize('json', objects, stream=output)
+        return path
+
+    def test_load_into_an_empty_database(self):
+        path = self.write('dump.json', self.objects)
+        rows = list(TripLocation.objects.order_by('pk').values_list('pk', 'trip_id', 'timestamp', 'latitude'))
+        School.objects.all().delete()
+        self.assertFalse(TripLocation.objects.exists())
+
+        counts, _ = load([path], batch_size=2)
+        self.assertEqual(counts['trips.TripLocation'], 3)
+        self.assertEqual(counts['schools.School'], 1)
+        self.assertEqual(
+            list(TripLocation.objects.order_by('pk').values_list('pk', 'trip_id', 'timestamp', 'latitude')), rows
+        )
+
+    def test_stored_rows_are_overwritten(self):
+        location = self.objects[-1]
+        location.latitude = Decimal('10.000000')
+        path = self.write('locations.json', [location])
+        load([path])
+        load([path])
+        self.assertEqual(TripLocation.objects.count(), 3)
+        self.assertEqual(TripLocation.objects.get(pk=location.pk).latitude, Decimal('10.000000'))
@@ -1,6 +1,11 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django import forms
-from .models import School, SchoolAdmin, Student, User, UserTypes, Route, RouteStudent
+from .models import School, SchoolAdmin, Student, User, UserTypes, Route, RouteStudent, GeocodeCache
+from .routing import optimize_route
+from common import spatial
+import re
+
+NEAR_SEARCH = re.compile(r'^near:\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)(?:\s*,\s*(\d+(?:\.\d+)?))?$')
 
 # Register your models here.
 
@@ -84,6 +89,25 @@ class RouteAdmin(admin.ModelAdmin):
     )
     
     inlines = [RouteStudentInline]
+    actions = ['optimize_stop_order']
+    
+    def optimize_stop_order(self, request, queryset):
+        saved = 0
+        for route in queryset.select_related('school'):
+            try:
+                result = optimize_route(route)
+            except ValueError as e:
+                self.message_user(request, f'{route}: {e}', messages.WARNING)
+                continue
+            saved += result['distance_saved_m']
+            if result['skipped_stops']:
+                self.message_user(
+                    request,
+                    f"{route}: {result['skipped_stops']} stops without coordinates were left at the end",
+                    messages.WARNING
+                )
+        self.message_user(request, f'Stop order optimized, {saved / 1000:.1f} km saved in total')
+    optimize_stop_order.short_description = 'Optimize stop order'
     
     def get_bus_info(self, obj):
         if obj.default_bus:
@@ -103,7 +127,16 @@ class StudentAdmin(admin.ModelAdmin):
     list_display = ('name', 'student_id', 'school', 'grade', 'section', 'guardian_name')
     list_filter = ('school', 'grade', 'section')
     search_fields = ('name', 'student_id', 'roll_number', 'guardian_name', 'guardian_phone')
+    search_help_text = 'Name, ID, roll number or guardian, or "near:<latitude>,<longitude>[,<metres>]" for students living nearby'
     
+    def get_search_results(self, request, queryset, search_term):
+        match = NEAR_SEARCH.match(search_term.strip())
+        if not match:
+            return super().get_search_results(request, queryset, search_term)
+        latitude, longitude, radius = match.groups()
+        found = spatial.within(Student, float(latitude), float(longitude), float(radius or 1000))
+        return queryset.filter(pk__in=[pk for pk, _ in found]), False
+
     fieldsets = (
         ('Basic Information', {
             'fields': ('name', 'student_id', 'roll_number', 'school', 'grade', 'section', 'date_of_birth', 'gender')
@@ -115,3 +148,10 @@ class StudentAdmin(admin.ModelAdmin):
             'fields': ('parent',)
         }),
     )
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ('normalized_address', 'latitude', 'longitude', 'provider', 'hit_count', 'last_used')
+    list_filter = ('provider',)
+    search_fields = ('normalized_address',)
+    readonly_fields = ('normalized_address', 'provider', 'hit_count', 'last_used')
@@ -0,0 +1,247 @@
+"""
+Offline geocoding of free-text addresses such as "123, Linking Road, Bandra, Mumbai".
+
+Addresses are normalized (case, accents, punctuation, common abbreviations)
+and the normalized string is the key of the persistent GeocodeCache, so only
+strings never seen before reach the provider. Misses are cached as well, and
+normalized strings longer than the cache key are resolved but not cached. The
+cache keeps at most GEOCODE_CACHE_MAX_ENTRIES rows and evicts the least
+recently used ones.
+
+The provider is pluggable through settings.GEOCODING_PROVIDER, a class with a
+`name` and a `geocode_many(normalized_addresses)` method returning
+{address: (latitude, longitude) or None}. The default GazetteerProvider
+resolves addresses against a local CSV of cities, areas and landmarks.
+"""
+import csv
+import re
+import unicodedata
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import GeocodeCache, RouteStudent
+
+DEFAULT_GAZETTEER = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+ABBREVIATIONS = {
+    'rd': 'road',
+    'ngr': 'nagar',
+    'apts': 'apartments',
+    'apt': 'apartment',
+    'blk': 'block',
+    'sec': 'sector',
+    'mkt': 'market',
+    'opp': 'opposite',
+    'nr': 'near',
+    'ext': 'extension',
+}
+KIND_RANKS = {'landmark': 0, 'area': 1, 'city': 2}  # most specific first
+MAX_NAME_TOKENS = 4
+MAX_KEY_LENGTH = GeocodeCache._meta.get_field('normalized_address').max_length
+
+
+def normalize_address(address):
+    """Lower-case ASCII words separated by single spaces, abbreviations expanded"""
+    text = unicodedata.normalize('NFKD', address or '').encode('ascii', 'ignore').decode('ascii').lower()
+    text = text.replace('&', ' and ')
+    tokens = re.findall(r'[a-z0-9]+', text)
+    return ' '.join(ABBREVIATIONS.get(token, token) for token in tokens)
+
+
+class GazetteerProvider:
+    """
+    Matches the words of an address against gazetteer names. The most
+    specific unambiguous match wins: a landmark inside a matched area or city
+    before an area, an area before a city. House numbers are not resolved.
+    """
+    name = 'gazetteer'
+
+    def __init__(self, path=None):
+        self.path = Path(path or getattr(settings, 'GEOCODING_GAZETTEER', None) or DEFAULT_GAZETTEER)
+        self.entries = {}  # normalized name -> [(kind, name, area, city, latitude, longitude)]
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                name = normalize_address(row['name'])
+                self.entries.setdefault(name, []).append((
+                    row['kind'],
+                    name,
+                    normalize_address(row['area']),
+                    normalize_address(row['city']),
+                    float(row['latitude']),
+                    float(row['longitude']),
+                ))
+
+    def matches(self, normalized_address):
+        """Gazetteer entries whose name occurs as whole words in the address"""
+        tokens = normalized_address.split()
+        found = []
+        for size in range(1, MAX_NAME_TOKENS + 1):
+            for start in range(len(tokens) - size + 1):
+                found.extend(self.entries.get(' '.join(tokens[start:start + size]), ()))
+        return found
+
+    def geocode(self, normalized_address):
+        found = self.matches(normalized_address)
+        cities = {entry[3] for entry in found if entry[0] == 'city'}
+        areas = {entry[1] for entry in found if entry[0] == 'area' and (not cities or entry[3] in cities)}
+
+        def consistent(entry):
+            kind, _, area, city = entry[:4]
+            if cities and city not in cities:
+                return False
+            return not (kind == 'landmark' and areas and area not in areas)
+
+        candidates = [entry for entry in found if consistent(entry)]
+        for kind in sorted(KIND_RANKS, key=KIND_RANKS.get):
+            coordinates = {entry[4:] for entry in candidates if entry[0] == kind}
+            if len(coordinates) == 1:
+                return coordinates.pop()
+            # No match or an ambiguous one (e.g. a landmark name in two cities): try the next level
+        return None
+
+    def geocode_many(self, normalized_addresses):
+        return {address: self.geocode(address) for address in normalized_addresses}
+
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        path = getattr(settings, 'GEOCODING_PROVIDER', 'schools.geocoding.GazetteerProvider')
+        _provider = import_string(path)()
+    return _provider
+
+
+def to_decimal(value):
+    return None if value is None else Decimal(f'{value:.6f}')
+
+
+def evict(max_entries=None):
+    """Delete the least recently used cache rows beyond `max_entries`, returns the number deleted"""
+    max_entries = max_entries or getattr(settings, 'GEOCODE_CACHE_MAX_ENTRIES', 100000)
+    if GeocodeCache.objects.count() <= max_entries:
+        return 0
+    cutoff = (
+        GeocodeCache.objects.order_by('-last_used', '-id')
+        .values_list('last_used', 'id')[max_entries:max_entries + 1]
+        .first()
+    )
+    if cutoff is None:
+        return 0
+    last_used, pk = cutoff
+    deleted, _ = GeocodeCache.objects.filter(last_used__lt=last_used).delete()
+    deleted += GeocodeCache.objects.filter(last_used=last_used, id__lte=pk).delete()[0]
+    return deleted
+
+
+def geocode_many(addresses, provider=None, max_entries=None):
+    """
+    Resolve free-text addresses in bulk, returns {address: (latitude, longitude) or None}.
+    Cached strings cost one query in total, unseen ones go to the provider in one call.
+    """
+    provider = provider or get_provider()
+    normalized = {address: normalize_address(address) for address in addresses}
+    keys = {key for key in normalized.values() if key}
+    cacheable = {key for key in keys if len(key) <= MAX_KEY_LENGTH}
+    now = timezone.now()
+
+    cached = {
+        entry.normalized_address: entry
+        for entry in GeocodeCache.objects.filter(normalized_address__in=cacheable)
+    }
+    if cached:
+        GeocodeCache.objects.filter(pk__in=[entry.pk for entry in cached.values()]).update(
+            last_used=now, hit_count=F('hit_count') + 1
+        )
+    results = {
+        key: None if entry.latitude is None else (float(entry.latitude), float(entry.longitude))
+        for key, entry in cached.items()
+    }
+
+    unseen = sorted(keys - cached.keys())
+    if unseen:
+        resolved = provider.geocode_many(unseen)
+        entries = []
+        for key in unseen:
+            if key not in cacheable:
+                continue
+            latitude, longitude = resolved.get(key) or (None, None)
+            entries.append(GeocodeCache(
+                normalized_address=key,
+                latitude=to_decimal(latitude),
+                longitude=to_decimal(longitude),
+                provider=provider.name,
+                last_used=now,
+                created_at=now,
+                updated_at=now,
+            ))
+        with transaction.atomic():
+            # Another process may have geocoded the same string meanwhile
+            GeocodeCache.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+        results.update({key: resolved.get(key) for key in unseen})
+        evict(max_entries)
+
+    return {address: results.get(key) for address, key in normalized.items()}
+
+
+def geocode(address, provider=None):
+    return geocode_many([address], provider)[address]
+
+
+def geocode_route_students(queryset, provider=None, overwrite=False):
+    """
+    Fill the pickup and drop coordinates of RouteStudents from their addresses.
+    Only missing pairs are filled unless `overwrite`, and a pair whose address
+    cannot be resolved keeps its current value either way.
+    Returns (number updated, number of addresses that could not be resolved).
+    """
+    if not overwrite:
+        queryset = queryset.filter(pickup_latitude__isnull=True) | queryset.filter(drop_latitude__isnull=True)
+    route_students = list(queryset.only(
+        'id', *(f'{kind}_{name}' for kind in ('pickup', 'drop') for name in ('address', 'latitude', 'longitude'))
+    ))
+    addresses = {rs.pickup_address for rs in route_students} | {rs.drop_address for rs in route_students}
+    resolved = geocode_many(addresses, provider)
+
+    now = timezone.now()
+    updated = []
+    for rs in route_students:
+        changed = False
+        for kind in ('pickup', 'drop'):
+            coordinates = resolved.get(getattr(rs, f'{kind}_address'))
+            if coordinates is None or not (overwrite or getattr(rs, f'{kind}_latitude') is None):
+                continue
+            setattr(rs, f'{kind}_latitude', to_decimal(coordinates[0]))
+            setattr(rs, f'{kind}_longitude', to_decimal(coordinates[1]))
+            changed = True
+        if changed:
+            rs.updated_at = now
+            updated.append(rs)
+    RouteStudent.objects.bulk_update(
+        updated,
+        ['pickup_latitude', 'pickup_longitude', 'drop_latitude', 'drop_longitude', 'updated_at'],
+        batch_size=1000,
+    )
+    unresolved = sum(1 for address in addresses if resolved.get(address) is None)
+    return len(updated), unresolved
+
+
+def stop_coordinate_expressions(trip_type, prefix=''):
+    """
+    (latitude, longitude) query expressions for the stop of a RouteStudent,
+    reached through `prefix` (e.g. 'route_student__'): the geocoded pickup or
+    drop address for the trip type, the student's home otherwise.
+    """
+    kind = 'drop' if trip_type == 'DROP' else 'pickup'
+    return (
+        Coalesce(f'{prefix}{kind}_latitude', f'{prefix}student__latitude'),
+        Coalesce(f'{prefix}{kind}_longitude', f'{prefix}student__longitude'),
+    )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from schools.geocoding import evict, geocode_route_students
+from schools.models import GeocodeCache, RouteStudent
+import time
+
+class Command(BaseCommand):
+    help = 'Resolve RouteStudent pickup and drop addresses to coordinates through the geocoding cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, help='Only geocode stops of the given school')
+        parser.add_argument('--overwrite', action='store_true', help='Also re-resolve stops that already have coordinates')
+        parser.add_argument(
+            '--retry-misses',
+            action='store_true',
+            help='Forget cached misses first, e.g. after the gazetteer was extended'
+        )
+
+    def handle(self, *args, **options):
+        route_students = RouteStudent.objects.all()
+        if options['school']:
+            route_students = route_students.filter(route__school_id=options['school'])
+
+        try:
+            if options['retry_misses']:
+                forgotten, _ = GeocodeCache.objects.filter(latitude__isnull=True).delete()
+                self.stdout.write(f'Forgot {forgotten} cached misses')
+
+            started = time.perf_counter()
+            updated, unresolved = geocode_route_students(route_students, overwrite=options['overwrite'])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully geocoded {updated} route stops in {time.perf_counter() - started:.2f} s'
+                )
+            )
+            if unresolved:
+                self.stdout.write(self.style.WARNING(f'{unresolved} addresses could not be resolved'))
+            evicted = evict()
+            if evicted:
+                self.stdout.write(f'Evicted {evicted} least recently used cache entries')
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error geocoding route stops: {str(e)}')
+            )
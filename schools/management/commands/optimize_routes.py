@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from schools.models import Route
+from schools.routing import optimize_route
+import time
+
+class Command(BaseCommand):
+    help = 'Reorder route stops to minimise the distance driven between the students and the school'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', type=int, action='append', help='Only optimize the given route (repeatable)')
+        parser.add_argument('--school', type=int, help='Only optimize routes of the given school')
+        parser.add_argument(
+            '--school-at',
+            choices=['start', 'end'],
+            default='end',
+            help='Whether the school is the first stop (drop-off) or the last (pick-up)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report the savings without saving')
+
+    def handle(self, *args, **options):
+        routes = Route.objects.select_related('school').order_by('id')
+        if options['route']:
+            routes = routes.filter(pk__in=options['route'])
+        if options['school']:
+            routes = routes.filter(school_id=options['school'])
+
+        optimized = before = after = 0
+        try:
+            for route in routes:
+                started = time.perf_counter()
+                try:
+                    result = optimize_route(route, school_at=options['school_at'], save=not options['dry_run'])
+                except ValueError as e:
+                    self.stdout.write(self.style.WARNING(f'Skipped {route}: {e}'))
+                    continue
+                elapsed = (time.perf_counter() - started) * 1000
+
+                optimized += 1
+                before += result['distance_before_m']
+                after += result['distance_after_m']
+                message = (
+                    f"{route}: {result['optimized_stops']} stops, "
+                    f"{result['distance_before_m'] / 1000:.2f} -> {result['distance_after_m'] / 1000:.2f} km "
+                    f"({result['distance_saved_m'] / 1000:.2f} km saved) in {elapsed:.0f} ms"
+                )
+                if result['skipped_stops']:
+                    message += f", {result['skipped_stops']} stops without coordinates left at the end"
+                self.stdout.write(message)
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully optimized {optimized} routes: {before / 1000:.1f} -> {after / 1000:.1f} km '
+                    f'({(before - after) / 1000:.1f} km saved)'
+                    + (' (dry run, nothing saved)' if options['dry_run'] else '')
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error optimizing routes: {str(e)}')
+            )
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from schools.models import School
+from schools.planning import create_routes, plan_routes
+import time
+
+class Command(BaseCommand):
+    help = "Partition a school's students into capacity-constrained routes and create them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, action='append', help='School to plan (repeatable, default: all)')
+        parser.add_argument('--method', choices=['sweep', 'kmeans'], default='kmeans', help='Partitioning method')
+        parser.add_argument('--replace', action='store_true', help="Delete the school's existing routes first, routes with trips are retired instead")
+        parser.add_argument('--prefix', default='Planned Route', help='Name prefix of the created routes')
+        parser.add_argument('--no-optimize', action='store_true', help='Keep stops in assignment order')
+        parser.add_argument('--dry-run', action='store_true', help='Print the plan without creating routes')
+
+    def handle(self, *args, **options):
+        schools = School.objects.order_by('id')
+        if options['school']:
+            schools = schools.filter(pk__in=options['school'])
+
+        total_routes = 0
+        try:
+            for school in schools:
+                started = time.perf_counter()
+                try:
+                    plans, unlocated = plan_routes(school, options['method'], optimize=not options['no_optimize'])
+                except ValueError as e:
+                    self.stdout.write(self.style.WARNING(f'Skipped {school.name}: {e}'))
+                    continue
+                if not plans:
+                    self.stdout.write(self.style.WARNING(f'Skipped {school.name}: no students with coordinates'))
+                    continue
+                if not options['dry_run']:
+                    create_routes(school, plans, options['prefix'], replace=options['replace'])
+                total_routes += len(plans)
+
+                students = sum(len(plan['students']) for plan in plans)
+                distance = sum(plan['distance_m'] for plan in plans) / 1000
+                self.stdout.write(
+                    f'{school.name}: {students} students in {len(plans)} routes, {distance:.1f} km in total '
+                    f'({time.perf_counter() - started:.2f} s)'
+                )
+                for plan in plans:
+                    self.stdout.write(
+                        f"  {plan['bus'].registration_number}: {len(plan['students'])}/{plan['bus'].capacity} students, "
+                        f"{plan['distance_m'] / 1000:.1f} km"
+                    )
+                if unlocated:
+                    self.stdout.write(self.style.WARNING(f'  {len(unlocated)} students without coordinates were left out'))
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully planned {total_routes} routes'
+                    + (' (dry run, nothing saved)' if options['dry_run'] else '')
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error planning routes: {str(e)}')
+            )
@@ -1,5 +1,6 @@
 from django.db import models
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from accounts.models import User, UserTypes
 from common.models import AddressMixin, BaseMixin
 from vehicles.models import Bus
@@ -163,8 +164,31 @@ class RouteStudent(BaseMixin):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     pickup_address = models.TextField()
     drop_address = models.TextField()
+    # Resolved from the addresses by schools.geocoding
+    pickup_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    pickup_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    drop_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    drop_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     sequence_number = models.PositiveIntegerField()
 
     class Meta:
         unique_together = ['route', 'student']
         ordering = ['sequence_number']
+
+
+class GeocodeCache(BaseMixin):
+    # Normalized address -> coordinates, see schools.geocoding. Misses are kept with no coordinates
+    normalized_address = models.CharField(max_length=500, unique=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    provider = models.CharField(max_length=100)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+    hit_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Geocode cache entry'
+        verbose_name_plural = 'Geocode cache entries'
+        ordering = ['-last_used']
+
+    def __str__(self):
+        return self.normalized_address
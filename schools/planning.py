@@ -0,0 +1,225 @@
+"""
+Automatic route planning: split the students of a school into routes that
+each fit in an ACTIVE bus, then order every route's stops (schools.routing).
+
+The sweep method sorts students by their bearing from the school, starting
+after the widest empty sector, and cuts the sequence into routes sized by
+bus capacity. The kmeans method starts from the sweep and runs a capacity
+constrained k-means: every round students are handed to their nearest
+centroid that still has room, those with most to lose by waiting first.
+
+Routes are sized to the buses largest first. When the school needs more
+routes than it has buses, buses are reused for several routes (runs).
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from common.geo import to_local_xy
+from vehicles.models import Bus
+
+from .models import Route, RouteStudent, Student
+from .routing import distance_matrix, optimize_order, path_length
+
+KMEANS_ITERATIONS = 20
+
+
+def route_sizes(count, capacities):
+    """
+    Number of students per route: as few routes as the capacities (largest
+    first, cycled) allow, with the load spread evenly over them
+    """
+    capacities = sorted(capacities, reverse=True)
+    if not capacities or capacities[0] <= 0:
+        raise ValueError('No ACTIVE bus with a capacity')
+    routes = []
+    while sum(routes) < count:
+        routes.append(capacities[len(routes) % len(capacities)])
+    routes = np.array(routes)
+    sizes = np.floor(routes * count / routes.sum()).astype(int)
+    # Hand out the remainder to the routes with the most room left
+    for index in np.argsort(sizes - routes)[:count - sizes.sum()]:
+        sizes[index] += 1
+    return routes, sizes
+
+
+def sweep(x, y, sizes):
+    """Route index per student, routes are consecutive sectors around the origin"""
+    angles = np.arctan2(y, x)
+    order = np.argsort(angles, kind='stable')
+    if len(order) > 1:
+        sorted_angles = angles[order]
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+        order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+    labels = np.empty(len(x), dtype=int)
+    labels[order] = np.repeat(np.arange(len(sizes)), sizes)
+    return labels
+
+
+def assign_with_capacity(distances, capacities):
+    """Nearest cluster with room for each point, points that lose most by waiting go first"""
+    preferences = np.argsort(distances, axis=1)
+    ranked = np.take_along_axis(distances, preferences, axis=1)
+    regret = ranked[:, 1] - ranked[:, 0] if distances.shape[1] > 1 else -ranked[:, 0]
+    room = np.array(capacities, dtype=int)
+    labels = np.empty(len(distances), dtype=int)
+    for point in np.argsort(-regret, kind='stable').tolist():
+        for cluster in preferences[point].tolist():
+            if room[cluster] > 0:
+                room[cluster] -= 1
+                labels[point] = cluster
+                break
+    return labels
+
+
+def capacity_kmeans(x, y, labels, capacities, iterations=KMEANS_ITERATIONS):
+    """Refine `labels` with k-means where cluster i never holds more than capacities[i] points"""
+    k = len(capacities)
+    centres_x = np.zeros(k)
+    centres_y = np.zeros(k)
+    for _ in range(iterations):
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        centres_x[filled] = np.bincount(labels, weights=x, minlength=k)[filled] / counts[filled]
+        centres_y[filled] = np.bincount(labels, weights=y, minlength=k)[filled] / counts[filled]
+        distances = np.hypot(x[:, None] - centres_x[None, :], y[:, None] - centres_y[None, :])
+        new_labels = assign_with_capacity(distances, capacities)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+def partition(x, y, capacities, method='kmeans'):
+    """
+    Split points (metres around the school) into routes. Returns (labels,
+    route capacities), labels[i] is the route of point i.
+    """
+    route_capacities, sizes = route_sizes(len(x), capacities)
+    labels = sweep(x, y, sizes)
+    if method == 'kmeans':
+        labels = capacity_kmeans(x, y, labels, route_capacities)
+    return labels, route_capacities
+
+
+def plan_routes(school, method='kmeans', optimize=True, school_at='end'):
+    """
+    Plan routes for the students of `school` that have coordinates. Returns
+    (plans, students without coordinates) where each plan is a dict with the
+    bus, the ordered students and the route length in metres.
+    """
+    if school.latitude is None or school.longitude is None:
+        raise ValueError(f'School {school.name} has no coordinates')
+    buses = list(Bus.objects.filter(school=school, status='ACTIVE', capacity__gt=0).order_by('-capacity', 'id'))
+    if not buses:
+        raise ValueError(f'School {school.name} has no ACTIVE bus')
+
+    students = list(
+        Student.objects.filter(school=school, is_deleted=False)
+        .only('id', 'name', 'address', 'city', 'latitude', 'longitude')
+        .order_by('id')
+    )
+    located = [s for s in students if s.latitude is not None and s.longitude is not None]
+    unlocated = [s for s in students if s.latitude is None or s.longitude is None]
+    if not located:
+        return [], unlocated
+
+    origin = (float(school.latitude), float(school.longitude))
+    latitudes = np.array([float(s.latitude) for s in located])
+    longitudes = np.array([float(s.longitude) for s in located])
+    x, y = to_local_xy(latitudes, longitudes, origin=origin)
+    labels, route_capacities = partition(x, y, [bus.capacity for bus in buses], method)
+
+    plans = []
+    for route_index in range(len(route_capacities)):
+        members = np.flatnonzero(labels == route_index)
+        if not len(members):
+            continue
+        matrix = distance_matrix(
+            np.append(origin[0], latitudes[members]),
+            np.append(origin[1], longitudes[members]),
+        )
+        order = optimize_order(matrix) if optimize else list(range(len(matrix)))
+        stops = [located[members[node - 1]] for node in order[1:]]
+        if school_at == 'end':
+            stops.reverse()
+        plans.append({
+            'bus': buses[route_index % len(buses)],
+            'students': stops,
+            'distance_m': path_length(matrix, order),
+        })
+    return plans, unlocated
+
+
+def retire_routes(school, now):
+    from trips.models import Trip, TripTemplate
+    routes = Route.objects.filter(school=school, is_deleted=False)
+    used = Q(pk__in=Trip.objects.filter(school=school).values('route_id')) | Q(
+        pk__in=TripTemplate.objects.filter(school=school).values('route_id')
+    )
+    TripTemplate.objects.filter(route__in=routes.filter(used)).update(is_active=False, updated_at=now)
+    routes.filter(used).update(is_active=False, is_deleted=True, updated_at=now)
+    routes.exclude(used).delete()
+
+
+def create_routes(school, plans, name_prefix='Planned Route', replace=False):
+    """
+    Write planned routes and their stops with two bulk inserts, returns the
+    Routes. With `replace` the school's current routes are deleted, except
+    those with trips or trip templates: they are retired (is_active and
+    is_deleted) so trip history stays and no new trips are planned on them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if replace:
+            retire_routes(school, now)
+        taken = set(Route.objects.filter(school=school).values_list('name', flat=True))
+        names = []
+        number = 1
+        while len(names) < len(plans):
+            name = f'{name_prefix} {number}'
+            if name not in taken:
+                names.append(name)
+            number += 1
+
+        routes = Route.objects.bulk_create([
+            Route(name=name, school=school, default_bus=plan['bus'], created_at=now, updated_at=now)
+            for name, plan in zip(names, plans)
+        ])
+        stops = []
+        for route, plan in zip(routes, plans):
+            for sequence, student in enumerate(plan['students'], start=1):
+                address = ', '.join(part for part in (student.address, student.city) if part)
+                stops.append(RouteStudent(
+                    route=route,
+                    student=student,
+                    sequence_number=sequence,
+                    pickup_address=address,
+                    drop_address=address,
+                    # The stop is the home the route was planned for
+                    pickup_latitude=student.latitude,
+                    pickup_longitude=student.longitude,
+                    drop_latitude=student.latitude,
+                    drop_longitude=student.longitude,
+                    created_at=now,
+                    updated_at=now,
+                ))
+        RouteStudent.objects.bulk_create(stops, batch_size=1000)
+    return routes
+
+
+def plan_as_dict(plans, unlocated):
+    return {
+        'routes': [
+            {
+                'bus': plan['bus'].pk,
+                'bus_registration_number': plan['bus'].registration_number,
+                'capacity': plan['bus'].capacity,
+                'students': [student.pk for student in plan['students']],
+                'distance_km': round(plan['distance_m'] / 1000, 2),
+            }
+            for plan in plans
+        ],
+        'students_without_coordinates': [student.pk for student in unlocated],
+    }
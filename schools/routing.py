@@ -0,0 +1,199 @@
+"""
+Stop order optimization for routes.
+
+The stops of a route and its school form a distance matrix (great-circle
+metres, computed once). A nearest-neighbour tour from the school is improved
+with 2-opt (reverse a stretch of stops) and Or-opt (move a run of up to three
+stops elsewhere, either way round) until neither finds a shorter route. Both
+moves evaluate all candidate positions for a stop at once with NumPy.
+
+Routes are open paths: the bus starts at the school for drop-offs and ends
+there for pick-ups. Distances are symmetric, so the order is optimized from
+the school outwards and reversed when the school is the last stop.
+"""
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from common.geo import haversine
+
+from .models import RouteStudent
+
+MAX_SEGMENT = 3  # longest run of stops Or-opt moves at once
+EPSILON = 1e-6
+
+
+def distance_matrix(latitudes, longitudes):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    return haversine(latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :])
+
+
+def path_length(matrix, order):
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def nearest_neighbour(matrix, start=0):
+    """Greedy path from `start` through every node"""
+    n = len(matrix)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    order = [start]
+    for _ in range(n - 1):
+        distances = np.where(visited, np.inf, matrix[order[-1]])
+        node = int(np.argmin(distances))
+        visited[node] = True
+        order.append(node)
+    return order
+
+
+def two_opt(matrix, order):
+    """Reverse stretches of the path while that shortens it, order[0] stays first"""
+    order = np.asarray(order)
+    n = len(order)
+    improved = False
+    changed = True
+    while changed:
+        changed = False
+        for i in range(1, n - 1):
+            a, b = order[i - 1], order[i]
+            # Reverse order[i..j] for every j > i at once; the path end (j = n-1) has no successor
+            c = order[i + 1:]
+            e = np.append(order[i + 2:], -1)
+            has_e = e >= 0
+            new_tail = np.where(has_e, matrix[b, np.maximum(e, 0)], 0.0)
+            old_tail = np.where(has_e, matrix[c, np.maximum(e, 0)], 0.0)
+            delta = matrix[a, c] + new_tail - matrix[a, b] - old_tail
+            j = int(np.argmin(delta))
+            if delta[j] < -EPSILON:
+                j += i + 1
+                order[i:j + 1] = order[i:j + 1][::-1].copy()
+                changed = improved = True
+    return order.tolist(), improved
+
+
+def or_opt(matrix, order):
+    """Move runs of up to MAX_SEGMENT stops to a better place in the path"""
+    order = list(order)
+    improved = False
+    changed = True
+    while changed:
+        changed = False
+        for length in range(1, MAX_SEGMENT + 1):
+            i = 1
+            while i + length <= len(order):
+                segment = order[i:i + length]
+                prev = order[i - 1]
+                nxt = order[i + length] if i + length < len(order) else None
+                removed_gain = matrix[prev, segment[0]] + (
+                    matrix[segment[-1], nxt] - matrix[prev, nxt] if nxt is not None else 0.0
+                )
+                rest = np.array(order[:i] + order[i + length:])
+                # Insert between rest[k] and rest[k + 1] (or after the last stop), both orientations
+                left = rest
+                right = np.append(rest[1:], -1)
+                has_right = right >= 0
+                safe_right = np.maximum(right, 0)
+                gap = np.where(has_right, matrix[left, safe_right], 0.0)
+                forward = matrix[left, segment[0]] + np.where(has_right, matrix[segment[-1], safe_right], 0.0) - gap
+                backward = matrix[left, segment[-1]] + np.where(has_right, matrix[segment[0], safe_right], 0.0) - gap
+                forward[i - 1] = backward[i - 1] = np.inf  # the current position
+                k = int(np.argmin(np.minimum(forward, backward)))
+                cost = min(forward[k], backward[k])
+                if cost < removed_gain - EPSILON:
+                    moved = segment if forward[k] <= backward[k] else segment[::-1]
+                    rest = rest.tolist()
+                    order = rest[:k + 1] + moved + rest[k + 1:]
+                    changed = improved = True
+                else:
+                    i += 1
+    return order, improved
+
+
+def optimize_order(matrix, start=0):
+    """Shortest path found from `start` through all nodes of `matrix`, as a list of node indexes"""
+    if len(matrix) <= 2:
+        return list(range(len(matrix)))
+    order = nearest_neighbour(matrix, start)
+    while True:
+        order, _ = two_opt(matrix, order)
+        order, moved_any = or_opt(matrix, order)
+        if not moved_any:
+            return order
+
+
+def route_stops(route):
+    """RouteStudents of a route in current sequence order"""
+    return list(
+        RouteStudent.objects.filter(route=route)
+        .select_related('student')
+        .order_by('sequence_number', 'id')
+    )
+
+
+def stop_coordinates(route_student, school_at='end'):
+    """Geocoded pickup (school last) or drop (school first) address, else the student's home"""
+    kind = 'pickup' if school_at == 'end' else 'drop'
+    latitude = getattr(route_student, f'{kind}_latitude')
+    longitude = getattr(route_student, f'{kind}_longitude')
+    if latitude is None or longitude is None:
+        latitude, longitude = route_student.student.latitude, route_student.student.longitude
+    if latitude is None or longitude is None:
+        return None
+    return float(latitude), float(longitude)
+
+
+def optimize_route(route, school_at='end', save=True):
+    """
+    Reorder the stops of `route` and write the new sequence numbers.
+    Stops without coordinates keep their relative order after the optimized ones.
+    Returns a summary dict with the distance before and after in metres.
+    """
+    school = route.school
+    if school.latitude is None or school.longitude is None:
+        raise ValueError(f'School {school.name} has no coordinates')
+
+    stops = route_stops(route)
+    located = [(stop, stop_coordinates(stop, school_at)) for stop in stops]
+    unlocated = [stop for stop, coordinates in located if coordinates is None]
+    located = [(stop, coordinates) for stop, coordinates in located if coordinates is not None]
+
+    latitudes = [float(school.latitude)] + [coordinates[0] for _, coordinates in located]
+    longitudes = [float(school.longitude)] + [coordinates[1] for _, coordinates in located]
+    matrix = distance_matrix(latitudes, longitudes)
+
+    # The current path as seen from the school
+    current = list(range(len(latitudes)))
+    if school_at == 'end':
+        current = [0] + current[:0:-1]
+    order = optimize_order(matrix)
+    before = path_length(matrix, current)
+    after = path_length(matrix, order)
+    if after >= before:
+        order, after = current, before
+
+    ordered = [located[node - 1][0] for node in order[1:]]
+    if school_at == 'end':
+        ordered.reverse()
+    ordered += unlocated
+
+    changed = [stop for number, stop in enumerate(ordered, start=1) if stop.sequence_number != number]
+    if save and changed:
+        now = timezone.now()
+        for number, stop in enumerate(ordered, start=1):
+            stop.sequence_number = number
+            stop.updated_at = now
+        with transaction.atomic():
+            RouteStudent.objects.bulk_update(changed, ['sequence_number', 'updated_at'])
+
+    return {
+        'route': route.pk,
+        'stops': len(stops),
+        'optimized_stops': len(located),
+        'skipped_stops': len(unlocated),
+        'reordered': len(changed),
+        'distance_before_m': round(before, 1),
+        'distance_after_m': round(after, 1),
+        'distance_saved_m': round(before - after, 1),
+    }
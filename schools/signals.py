@@ -0,0 +1,44 @@
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .geocoding import geocode_many, to_decimal
+from .models import RouteStudent
+
+STOP_KINDS = ('pickup', 'drop')
+
+
+@receiver(pre_save, sender=RouteStudent)
+def geocode_stop_addresses(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Geocode a stop address when it is new or changed, or has no coordinates
+    yet, cached addresses cost one query. Coordinates set by hand, with or
+    without a new address, are kept.
+    """
+    if raw or update_fields is not None:
+        return  # partial saves would not write the coordinates anyway
+    columns = [f'{kind}_{name}' for kind in STOP_KINDS for name in ('address', 'latitude', 'longitude')]
+    stored = None
+    if instance.pk is not None:
+        stored = RouteStudent.objects.filter(pk=instance.pk).values(*columns).first()
+
+    pending = []
+    for kind in STOP_KINDS:
+        address = getattr(instance, f'{kind}_address')
+        coordinates = (getattr(instance, f'{kind}_latitude'), getattr(instance, f'{kind}_longitude'))
+        if None in coordinates:
+            pending.append(kind)
+            continue
+        if stored is None:
+            continue  # a new stop created with its coordinates
+        address_changed = stored[f'{kind}_address'] != address
+        coordinates_changed = (stored[f'{kind}_latitude'], stored[f'{kind}_longitude']) != coordinates
+        if address_changed and not coordinates_changed:
+            pending.append(kind)
+    if not pending:
+        return
+
+    resolved = geocode_many([getattr(instance, f'{kind}_address') for kind in pending])
+    for kind in pending:
+        latitude, longitude = resolved[getattr(instance, f'{kind}_address')] or (None, None)
+        setattr(instance, f'{kind}_latitude', to_decimal(latitude))
+        setattr(instance, f'{kind}_longitude', to_decimal(longitude))
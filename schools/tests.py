@@ -1,3 +1,227 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import Client, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from accounts.models import User, UserTypes
+from trips.models import Trip
+from vehicles.models import Bus
+
+from .geocoding import GazetteerProvider, geocode_many, geocode_route_students, normalize_address
+from .models import GeocodeCache, Route, RouteStudent, School, Student
+from .planning import create_routes
+
+
+class CountingProvider(GazetteerProvider):
+    """Bundled gazetteer that records which addresses it was asked for"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def geocode_many(self, normalized_addresses):
+        self.calls.append(list(normalized_addresses))
+        return super().geocode_many(normalized_addresses)
+
+
+class NormalizeAddressTests(SimpleTestCase):
+    def test_case_punctuation_and_spacing(self):
+        self.assertEqual(normalize_address('  123, Linking Rd.,  BANDRA - Mumbai '), '123 linking road bandra mumbai')
+
+    def test_accents_are_stripped(self):
+        self.assertEqual(normalize_address('Café Road'), 'cafe road')
+
+    def test_empty(self):
+        self.assertEqual(normalize_address(None), '')
+
+
+class GazetteerProviderTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.provider = GazetteerProvider()
+
+    def geocode(self, address):
+        return self.provider.geocode(normalize_address(address))
+
+    def test_landmark(self):
+        self.assertEqual(self.geocode('123, Linking Road, Bandra, Mumbai'), (19.065, 72.834))
+
+    def test_landmark_disambiguated_by_area(self):
+        self.assertEqual(self.geocode('5, Defence Colony, South Ex, Delhi'), (28.573, 77.232))
+        self.assertEqual(self.geocode('5, Defence Colony, Indiranagar, Bangalore'), (12.978, 77.646))
+
+    def test_landmark_disambiguated_by_city_alias(self):
+        self.assertEqual(self.geocode('Defence Colony, Bengaluru'), (12.978, 77.646))
+
+    def test_unknown_landmark_falls_back_to_area(self):
+        self.assertEqual(self.geocode('7, Unknown Lane, Powai, Mumbai'), (19.1176, 72.906))
+
+    def test_ambiguous_landmark_without_context(self):
+        self.assertIsNone(self.geocode('Defence Colony'))
+
+    def test_unknown_address(self):
+        self.assertIsNone(self.geocode('1 Main Street, Springfield'))
+
+
+class GeocodeCacheTests(TestCase):
+    def setUp(self):
+        self.provider = CountingProvider()
+
+    def test_only_unseen_addresses_reach_the_provider(self):
+        first = geocode_many(['1, IIT Bombay, Powai, Mumbai', 'Nowhere'], self.provider)
+        self.assertEqual(first['1, IIT Bombay, Powai, Mumbai'], (19.1334, 72.9133))
+        self.assertIsNone(first['Nowhere'])
+
+        # Same normalized strings plus one new address
+        second = geocode_many(['1,  iit bombay, POWAI, Mumbai', 'nowhere', 'Carter Road, Bandra, Mumbai'], self.provider)
+        self.assertEqual(second['1,  iit bombay, POWAI, Mumbai'], (19.1334, 72.9133))
+        self.assertIsNone(second['nowhere'])
+        self.assertEqual(self.provider.calls, [
+            ['1 iit bombay powai mumbai', 'nowhere'],
+            ['carter road bandra mumbai'],
+        ])
+        self.assertEqual(GeocodeCache.objects.get(normalized_address='nowhere').hit_count, 1)
+
+    def test_addresses_longer_than_the_key_are_not_cached(self):
+        address = 'Carter Road, Bandra, Mumbai ' + 'x' * 500
+        for _ in range(2):
+            self.assertEqual(geocode_many([address], self.provider)[address], (19.068, 72.822))
+        self.assertEqual(len(self.provider.calls), 2)
+        self.assertFalse(GeocodeCache.objects.exists())
+
+    def test_least_recently_used_entries_are_evicted(self):
+        geocode_many(['Powai, Mumbai'], self.provider, max_entries=2)
+        geocode_many(['Bandra, Mumbai'], self.provider, max_entries=2)
+        geocode_many(['Powai, Mumbai'], self.provider, max_entries=2)  # now the most recently used
+        geocode_many(['Dwarka, Delhi'], self.provider, max_entries=2)
+        self.assertEqual(
+            set(GeocodeCache.objects.values_list('normalized_address', flat=True)),
+            {'powai mumbai', 'dwarka delhi'},
+        )
+
+
+class RouteStopGeocodingTests(TestCase):
+    def setUp(self):
+        school = School.objects.create(
+            name='Test School', contact_number='+919999999999', email='school@example.com',
+            established_date=date(2000, 1, 1),
+        )
+        self.student = Student.objects.create(
+            school=school, roll_number='1', student_id='S1', name='Test Student', grade='5', section='A',
+            date_of_birth=date(2015, 1, 1), gender='F', guardian_name='Guardian', guardian_relation='Mother',
+            guardian_phone='+919999999998',
+        )
+        self.route = Route.objects.create(name='Route 1', school=school)
+
+    def test_saving_a_stop_geocodes_its_addresses(self):
+        stop = RouteStudent.objects.create(
+            route=self.route, student=self.student, sequence_number=1,
+            pickup_address='12, Forum Mall, Koramangala, Bangalore', drop_address='Unknown place',
+        )
+        stop.refresh_from_db()
+        self.assertEqual((float(stop.pickup_latitude), float(stop.pickup_longitude)), (12.9345, 77.6112))
+        self.assertIsNone(stop.drop_latitude)
+
+    def test_manual_coordinates_survive_a_save(self):
+        stop = RouteStudent.objects.create(
+            route=self.route, student=self.student, sequence_number=1,
+            pickup_address='12, Forum Mall, Koramangala, Bangalore', drop_address='Unknown place',
+        )
+        stop.pickup_latitude, stop.pickup_longitude = Decimal('12.935000'), Decimal('77.612500')
+        stop.drop_latitude, stop.drop_longitude = Decimal('12.940000'), Decimal('77.620000')
+        stop.save()
+        stop.sequence_number = 2
+        stop.save()
+        stop.refresh_from_db()
+        self.assertEqual((stop.pickup_latitude, stop.pickup_longitude), (Decimal('12.935000'), Decimal('77.612500')))
+        self.assertEqual((stop.drop_latitude, stop.drop_longitude), (Decimal('12.940000'), Decimal('77.620000')))
+
+    def test_changed_address_is_geocoded_again(self):
+        stop = RouteStudent.objects.create(
+            route=self.route, student=self.student, sequence_number=1,
+            pickup_address='12, Forum Mall, Koramangala, Bangalore', drop_address='Unknown place',
+        )
+        stop.pickup_address = 'ITPL, Whitefield, Bangalore'
+        stop.save()
+        stop.refresh_from_db()
+        self.assertNotEqual((float(stop.pickup_latitude), float(stop.pickup_longitude)), (12.9345, 77.6112))
+        self.assertIsNotNone(stop.pickup_latitude)
+
+    def test_bulk_geocoding(self):
+        RouteStudent.objects.bulk_create([RouteStudent(
+            route=self.route, student=self.student, sequence_number=1,
+            pickup_address='ITPL, Whitefield, Bangalore', drop_address='Hope Farm, Whitefield, Bangalore',
+        )])
+        updated, unresolved = geocode_route_students(RouteStudent.objects.all())
+        self.assertEqual((updated, unresolved), (1, 0))
+        stop = RouteStudent.objects.get()
+        self.assertEqual(float(stop.drop_latitude), 12.983)
+
+    def test_bulk_geocoding_fills_only_missing_pairs(self):
+        RouteStudent.objects.bulk_create([RouteStudent(
+            route=self.route, student=self.student, sequence_number=1,
+            pickup_address='ITPL, Whitefield, Bangalore', drop_address='Unknown place',
+            pickup_latitude=Decimal('12.900000'), pickup_longitude=Decimal('77.700000'),
+            drop_latitude=Decimal('12.940000'), drop_longitude=Decimal('77.620000'),
+        )])
+        self.assertEqual(geocode_route_students(RouteStudent.objects.all(), overwrite=True), (1, 1))
+        stop = RouteStudent.objects.get()
+        self.assertNotEqual(stop.pickup_latitude, Decimal('12.900000'))
+        self.assertEqual((stop.drop_latitude, stop.drop_longitude), (Decimal('12.940000'), Decimal('77.620000')))
+
+        RouteStudent.objects.update(pickup_latitude=Decimal('12.900000'), drop_latitude=None, drop_longitude=None)
+        self.assertEqual(geocode_route_students(RouteStudent.objects.all()), (0, 1))
+        stop = RouteStudent.objects.get()
+        self.assertEqual((stop.pickup_latitude, stop.drop_latitude), (Decimal('12.900000'), None))
+
+
+class PlanRoutesViewTests(TestCase):
+    def test_session_requests_need_the_csrf_token(self):
+        school = School.objects.create(
+            name='Test School', contact_number='+919999999999', email='school@example.com',
+            established_date=date(2000, 1, 1),
+        )
+        user = User.objects.create_user(
+            email='admin@example.com', phone='+919999999990', password='secret', user_type=UserTypes.ADMIN,
+            is_staff=True,
+        )
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(user)
+        url = reverse('schools:plan_routes', args=[school.pk])
+        self.assertEqual(client.post(url, '{}', content_type='application/json').status_code, 403)
+
+        token = 'x' * 32  # CSRF_SECRET_LENGTH
+        client.cookies['csrftoken'] = token
+        response = client.post(url, '{}', content_type='application/json', HTTP_X_CSRFTOKEN=token)
+        self.assertNotEqual(response.status_code, 403)  # past the CSRF check, on to planning
+
+
+class CreateRoutesTests(TestCase):
+    def test_replanning_keeps_trip_history(self):
+        school = School.objects.create(
+            name='Test School', contact_number='+919999999999', email='school@example.com',
+            established_date=date(2000, 1, 1),
+        )
+        student = Student.objects.create(
+            school=school, roll_number='1', student_id='S1', name='Test Student', grade='5', section='A',
+            date_of_birth=date(2015, 1, 1), gender='F', guardian_name='Guardian', guardian_relation='Mother',
+            guardian_phone='+919999999998', latitude=Decimal('12.970000'), longitude=Decimal('77.590000'),
+        )
+        bus = Bus.objects.create(
+            registration_number='KA01AB1234', school=school, capacity=40, make='Tata', model='Starbus', year=2020,
+            fuel_type='DIESEL', insurance_expiry=date(2030, 1, 1), fitness_certificate_expiry=date(2030, 1, 1),
+        )
+        driven = Route.objects.create(name='Route 1', school=school, default_bus=bus)
+        unused = Route.objects.create(name='Route 2', school=school, default_bus=bus)
+        trip = Trip.objects.create(school=school, route=driven, bus=bus, trip_type='PICKUP', status='COMPLETED')
+
+        plans = [{'bus': bus, 'students': [student], 'distance_m': 0.0}]
+        routes = create_routes(school, plans, replace=True)
+
+        self.assertTrue(Trip.objects.filter(pk=trip.pk).exists())
+        driven.refresh_from_db()
+        self.assertEqual((driven.is_active, driven.is_deleted), (False, True))
+        self.assertFalse(Route.objects.filter(pk=unused.pk).exists())
+        self.assertEqual(RouteStudent.objects.get(route=routes[0]).student, student)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'schools'
+
+urlpatterns = [
+    path('<int:school_id>/plan-routes/', views.plan_school_routes, name='plan_routes'),
+]
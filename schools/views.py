@@ -1,3 +1,39 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_POST
+
+from trips.views import can_view_school, forbidden
+
+from .models import School
+from .planning import create_routes, plan_as_dict, plan_routes
+
+
+@require_POST
+def plan_school_routes(request, school_id):
+    """
+    Plan capacity-constrained routes for a school. JSON body (all optional):
+    {"method": "kmeans" | "sweep", "commit": false, "replace": false, "prefix": "Planned Route"}
+    Without "commit" the plan is only returned. Session authenticated, so
+    requests need the CSRF token like any form post.
+    """
+    school = School.objects.filter(pk=school_id).first()
+    if school is None:
+        raise Http404('Unknown school')
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    try:
+        options = json.loads(request.body or '{}')
+        method = options.get('method', 'kmeans')
+        if method not in ('kmeans', 'sweep'):
+            raise ValueError("method must be 'kmeans' or 'sweep'")
+        plans, unlocated = plan_routes(school, method)
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    result = plan_as_dict(plans, unlocated)
+    if options.get('commit') and plans:
+        routes = create_routes(school, plans, options.get('prefix') or 'Planned Route', bool(options.get('replace')))
+        for route, data in zip(routes, result['routes']):
+            data['route'] = route.pk
+    return JsonResponse(result, status=201 if options.get('commit') and plans else 200)
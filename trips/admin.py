@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Trip, TripStudent, TripLocation, TripEvent
+from .models import Trip, TripTemplate, TripStudent, TripLocation, TripEvent, TripTrack, TripSummary, SegmentTravelTime, SafetyThresholds, RoutePath
 
 # Register your models here.
 
@@ -33,7 +33,9 @@ class TripLocationAdmin(admin.ModelAdmin):
     list_display = ('trip', 'latitude', 'longitude', 'timestamp', 'speed')
     list_filter = ('trip__trip_type',)
     search_fields = ('trip__route__name',)
-    date_hierarchy = 'timestamp'
+    date_hierarchy = 'timestamp'  # drill-downs filter by timestamp range, so only matching partitions are scanned
+    list_select_related = ('trip__route',)
+    show_full_result_count = False  # avoid an extra COUNT(*) across every partition
 
 @admin.register(TripEvent)
 class TripEventAdmin(admin.ModelAdmin):
@@ -41,3 +43,76 @@ class TripEventAdmin(admin.ModelAdmin):
     list_filter = ('event_type',)
     search_fields = ('trip__route__name', 'description')
     date_hierarchy = 'timestamp'
+    list_select_related = ('trip__route',)
+    show_full_result_count = False
+
+@admin.register(TripTrack)
+class TripTrackAdmin(admin.ModelAdmin):
+    list_display = ('trip', 'start_time', 'raw_point_count', 'point_count', 'get_compression_ratio')
+    search_fields = ('trip__route__name',)
+    date_hierarchy = 'start_time'
+    readonly_fields = ('trip', 'start_time', 'raw_point_count', 'point_count', 'tolerance')
+
+    def get_compression_ratio(self, obj):
+        ratio = obj.compression_ratio
+        return f"{ratio:.1f}x" if ratio else '-'
+    get_compression_ratio.short_description = 'Compression'
+
+@admin.register(TripSummary)
+class TripSummaryAdmin(admin.ModelAdmin):
+    list_display = ('trip', 'start_time', 'get_distance_km', 'get_moving_minutes', 'max_speed_kmh', 'harsh_acceleration_count', 'harsh_braking_count')
+    list_filter = ('trip__trip_type', 'trip__school')
+    search_fields = ('trip__route__name', 'trip__bus__registration_number')
+    date_hierarchy = 'start_time'
+    list_select_related = ('trip__route', 'trip__bus', 'trip__school')
+    readonly_fields = (
+        'trip', 'start_time', 'end_time', 'point_count', 'distance_m', 'duration_seconds', 'moving_seconds',
+        'idle_seconds', 'max_speed_kmh', 'avg_speed_kmh', 'harsh_acceleration_count', 'harsh_braking_count'
+    )
+
+    def get_distance_km(self, obj):
+        return f"{obj.distance_km:.2f}"
+    get_distance_km.short_description = 'Distance (km)'
+
+    def get_moving_minutes(self, obj):
+        return f"{obj.moving_seconds / 60:.0f}"
+    get_moving_minutes.short_description = 'Moving (min)'
+
+
+@admin.register(SegmentTravelTime)
+class SegmentTravelTimeAdmin(admin.ModelAdmin):
+    list_display = ('route', 'from_stop', 'to_stop', 'trip_type', 'time_bucket', 'sample_count', 'p50_seconds', 'p90_seconds')
+    list_filter = ('trip_type', 'route__school')
+    search_fields = ('route__name',)
+    list_select_related = ('route', 'from_stop__student', 'to_stop__student')
+    exclude = ('histogram',)
+    readonly_fields = ('route', 'from_stop', 'to_stop', 'trip_type', 'time_bucket', 'sample_count', 'p50_seconds', 'p90_seconds')
+
+
+@admin.register(SafetyThresholds)
+class SafetyThresholdsAdmin(admin.ModelAdmin):
+    list_display = ('school', 'speed_limit_kmh', 'overspeed_seconds', 'harsh_braking_ms2', 'stationary_minutes', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('school__name',)
+
+
+@admin.register(RoutePath)
+class RoutePathAdmin(admin.ModelAdmin):
+    list_display = ('route', 'trip_type', 'get_length_km', 'point_count', 'track_count', 'updated_at')
+    list_filter = ('trip_type', 'route__school')
+    search_fields = ('route__name',)
+    list_select_related = ('route',)
+    exclude = ('data',)
+    readonly_fields = ('route', 'trip_type', 'point_count', 'length_m', 'track_count')
+
+    def get_length_km(self, obj):
+        return f"{obj.length_m / 1000:.2f}"
+    get_length_km.short_description = 'Length (km)'
+
+
+@admin.register(TripTemplate)
+class TripTemplateAdmin(admin.ModelAdmin):
+    list_display = ('route', 'trip_type', 'start_time', 'weekdays', 'bus', 'driver', 'valid_from', 'valid_until', 'is_active')
+    list_filter = ('trip_type', 'is_active', 'school')
+    search_fields = ('route__name', 'bus__registration_number')
+    list_select_related = ('route', 'bus', 'driver__user')
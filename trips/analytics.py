@@ -0,0 +1,130 @@
+"""
+Odometry and driving analytics of a trip, computed with NumPy over the point
+arrays of trips.tracks and stored as one TripSummary row per trip, so reports
+read summaries instead of raw points.
+
+Segments between consecutive points faster than MAX_PLAUSIBLE_SPEED_KMH, or
+between points with the same timestamp, are GPS jumps and do not count
+towards the distance. A segment is moving when
+its speed is at least IDLE_SPEED_KMH. Harsh acceleration and braking are
+counted once per episode, consecutive samples over the threshold are one event.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Count, Sum
+
+from common.geo import haversine
+
+from .models import TripSummary, TripTrack
+from .tracks import raw_trip_points, track_points
+
+IDLE_SPEED_KMH = 3.0
+MAX_PLAUSIBLE_SPEED_KMH = 150.0
+HARSH_ACCELERATION_MS2 = 3.0  # about 0.3 g
+HARSH_BRAKING_MS2 = -3.5
+MIN_ACCELERATION_GAP_SECONDS = 1.0  # closer readings are too noisy to derive acceleration from
+
+
+def analysis_points(trip_id):
+    """
+    Point arrays of a trip, raw rows while all of them are present (full
+    resolution), else its track. Once raw rows were purged the few late ones
+    left are not the trip.
+    """
+    points = raw_trip_points(trip_id)
+    track = TripTrack.objects.filter(trip_id=trip_id).only('start_time', 'data', 'raw_point_count').first()
+    if track is not None and len(points[1]) < track.raw_point_count:
+        points = track_points(track)
+    return points
+
+
+def count_episodes(flags):
+    """Number of runs of True in a boolean array"""
+    if not len(flags):
+        return 0
+    return int(flags[0]) + int(np.count_nonzero(flags[1:] & ~flags[:-1]))
+
+
+def compute_summary(offsets, latitudes, longitudes, speeds):
+    """Summary figures of a trip from its point arrays (seconds, degrees, km/h with NaN)"""
+    count = len(offsets)
+    summary = {
+        'point_count': count,
+        'distance_m': 0.0,
+        'duration_seconds': float(offsets[-1] - offsets[0]) if count else 0.0,
+        'moving_seconds': 0.0,
+        'idle_seconds': 0.0,
+        'max_speed_kmh': None,
+        'avg_speed_kmh': None,
+        'harsh_acceleration_count': 0,
+        'harsh_braking_count': 0,
+    }
+    if count < 2:
+        return summary
+
+    gaps = np.diff(offsets)
+    distances = haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        segment_speeds = np.where(gaps > 0, distances / gaps * 3.6, np.nan)
+    plausible = segment_speeds <= MAX_PLAUSIBLE_SPEED_KMH  # NaN for points sharing a timestamp
+    moving = plausible & (segment_speeds >= IDLE_SPEED_KMH)
+
+    # Device speed where reported, otherwise the speed of the segment leading to the point
+    point_speeds = speeds.astype(np.float64, copy=True)
+    derived = np.concatenate(([np.nan], np.where(plausible, segment_speeds, np.nan)))
+    missing = np.isnan(point_speeds)
+    point_speeds[missing] = derived[missing]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accelerations = np.where(gaps >= MIN_ACCELERATION_GAP_SECONDS, np.diff(point_speeds) / 3.6 / gaps, np.nan)
+
+    distance = float(distances[plausible].sum())
+    moving_seconds = float(gaps[moving].sum())
+    summary.update({
+        'distance_m': distance,
+        'moving_seconds': moving_seconds,
+        'idle_seconds': float(gaps.sum()) - moving_seconds,
+        'max_speed_kmh': float(np.nanmax(point_speeds)) if not np.isnan(point_speeds).all() else None,
+        'avg_speed_kmh': distance / moving_seconds * 3.6 if moving_seconds else None,
+        'harsh_acceleration_count': count_episodes(accelerations > HARSH_ACCELERATION_MS2),
+        'harsh_braking_count': count_episodes(accelerations < HARSH_BRAKING_MS2),
+    })
+    return summary
+
+
+def summarize_trip(trip_id):
+    """Compute and store the TripSummary of a trip, returns None if it has no points"""
+    start_time, offsets, latitudes, longitudes, speeds = analysis_points(trip_id)
+    if start_time is None:
+        return None
+    summary = compute_summary(offsets, latitudes, longitudes, speeds)
+    end_time = start_time + timedelta(seconds=float(offsets[-1]))
+    trip_summary, _ = TripSummary.objects.update_or_create(
+        trip_id=trip_id,
+        defaults={'start_time': start_time, 'end_time': end_time, **summary},
+    )
+    return trip_summary
+
+
+def bus_distances(start, end, school_id=None):
+    """Kilometres and trips per bus for trips that started in [start, end), from the summaries"""
+    summaries = TripSummary.objects.filter(start_time__gte=start, start_time__lt=end)
+    if school_id is not None:
+        summaries = summaries.filter(trip__school_id=school_id)
+    rows = (
+        summaries.order_by()
+        .values('trip__bus_id', 'trip__bus__registration_number')
+        .annotate(total_distance_m=Sum('distance_m'), trips=Count('id'), total_moving_seconds=Sum('moving_seconds'))
+        .order_by('-total_distance_m')
+    )
+    return [
+        {
+            'bus': row['trip__bus_id'],
+            'registration_number': row['trip__bus__registration_number'],
+            'trips': row['trips'],
+            'distance_km': row['total_distance_m'] / 1000,
+            'moving_hours': row['total_moving_seconds'] / 3600,
+        }
+        for row in rows
+    ]
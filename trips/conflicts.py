@@ -0,0 +1,208 @@
+"""
+Double-booking detection: a Bus or Driver assigned to trips whose scheduled
+windows overlap. CANCELLED trips never conflict, and a trip without a
+scheduled end is taken to last DEFAULT_DURATION.
+
+IntervalTree keeps the windows of one bus or driver sorted by start with
+the largest end of every subtree (an implicit balanced tree over the sorted
+array), so an overlap query costs O(log n + conflicts). ConflictIndex holds
+one tree per bus and per driver and is what scheduling code, Trip.clean and
+the TripMaterializer ask. The fleet audit does not need trees: one sweep over
+all windows sorted by (resource, start) finds every overlapping pair.
+"""
+import bisect
+import heapq
+from datetime import timedelta
+
+from django.db.models import Q
+
+from .models import Trip
+
+DEFAULT_DURATION = timedelta(minutes=45)
+RESOURCES = ('bus', 'driver')
+
+
+def trip_window(start, end):
+    """(start, end) epoch seconds of a scheduled window"""
+    start = start.timestamp()
+    return start, end.timestamp() if end is not None else start + DEFAULT_DURATION.total_seconds()
+
+
+class IntervalTree:
+    """Half-open intervals [start, end) with a key, for overlap queries"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.keys = []
+        self.max_ends = None  # per node, rebuilt lazily after inserts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, key):
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+        self.keys.insert(index, key)
+        self.max_ends = None
+
+    def remove(self, key):
+        if key in self.keys:
+            index = self.keys.index(key)
+            del self.starts[index], self.ends[index], self.keys[index]
+            self.max_ends = None
+
+    def _build(self):
+        max_ends = [0.0] * len(self.starts)
+        stack = [(0, len(self.starts), False)]
+        # Post-order without recursion: children are filled before their parent
+        while stack:
+            low, high, children_done = stack.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            if not children_done:
+                stack.append((low, high, True))
+                stack.append((low, middle, False))
+                stack.append((middle + 1, high, False))
+                continue
+            best = self.ends[middle]
+            if low < middle:
+                best = max(best, max_ends[(low + middle) // 2])
+            if middle + 1 < high:
+                best = max(best, max_ends[(middle + 1 + high) // 2])
+            max_ends[middle] = best
+        self.max_ends = max_ends
+
+    def overlapping(self, start, end, exclude=None):
+        """Keys of the intervals overlapping [start, end)"""
+        if self.max_ends is None:
+            self._build()
+        found = []
+        stack = [(0, len(self.starts))]
+        while stack:
+            low, high = stack.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            if self.max_ends[middle] <= start:
+                continue  # everything below ends before the query starts
+            stack.append((low, middle))
+            if self.starts[middle] < end:
+                if self.ends[middle] > start and self.keys[middle] != exclude:
+                    found.append(self.keys[middle])
+                stack.append((middle + 1, high))
+        return found
+
+
+class ConflictIndex:
+    """
+    IntervalTrees of the scheduled trip windows per bus and per driver. Keys
+    are trip ids; callers indexing trips not written yet use negative keys.
+    """
+
+    def __init__(self):
+        self.trees = {}  # (resource, id) -> IntervalTree
+        self.indexed = set()
+
+    @classmethod
+    def load(cls, start, end, **filters):
+        return cls().fill(start, end, **filters)
+
+    def fill(self, start, end, school_ids=None, bus_ids=None, driver_ids=None):
+        """Index the stored trips that may overlap [start, end), optionally only some schools, buses or drivers"""
+        trips = Trip.objects.exclude(status='CANCELLED').filter(
+            scheduled_start_time__lt=end,
+            scheduled_start_time__gte=start - timedelta(days=1),  # trips are shorter than a day
+        )
+        if school_ids is not None:
+            trips = trips.filter(school_id__in=school_ids)
+        if bus_ids is not None or driver_ids is not None:
+            trips = trips.filter(Q(bus_id__in=bus_ids or []) | Q(driver_id__in=driver_ids or []))
+        rows = trips.values_list('id', 'bus_id', 'driver_id', 'scheduled_start_time', 'scheduled_end_time')
+        for trip_id, bus_id, driver_id, scheduled_start, scheduled_end in rows.iterator(chunk_size=10000):
+            self.add(trip_id, bus_id, driver_id, *trip_window(scheduled_start, scheduled_end))
+        return self
+
+    def add(self, trip_id, bus_id, driver_id, start, end):
+        if trip_id in self.indexed:
+            return
+        self.indexed.add(trip_id)
+        for resource, resource_id in zip(RESOURCES, (bus_id, driver_id)):
+            if resource_id is not None:
+                self.trees.setdefault((resource, resource_id), IntervalTree()).add(start, end, trip_id)
+
+    def remove(self, trip_id, bus_id, driver_id):
+        self.indexed.discard(trip_id)
+        for resource, resource_id in zip(RESOURCES, (bus_id, driver_id)):
+            tree = self.trees.get((resource, resource_id))
+            if tree is not None:
+                tree.remove(trip_id)
+
+    def conflicts(self, bus_id, driver_id, start, end, exclude=None):
+        """[(resource, trip id)] already booked in [start, end) for the bus or driver"""
+        found = []
+        for resource, resource_id in zip(RESOURCES, (bus_id, driver_id)):
+            tree = self.trees.get((resource, resource_id))
+            if tree is not None:
+                found.extend((resource, trip_id) for trip_id in tree.overlapping(start, end, exclude))
+        return found
+
+    def trip_conflicts(self, trip, exclude=None):
+        if trip.scheduled_start_time is None or trip.status == 'CANCELLED':
+            return []
+        start, end = trip_window(trip.scheduled_start_time, trip.scheduled_end_time)
+        return self.conflicts(trip.bus_id, trip.driver_id, start, end, exclude=exclude)
+
+
+def trip_conflicts(trip):
+    """[(resource, trip id)] of the stored trips that double-book the bus or driver of `trip`"""
+    if trip.scheduled_start_time is None or trip.status == 'CANCELLED':
+        return []
+    end = trip.scheduled_end_time or trip.scheduled_start_time + DEFAULT_DURATION
+    index = ConflictIndex.load(
+        trip.scheduled_start_time, end,
+        bus_ids=[trip.bus_id], driver_ids=[trip.driver_id] if trip.driver_id else [],
+    )
+    return index.trip_conflicts(trip, exclude=trip.pk)
+
+
+def sweep_conflicts(windows):
+    """
+    Overlapping pairs among `windows` [(resource, resource id, start, end, trip id)]
+    sorted by (resource, resource id, start). Yields (resource, resource id, earlier trip, later trip).
+    """
+    current = None
+    active = []  # heap of (end, trip id) of the windows still open
+    for resource, resource_id, start, end, trip_id in windows:
+        if (resource, resource_id) != current:
+            current = (resource, resource_id)
+            active = []
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, other in active:
+            yield resource, resource_id, other, trip_id
+        heapq.heappush(active, (end, trip_id))
+
+
+def audit(start, end, school_ids=None):
+    """Every double booking among the trips scheduled to start in [start, end)"""
+    trips = Trip.objects.exclude(status='CANCELLED').filter(
+        scheduled_start_time__gte=start, scheduled_start_time__lt=end
+    )
+    if school_ids is not None:
+        trips = trips.filter(school_id__in=school_ids)
+
+    def windows():
+        for resource in RESOURCES:
+            field = f'{resource}_id'
+            rows = (
+                trips.filter(**{f'{field}__isnull': False})
+                .order_by(field, 'scheduled_start_time', 'id')
+                .values_list(field, 'id', 'scheduled_start_time', 'scheduled_end_time')
+            )
+            for resource_id, trip_id, scheduled_start, scheduled_end in rows.iterator(chunk_size=10000):
+                yield (resource, resource_id, *trip_window(scheduled_start, scheduled_end), trip_id)
+
+    return list(sweep_conflicts(windows()))
@@ -0,0 +1,193 @@
+"""
+Live ETA for every remaining stop of an in-progress trip.
+
+Per trip the engine keeps the ordered stops, their coordinates and the
+expected stop-to-stop time of each segment as a cumulative array, all loaded
+once. A new point only re-estimates the time to the next stop; the ETAs of
+the stops after it are that estimate plus a precomputed offset, so an update
+costs one distance calculation and one vector add.
+
+Expected segment times come, in order of preference, from the learned
+median for the stop pair and time of day (trips.segments), from the
+distance at DEFAULT_SPEED_KMH plus DWELL_SECONDS, or from the gap in
+scheduled times.
+"""
+import threading
+
+import numpy as np
+
+from common.geo import distance_m
+from schools.geocoding import stop_coordinate_expressions
+
+from . import positions
+from .models import Trip, TripStudent
+from .segments import segment_times
+
+DEFAULT_SPEED_KMH = 20
+MIN_SPEED_MS = 1.5  # below this the bus is treated as waiting, not crawling
+DWELL_SECONDS = 60
+ARRIVAL_RADIUS_M = 50
+SPEED_SMOOTHING = 0.3
+FINISHED_STATUSES = ('PICKED_UP', 'DROPPED_OFF', 'ABSENT', 'CANCELLED')
+
+
+def eta_key(trip_id):
+    return f'eta:{trip_id}'
+
+
+class TripEta:
+    """ETA state of one trip"""
+
+    def __init__(self, trip_id, stop_ids, latitudes, longitudes, segment_seconds, finished):
+        self.trip_id = trip_id
+        self.stop_ids = list(stop_ids)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        # segment_seconds[i]: expected time from stop i-1 to stop i (0 for the first stop)
+        self.segment_seconds = np.asarray(segment_seconds, dtype=np.float64)
+        self.offsets = np.cumsum(self.segment_seconds)
+        self.segment_lengths = np.full(len(self.stop_ids), np.nan)
+        self.segment_lengths[1:] = [
+            distance_m(self.latitudes[i - 1], self.longitudes[i - 1], self.latitudes[i], self.longitudes[i])
+            for i in range(1, len(self.stop_ids))
+        ]
+        self.finished = np.asarray(finished, dtype=bool)
+        self.next_index = 0
+        self.speed = None
+        self.last_fix = None
+        self.etas = np.full(len(self.stop_ids), np.nan)
+        self._advance(None, None)
+
+    @classmethod
+    def load(cls, trip):
+        """Build the state for a Trip from its TripStudents, ordered by stop sequence"""
+        latitude, longitude = stop_coordinate_expressions(trip.trip_type, 'route_student__')
+        stops = list(
+            TripStudent.objects.filter(trip=trip)
+            .order_by('route_student__sequence_number')
+            .annotate(stop_latitude=latitude, stop_longitude=longitude)
+            .values_list('id', 'route_student_id', 'status', 'scheduled_time', 'stop_latitude', 'stop_longitude')
+        )
+        latitudes = [np.nan if s[4] is None else float(s[4]) for s in stops]
+        longitudes = [np.nan if s[5] is None else float(s[5]) for s in stops]
+        segment_seconds = [0.0]
+        for i in range(1, len(stops)):
+            seconds = segment_times.median(stops[i - 1][1], stops[i][1], trip.trip_type, stops[i - 1][3])
+            if seconds is None and not np.isnan(latitudes[i - 1] + latitudes[i]):
+                length = distance_m(latitudes[i - 1], longitudes[i - 1], latitudes[i], longitudes[i])
+                seconds = length / (DEFAULT_SPEED_KMH / 3.6) + DWELL_SECONDS
+            if seconds is None:
+                seconds = (stops[i][3] - stops[i - 1][3]).total_seconds()
+            segment_seconds.append(max(seconds, 0.0))
+
+        return cls(
+            trip.id,
+            [s[0] for s in stops],
+            latitudes,
+            longitudes,
+            segment_seconds,
+            [s[2] in FINISHED_STATUSES for s in stops],
+        )
+
+    def _advance(self, latitude, longitude):
+        # Move past finished stops and stops the bus is currently at
+        while self.next_index < len(self.stop_ids):
+            i = self.next_index
+            if not self.finished[i]:
+                if latitude is None or np.isnan(self.latitudes[i]):
+                    break
+                if distance_m(latitude, longitude, self.latitudes[i], self.longitudes[i]) > ARRIVAL_RADIUS_M:
+                    break
+                self.finished[i] = True
+            self.next_index += 1
+
+    def mark_finished(self, stop_id):
+        if stop_id in self.stop_ids:
+            self.finished[self.stop_ids.index(stop_id)] = True
+            self._advance(None, None)
+
+    def update(self, latitude, longitude, timestamp, speed_kmh=None):
+        """Take a new fix (epoch seconds) and return the ETA array, NaN for passed stops"""
+        if speed_kmh is not None:
+            speed = speed_kmh / 3.6
+        elif self.last_fix is not None and timestamp > self.last_fix[2]:
+            speed = distance_m(latitude, longitude, *self.last_fix[:2]) / (timestamp - self.last_fix[2])
+        else:
+            speed = None
+        if speed is not None:
+            self.speed = speed if self.speed is None else (
+                SPEED_SMOOTHING * speed + (1 - SPEED_SMOOTHING) * self.speed
+            )
+        self.last_fix = (latitude, longitude, timestamp)
+
+        self._advance(latitude, longitude)
+        i = self.next_index
+        self.etas[:i] = np.nan
+        if i >= len(self.stop_ids):
+            return self.etas
+
+        segment = self.segment_seconds[i]
+        if np.isnan(self.latitudes[i]):
+            to_next = segment
+        else:
+            remaining = distance_m(latitude, longitude, self.latitudes[i], self.longitudes[i])
+            length = self.segment_lengths[i]
+            # Historical estimate scaled to the distance still to cover
+            to_next = segment * min(remaining / length, 1.0) if length > 0 else remaining / (DEFAULT_SPEED_KMH / 3.6)
+            if self.speed is not None and self.speed >= MIN_SPEED_MS:
+                to_next = (to_next + remaining / self.speed) / 2
+
+        self.etas[i:] = timestamp + to_next + (self.offsets[i:] - self.offsets[i])
+        self.etas[i:][self.finished[i:]] = np.nan
+        return self.etas
+
+    def as_dict(self):
+        return {
+            stop_id: None if np.isnan(eta) else float(eta)
+            for stop_id, eta in zip(self.stop_ids, self.etas.tolist())
+        }
+
+
+class EtaEngine:
+    """Per-process registry of TripEta states, fed by the ingestion pipeline"""
+
+    def __init__(self):
+        self.trips = {}
+        self._lock = threading.Lock()
+
+    def get(self, trip_id):
+        state = self.trips.get(trip_id)
+        if state is None:
+            trip = Trip.objects.only('route_id', 'trip_type').get(pk=trip_id)
+            state = TripEta.load(trip)
+            with self._lock:
+                state = self.trips.setdefault(trip_id, state)
+        return state
+
+    def on_points(self, trip_id, locations):
+        state = self.get(trip_id)
+        for location in locations:
+            state.update(
+                float(location.latitude),
+                float(location.longitude),
+                location.timestamp.timestamp(),
+                None if location.speed is None else float(location.speed),
+            )
+        positions.get_store().set(eta_key(trip_id), state.as_dict(), timeout=None)
+
+    def mark_finished(self, trip_id, trip_student_id):
+        state = self.trips.get(trip_id)
+        if state is not None:
+            state.mark_finished(trip_student_id)
+
+    def forget(self, trip_id):
+        self.trips.pop(trip_id, None)
+        positions.get_store().delete(eta_key(trip_id))
+
+
+engine = EtaEngine()
+
+
+def get_trip_etas(trip_id):
+    """{trip_student_id: epoch seconds or None} as last computed for the trip"""
+    return positions.get_store().get(eta_key(trip_id))
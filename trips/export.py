@@ -0,0 +1,226 @@
+"""
+Per-school data export as a tar archive of compressed NDJSON, one member per
+model (schools.student.ndjson.gz, trips.triplocation.ndjson.zst, ...) and a
+manifest.json with the row counts, written last.
+
+Each model is read with .iterator(chunk_size), a server-side cursor on
+PostgreSQL, as value tuples rather than model instances. Lines are in the
+serializer format of dumpdata ({"model", "pk", "fields"}). Trips and their
+students, events, locations, tracks and summaries can be limited to a range
+of days; the other models are exported whole. Everything is read in one
+REPEATABLE READ transaction, so the members agree with each other even while
+trips are being written.
+
+The archive is self-contained: the parents of the students, the drivers of
+the school and of its trips, and every user account referenced by an
+exported row (parents, drivers, created_by/updated_by) are included, so
+the extracted members load into an empty database with stream_loaddata.
+User accounts are exported with an unusable password, not the stored hash;
+restored users set a new one.
+
+A member is compressed into a temporary file first because a tar header
+needs the member size; archive_chunks() then yields the archive block by
+block, so memory stays flat however large the export is and the same
+generator serves the command and a streaming HTTP response.
+"""
+import base64
+import gzip
+import io
+import json
+import tarfile
+import tempfile
+import time
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+
+from accounts.models import Driver, Parent
+from schools.models import Route, RouteStudent, School, Student
+from vehicles.models import Bus
+
+from .materialize import day_bounds
+from .models import Trip, TripEvent, TripLocation, TripStudent, TripSummary, TripTemplate, TripTrack
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for zstd archives
+    zstandard = None
+
+CHUNK_SIZE = 2000  # rows fetched per round trip of the server-side cursor
+COPY_SIZE = 1 << 20
+COMPRESSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+
+
+class ExportError(Exception):
+    pass
+
+
+def school_querysets(school_id, first_day=None, last_day=None):
+    """
+    [(model, queryset)] of the rows exported for a school, trips limited to
+    the days if given. The user accounts they reference come on top, see
+    archive_chunks().
+    """
+    trips = Trip.objects.filter(school_id=school_id)
+    if first_day is not None:
+        trips = trips.filter(scheduled_start_time__gte=day_bounds(first_day, first_day)[0])
+    if last_day is not None:
+        trips = trips.filter(scheduled_start_time__lt=day_bounds(last_day, last_day)[1])
+    trip_ids = trips.values('id')
+    drivers = Driver.objects.filter(
+        Q(school_id=school_id)
+        | Q(pk__in=trips.values('driver_id'))
+        | Q(pk__in=TripTemplate.objects.filter(school_id=school_id).values('driver_id'))
+    )
+    return [
+        (School, School.objects.filter(pk=school_id)),
+        (Parent, Parent.objects.filter(pk__in=Student.objects.filter(school_id=school_id).values('parent_id'))),
+        (Driver, drivers),
+        (Student, Student.objects.filter(school_id=school_id)),
+        (Bus, Bus.objects.filter(school_id=school_id)),
+        (Route, Route.objects.filter(school_id=school_id)),
+        (RouteStudent, RouteStudent.objects.filter(route__school_id=school_id)),
+        (TripTemplate, TripTemplate.objects.filter(school_id=school_id)),
+        (Trip, trips),
+        (TripStudent, TripStudent.objects.filter(trip__in=trip_ids)),
+        # By trip, not by timestamp: points keep whatever time the device clock gave them
+        (TripEvent, TripEvent.objects.filter(trip__in=trip_ids)),
+        (TripLocation, TripLocation.objects.filter(trip__in=trip_ids)),
+        # The only geometry left of trips whose raw locations were packed and purged
+        (TripTrack, TripTrack.objects.filter(trip__in=trip_ids)),
+        (TripSummary, TripSummary.objects.filter(trip__in=trip_ids)),
+    ]
+
+
+def export_querysets(school_id, first_day, last_day, users):
+    """school_querysets(), then the user accounts collected into `users` while those were written"""
+    yield from school_querysets(school_id, first_day, last_day)
+    # Last, once every row pointing to a user account has been seen
+    user_model = get_user_model()
+    yield user_model, user_model.objects.filter(pk__in=sorted(users))
+
+
+def open_compressed(fileobj, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6)
+    if zstandard is None:
+        raise ExportError('zstd compression needs the zstandard package')
+    return zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False)
+
+
+def write_member(fileobj, model, queryset, compression, chunk_size=CHUNK_SIZE, users=None, replace=None):
+    """
+    Write the rows of `queryset` as compressed NDJSON lines into `fileobj`,
+    returns the row count. The ids of the user accounts the rows point to
+    are added to the `users` set if given; `replace` maps field names to
+    values written instead of the stored ones.
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    names = [field.name for field in fields]
+    user_model = get_user_model()
+    user_columns = [
+        index for index, field in enumerate(fields) if field.is_relation and field.related_model is user_model
+    ]
+    # Base64 like the serializers of dumpdata (BinaryField.value_to_string)
+    binary_columns = [index for index, field in enumerate(fields) if field.get_internal_type() == 'BinaryField']
+    replace = replace or {}
+    label = model._meta.label_lower
+    encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    rows = (
+        queryset.order_by()  # no sort, rows come out in table order
+        .values_list('pk', *[field.attname for field in fields])
+        .iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    lines = []
+    with open_compressed(fileobj, compression) as stream:
+        for pk, *values in rows:
+            if users is not None:
+                users.update(values[index] for index in user_columns if values[index] is not None)
+            for index in binary_columns:
+                if values[index] is not None:
+                    values[index] = base64.b64encode(values[index]).decode('ascii')
+            item = dict(zip(names, values))
+            item.update(replace)
+            lines.append(encoder.encode({'model': label, 'pk': pk, 'fields': item}))
+            count += 1
+            if len(lines) >= chunk_size:
+                stream.write(('\n'.join(lines) + '\n').encode())
+                lines = []
+        if lines:
+            stream.write(('\n'.join(lines) + '\n').encode())
+    return count
+
+
+def tar_member(name, fileobj, size, mtime):
+    """Yield the tar header, the contents of `fileobj` and the padding of one member"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    yield info.tobuf(format=tarfile.PAX_FORMAT)
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(COPY_SIZE)
+        if not block:
+            break
+        yield block
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+
+def archive_chunks(school_id, first_day=None, last_day=None, compression='gzip', chunk_size=CHUNK_SIZE):
+    """Yield the bytes of a school's export archive"""
+    if compression not in COMPRESSIONS:
+        raise ExportError(f'Unknown compression {compression}, use one of {", ".join(COMPRESSIONS)}')
+    if compression == 'zstd' and zstandard is None:
+        raise ExportError('zstd compression needs the zstandard package')
+    extension = COMPRESSIONS[compression]
+    started = time.time()
+    manifest = {
+        'school': school_id,
+        'first_day': first_day and first_day.isoformat(),
+        'last_day': last_day and last_day.isoformat(),
+        'compression': compression,
+        'models': {},
+    }
+    written = 0
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and outermost:
+            # One snapshot for all members; must come before any query of the transaction
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        users = set()
+        for model, queryset in export_querysets(school_id, first_day, last_day, users):
+            replace = {'password': UNUSABLE_PASSWORD_PREFIX} if model is get_user_model() else None
+            with tempfile.TemporaryFile() as member:
+                count = write_member(member, model, queryset, compression, chunk_size, users=users, replace=replace)
+                size = member.tell()
+                name = f'{model._meta.label_lower}.ndjson.{extension}'
+                manifest['models'][model._meta.label_lower] = {'file': name, 'rows': count}
+                for block in tar_member(name, member, size, started):
+                    written += len(block)
+                    yield block
+
+    data = json.dumps(manifest, indent=2).encode()
+    for block in tar_member('manifest.json', io.BytesIO(data), len(data), started):
+        written += len(block)
+        yield block
+    # End of archive: two zero blocks, padded to a whole record
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(written + end) % tarfile.RECORDSIZE
+    yield tarfile.NUL * end
+
+
+def export_school(school_id, path, **options):
+    """Write the archive to `path`, returns its size in bytes"""
+    size = 0
+    with open(path, 'wb') as output:
+        for block in archive_chunks(school_id, **options):
+            output.write(block)
+            size += len(block)
+    return size
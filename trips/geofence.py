@@ -0,0 +1,138 @@
+"""
+Automatic pickup and drop detection.
+
+Each in-progress trip gets a GridIndex of its remaining stops (geocoded
+pickup or drop address, else the student's home) with cells as wide as the stop radius, so a
+position is only compared with the stops in the surrounding cells. When the
+bus stays within the radius of a stop for the dwell time, the TripStudent is
+marked PICKED_UP or DROPPED_OFF at the time of that fix and a PICKUP/DROP
+TripEvent is recorded. Stops are removed from the grid once handled.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from common.spatial import GridIndex
+from schools.geocoding import stop_coordinate_expressions
+
+from .models import Trip, TripEvent, TripStudent
+
+# trip_type -> (TripStudent status, TripEvent type)
+ARRIVAL_ACTIONS = {
+    'PICKUP': ('PICKED_UP', 'PICKUP'),
+    'DROP': ('DROPPED_OFF', 'DROP'),
+}
+
+
+class TripFence:
+    """Grid of the remaining stops of one trip and the dwell state of the bus"""
+
+    def __init__(self, trip_id, trip_type, stops, radius_m=None, dwell_seconds=None):
+        self.trip_id = trip_id
+        self.trip_type = trip_type
+        self.radius_m = radius_m or getattr(settings, 'TRIP_GEOFENCE_RADIUS_M', 40.0)
+        self.dwell_seconds = dwell_seconds or getattr(settings, 'TRIP_GEOFENCE_DWELL_SECONDS', 20.0)
+        self.stops = GridIndex(cell_m=self.radius_m).build(stops)
+        self.entered = {}  # trip student id -> time of the first fix inside its radius
+
+    @classmethod
+    def load(cls, trip):
+        """Remaining stops of a Trip that have coordinates"""
+        latitude, longitude = stop_coordinate_expressions(trip.trip_type, 'route_student__')
+        stops = (
+            TripStudent.objects.filter(trip=trip, status='SCHEDULED')
+            .annotate(stop_latitude=latitude, stop_longitude=longitude)
+            .filter(stop_latitude__isnull=False, stop_longitude__isnull=False)
+            .values_list('id', 'stop_latitude', 'stop_longitude')
+        )
+        return cls(trip.id, trip.trip_type, [
+            (stop_id, float(latitude), float(longitude)) for stop_id, latitude, longitude in stops
+        ])
+
+    def __len__(self):
+        return len(self.stops)
+
+    def remove(self, stop_id):
+        self.stops.remove(stop_id)
+        self.entered.pop(stop_id, None)
+
+    def update(self, latitude, longitude, timestamp):
+        """Take a fix, returns the ids of the stops the bus has now dwelled at"""
+        inside = {stop_id for stop_id, _ in self.stops.within(latitude, longitude, self.radius_m)}
+
+        for stop_id in [stop_id for stop_id in self.entered if stop_id not in inside]:
+            del self.entered[stop_id]  # left the stop before the dwell time passed
+
+        arrived = []
+        for stop_id in inside:
+            entered = self.entered.setdefault(stop_id, timestamp)
+            if (timestamp - entered).total_seconds() >= self.dwell_seconds:
+                arrived.append(stop_id)
+                self.remove(stop_id)
+        return arrived
+
+
+def record_arrivals(fence, arrivals):
+    """Mark the TripStudents of `arrivals` [(trip student id, TripLocation)] and log their events"""
+    status, event_type = ARRIVAL_ACTIONS[fence.trip_type]
+    with transaction.atomic():
+        trip_students = TripStudent.objects.select_related('route_student__student').in_bulk(
+            [stop_id for stop_id, _ in arrivals]
+        )
+        for stop_id, location in arrivals:
+            trip_student = trip_students.get(stop_id)
+            if trip_student is None or trip_student.status != 'SCHEDULED':
+                continue  # already handled by the driver
+            trip_student.status = status
+            trip_student.actual_time = location.timestamp
+            trip_student.save(update_fields=['status', 'actual_time', 'updated_at'])
+            TripEvent.objects.create(
+                trip_id=fence.trip_id,
+                event_type=event_type,
+                timestamp=location.timestamp,
+                description=f'{trip_student.route_student.student.name} '
+                            f'{trip_student.get_status_display().lower()} (geofence)',
+                latitude=location.latitude,
+                longitude=location.longitude,
+            )
+
+
+class GeofenceEngine:
+    """Per-process registry of TripFence grids, fed by the ingestion pipeline"""
+
+    def __init__(self):
+        self.trips = {}
+        self._lock = threading.Lock()
+
+    def get(self, trip_id):
+        fence = self.trips.get(trip_id)
+        if fence is None:
+            trip = Trip.objects.only('trip_type').get(pk=trip_id)
+            fence = TripFence.load(trip)
+            with self._lock:
+                fence = self.trips.setdefault(trip_id, fence)
+        return fence
+
+    def on_points(self, trip_id, locations):
+        fence = self.get(trip_id)
+        if not fence:
+            return []
+        arrivals = []
+        for location in locations:
+            for stop_id in fence.update(float(location.latitude), float(location.longitude), location.timestamp):
+                arrivals.append((stop_id, location))
+        if arrivals:
+            record_arrivals(fence, arrivals)
+        return arrivals
+
+    def remove_stop(self, trip_id, trip_student_id):
+        fence = self.trips.get(trip_id)
+        if fence is not None:
+            fence.remove(trip_student_id)
+
+    def forget(self, trip_id):
+        self.trips.pop(trip_id, None)
+
+
+engine = GeofenceEngine()
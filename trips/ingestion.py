@@ -0,0 +1,218 @@
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Trip, TripLocation
+from .signals import points_ingested
+
+logger = logging.getLogger(__name__)
+SPEED_FIELD = TripLocation._meta.get_field('speed')
+MAX_SPEED = 10 ** (SPEED_FIELD.max_digits - SPEED_FIELD.decimal_places)  # exclusive, in km/h
+
+
+class IngestionError(ValueError):
+    """Raised when a device payload cannot be accepted"""
+
+
+class LocationBuffer:
+    """
+    Collects TripLocation rows across requests and writes them with a single
+    bulk_create once either `max_points` rows are waiting or the oldest
+    waiting row is `max_age` seconds old.
+
+    If the write fails the batch is written again trip by trip: the rows of
+    a trip the database rejects (e.g. a deleted trip) are logged and
+    dropped, the rest are written, or requeued if the database is
+    unavailable, keeping at most `max_pending` rows.
+    """
+
+    def __init__(self, max_points=None, max_age=None, max_pending=None):
+        self.max_points = max_points or getattr(settings, 'TRIP_LOCATION_BATCH_SIZE', 500)
+        self.max_age = max_age or getattr(settings, 'TRIP_LOCATION_FLUSH_INTERVAL', 2.0)
+        self.max_pending = max_pending or getattr(settings, 'TRIP_LOCATION_MAX_PENDING', 100 * self.max_points)
+        self._pending = []
+        self._first_added = None
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def extend(self, locations):
+        """Queue locations and flush if the size or age trigger has fired"""
+        with self._lock:
+            if not self._pending:
+                self._first_added = time.monotonic()
+                self._schedule_timer()
+            self._pending.extend(locations)
+            due = (
+                len(self._pending) >= self.max_points
+                or time.monotonic() - self._first_added >= self.max_age
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all pending locations, returns the number of rows written"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._first_added = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return 0
+        try:
+            self._write(batch)
+            return len(batch)
+        except DatabaseError:
+            logger.exception('Writing %d trip locations failed, retrying trip by trip', len(batch))
+        return self._write_by_trip(batch)
+
+    def _write(self, locations):
+        # A savepoint when called inside a transaction, so a failure leaves it usable for the retries
+        with transaction.atomic():
+            TripLocation.objects.bulk_create(locations, batch_size=self.max_points)
+
+    def _write_by_trip(self, batch):
+        by_trip = defaultdict(list)
+        for location in batch:
+            by_trip[location.trip_id].append(location)
+        written = 0
+        failed = []
+        for trip_id, locations in by_trip.items():
+            if failed:
+                failed.extend(locations)
+                continue
+            try:
+                self._write(locations)
+                written += len(locations)
+            except (DataError, IntegrityError):
+                logger.exception('Dropped %d locations of trip %s rejected by the database', len(locations), trip_id)
+            except DatabaseError:
+                # Database unavailable, keep this and the remaining trips for the next flush
+                failed.extend(locations)
+        if failed:
+            logger.warning('Requeued %d trip locations for the next flush', len(failed))
+            self._requeue(failed)
+        return written
+
+    def _requeue(self, locations):
+        with self._lock:
+            pending = locations + self._pending
+            if len(pending) > self.max_pending:
+                logger.error(
+                    'Dropped the %d oldest trip locations, over the pending limit', len(pending) - self.max_pending
+                )
+                pending = pending[-self.max_pending:]
+            self._pending = pending
+            if self._first_added is None:
+                self._first_added = time.monotonic()
+            if self._timer is None:
+                self._schedule_timer()
+
+    def _schedule_timer(self):
+        # Guarantees a flush for quiet periods where no further request arrives
+        self._timer = threading.Timer(self.max_age, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # Timer threads get their own connection, don't leak it
+            connection.close()
+
+
+location_buffer = LocationBuffer()
+
+
+def parse_points(points, trip_id):
+    """Convert the device `points` list into unsaved TripLocation objects"""
+    if not isinstance(points, list) or not points:
+        raise IngestionError("'points' must be a non-empty list")
+
+    now = timezone.now()
+    locations = []
+    for point in points:
+        try:
+            latitude = float(point['latitude'])
+            longitude = float(point['longitude'])
+            speed = point.get('speed')
+            speed = None if speed is None else float(speed)
+            timestamp = point.get('timestamp')
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise IngestionError('Each point needs numeric latitude and longitude, and a numeric speed if given')
+
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise IngestionError('Coordinates out of range')
+        # Rounded as stored, so 999.999 is rejected rather than overflowing the column
+        if speed is not None and not (math.isfinite(speed) and 0 <= round(speed, 2) < MAX_SPEED):
+            raise IngestionError(f'Speed out of range, expected 0 to {MAX_SPEED} km/h')
+
+        if timestamp:
+            try:
+                timestamp = parse_datetime(timestamp)
+            except (TypeError, ValueError):
+                timestamp = None
+            if timestamp is None:
+                raise IngestionError('Invalid timestamp, expected ISO 8601')
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+        else:
+            timestamp = now
+
+        locations.append(TripLocation(
+            trip_id=trip_id,
+            latitude=Decimal(f'{latitude:.6f}'),
+            longitude=Decimal(f'{longitude:.6f}'),
+            speed=None if speed is None else Decimal(f'{speed:.2f}'),
+            timestamp=timestamp,
+            created_at=now,
+            updated_at=now,
+        ))
+    return locations
+
+
+def ingest(registration_number, points):
+    """
+    Accept a batch of points for the bus's in-progress trip.
+    Returns (trip_id, number of accepted points).
+    """
+    trip = Trip.objects.filter(
+        bus__registration_number=registration_number,
+        status='IN_PROGRESS',
+    ).order_by('-actual_start_time').values_list('id', 'bus_id', 'school_id').first()
+    if trip is None:
+        raise Trip.DoesNotExist(f'No trip in progress for bus {registration_number}')
+    trip_id, bus_id, school_id = trip
+
+    locations = parse_points(points, trip_id)
+    locations.sort(key=lambda location: location.timestamp)
+    location_buffer.extend(locations)  # stored whatever the receivers below do
+    responses = points_ingested.send_robust(
+        sender=TripLocation,
+        trip_id=trip_id,
+        bus_id=bus_id,
+        school_id=school_id,
+        locations=locations,
+    )
+    for receiver, response in responses:
+        if isinstance(response, Exception):
+            logger.error(
+                'Receiver %s failed on %d points of trip %s', getattr(receiver, '__qualname__', receiver),
+                len(locations), trip_id, exc_info=response,
+            )
+    return trip_id, len(locations)
@@ -0,0 +1,219 @@
+"""
+Live tracking over WebSockets, served by SmartBus/asgi.py at /ws/live/.
+
+Clients send {"action": "subscribe", "trip": <id>} or {"action": "subscribe",
+"school": <id>} (and "unsubscribe" likewise) and receive position and event
+messages for those channels. Every message is serialized once and the same
+text frame is handed to all subscribers. Each connection has its own writer
+task, so a slow client never holds up the others: while it is busy its
+pending position updates are coalesced to the newest per trip and only a
+bounded number of events is kept.
+"""
+import asyncio
+import json
+from collections import defaultdict, deque
+from http.cookies import SimpleCookie
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, load_backend
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+LIVE_PATH = '/ws/live/'
+MAX_PENDING_EVENTS = 100
+MAX_SUBSCRIPTIONS = 50
+
+
+class Subscriber:
+    """One WebSocket connection and its outgoing queue"""
+
+    def __init__(self, send, user=None, max_events=MAX_PENDING_EVENTS):
+        self.send = send
+        self.user = user
+        self.channels = set()
+        self.positions = {}  # trip id -> newest unsent position frame
+        self.events = deque(maxlen=max_events)
+        self.coalesced = 0
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+
+    def offer(self, kind, trip_id, text):
+        if kind == 'position':
+            if trip_id in self.positions:
+                self.coalesced += 1
+            self.positions[trip_id] = text
+        else:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(text)
+        self._wakeup.set()
+
+    def next_frame(self):
+        # Events first, they cannot be recreated from a later message
+        if self.events:
+            return self.events.popleft()
+        if self.positions:
+            return self.positions.pop(next(iter(self.positions)))
+        return None
+
+    async def run(self):
+        """Write queued frames until the connection goes away"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            text = self.next_frame()
+            while text is not None:
+                await self.send({'type': 'websocket.send', 'text': text})
+                text = self.next_frame()
+
+
+class LiveHub:
+    """Channel registry and fan-out, lives on the event loop of the ASGI worker"""
+
+    def __init__(self):
+        self.channels = defaultdict(set)
+        self.loop = None
+
+    @property
+    def is_running(self):
+        return self.loop is not None and not self.loop.is_closed()
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def subscribe(self, subscriber, channel):
+        self.channels[channel].add(subscriber)
+        subscriber.channels.add(channel)
+
+    def unsubscribe(self, subscriber, channel):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[channel]
+        subscriber.channels.discard(channel)
+
+    def remove(self, subscriber):
+        for channel in list(subscriber.channels):
+            self.unsubscribe(subscriber, channel)
+
+    def publish(self, kind, trip_id, school_id, data):
+        """Fan a message out to the trip and school channels, returns the frame sent (if any)"""
+        targets = self.channels.get(('trip', trip_id), set()) | self.channels.get(('school', school_id), set())
+        if not targets:
+            return None
+        text = json.dumps({'type': kind, 'trip': trip_id, 'school': school_id, 'data': data})
+        for subscriber in targets:
+            subscriber.offer(kind, trip_id, text)
+        return text
+
+    def publish_threadsafe(self, kind, trip_id, school_id, data):
+        """Publish from synchronous code, e.g. the ingestion view running in a worker thread"""
+        if self.is_running:
+            self.loop.call_soon_threadsafe(self.publish, kind, trip_id, school_id, data)
+
+
+hub = LiveHub()
+
+
+def parse_channel(message):
+    for kind in ('trip', 'school'):
+        if isinstance(message.get(kind), int):
+            return (kind, message[kind])
+    return None
+
+
+def get_user(scope):
+    """Resolve the Django user from the session cookie of the handshake"""
+    from django.contrib.auth.models import AnonymousUser
+
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return AnonymousUser()
+
+    session = import_string(settings.SESSION_ENGINE + '.SessionStore')(morsel.value)
+    try:
+        user_id = session[SESSION_KEY]
+        backend = load_backend(session[BACKEND_SESSION_KEY])
+    except (KeyError, ImportError):
+        return AnonymousUser()
+    user = backend.get_user(user_id)
+    if user is None or not constant_time_compare(
+        session.get(HASH_SESSION_KEY, ''), user.get_session_auth_hash()
+    ):
+        return AnonymousUser()
+    return user
+
+
+def can_subscribe(user, channel):
+    from .models import Trip, TripStudent
+    from .views import can_view_school
+
+    kind, pk = channel
+    if kind == 'school':
+        return can_view_school(user, pk)
+
+    school_id = Trip.objects.filter(pk=pk).values_list('school_id', flat=True).first()
+    if school_id is None:
+        return False
+    if can_view_school(user, school_id):
+        return True
+    return user.is_authenticated and TripStudent.objects.filter(
+        trip_id=pk, route_student__student__parent__user=user
+    ).exists()
+
+
+async def live_application(scope, receive, send):
+    """ASGI application for the live tracking WebSocket"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if scope['path'] != LIVE_PATH:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    hub.attach(asyncio.get_running_loop())
+    user = await sync_to_async(get_user)(scope)
+    if not user.is_authenticated:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+
+    subscriber = Subscriber(send, user)
+    writer = asyncio.create_task(subscriber.run())
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] != 'websocket.receive':
+                continue
+            try:
+                request = json.loads(message.get('text') or '')
+            except ValueError:
+                continue
+            channel = parse_channel(request) if isinstance(request, dict) else None
+            if channel is None:
+                continue
+
+            if request.get('action') == 'unsubscribe':
+                hub.unsubscribe(subscriber, channel)
+            elif request.get('action') == 'subscribe':
+                allowed = (
+                    len(subscriber.channels) < MAX_SUBSCRIPTIONS
+                    and await sync_to_async(can_subscribe)(user, channel)
+                )
+                if allowed:
+                    hub.subscribe(subscriber, channel)
+                subscriber.offer('ack', None, json.dumps({
+                    'type': 'subscribed' if allowed else 'denied',
+                    channel[0]: channel[1],
+                }))
+    finally:
+        hub.remove(subscriber)
+        writer.cancel()
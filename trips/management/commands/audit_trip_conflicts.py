@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from trips.conflicts import audit
+from trips.models import Trip
+import time
+
+class Command(BaseCommand):
+    help = 'Find every bus or driver assigned to overlapping trips in a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--days', type=int, default=7, help='Number of days to audit')
+        parser.add_argument('--school', type=int, action='append', help='Only audit the given school (repeatable)')
+
+    def handle(self, *args, **options):
+        if options['start']:
+            first_day = datetime.strptime(options['start'], '%Y-%m-%d').date()
+        else:
+            first_day = timezone.localdate()
+        start = timezone.make_aware(datetime.combine(first_day, datetime.min.time()))
+        end = start + timedelta(days=options['days'])
+
+        try:
+            started = time.perf_counter()
+            conflicts = audit(start, end, options['school'])
+            trip_ids = {trip_id for conflict in conflicts for trip_id in conflict[2:]}
+            trips = Trip.objects.select_related('route').in_bulk(trip_ids)
+            for resource, resource_id, first, second in conflicts:
+                self.stdout.write(
+                    f'{resource} {resource_id}: trip {first} ({trips[first]}) overlaps trip {second} ({trips[second]})'
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully audited {first_day} to {end.date() - timedelta(days=1)}: '
+                    f'{len(conflicts)} conflicts in {time.perf_counter() - started:.2f} s'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error auditing trip conflicts: {str(e)}')
+            )
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from trips.ingestion import LocationBuffer, parse_points
+from trips.models import Trip, TripLocation
+from datetime import timedelta
+import random
+import time
+
+BENCHMARK_MARKER = 'ingestion-benchmark'
+
+class Command(BaseCommand):
+    help = 'Compare points/second of per-row TripLocation inserts against the buffered ingestion path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=5000, help='Number of points written by each path')
+        parser.add_argument('--request-size', type=int, default=20, help='Points per simulated device request')
+        parser.add_argument('--batch-size', type=int, default=500, help='Buffer size before a bulk flush')
+        parser.add_argument('--trip', type=int, help='Trip to attach points to (defaults to the latest trip)')
+
+    def make_points(self, count):
+        start = timezone.now() - timedelta(seconds=count)
+        return [
+            {
+                'latitude': random.uniform(17.3850, 17.4950),
+                'longitude': random.uniform(78.3350, 78.4950),
+                'speed': random.uniform(0, 40),
+                'timestamp': (start + timedelta(seconds=i)).isoformat(),
+            }
+            for i in range(count)
+        ]
+
+    def handle(self, *args, **options):
+        count = options['points']
+        request_size = options['request_size']
+
+        trip = Trip.objects.filter(pk=options['trip']).first() if options['trip'] else Trip.objects.first()
+        if not trip:
+            self.stdout.write(self.style.ERROR('No trips found. Please run generate_sample_trips first.'))
+            return
+
+        points = self.make_points(count)
+        requests = [points[i:i + request_size] for i in range(0, count, request_size)]
+
+        try:
+            # Current path: one INSERT and commit per point
+            started = time.perf_counter()
+            for request_points in requests:
+                for location in parse_points(request_points, trip.id):
+                    location.remarks = BENCHMARK_MARKER
+                    location.save()
+            per_row_elapsed = time.perf_counter() - started
+
+            # Buffered path: requests are queued and flushed with bulk_create
+            buffer = LocationBuffer(max_points=options['batch_size'], max_age=3600)
+            started = time.perf_counter()
+            for request_points in requests:
+                locations = parse_points(request_points, trip.id)
+                for location in locations:
+                    location.remarks = BENCHMARK_MARKER
+                buffer.extend(locations)
+            buffer.flush()
+            buffered_elapsed = time.perf_counter() - started
+        finally:
+            TripLocation.objects.filter(trip=trip, remarks=BENCHMARK_MARKER).delete()
+
+        per_row_rate = count / per_row_elapsed
+        buffered_rate = count / buffered_elapsed
+        self.stdout.write(f'Per-row create(): {per_row_rate:,.0f} points/s ({per_row_elapsed:.2f}s)')
+        self.stdout.write(f'Buffered bulk:    {buffered_rate:,.0f} points/s ({buffered_elapsed:.2f}s)')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {buffered_rate / per_row_rate:.1f}x for {count} points'))
@@ -1,9 +1,9 @@
-from django.core.management.base import BaseCommand
-from django.db import transaction
-from trips.models import Trip, TripStudent, TripLocation, TripEvent
+from django.core.management.base import BaseCommand, CommandError
+from trips.purge import CHUNK_SIZE, purge
+from datetime import date
 
 class Command(BaseCommand):
-    help = 'Clear all trip-related data from the database'
+    help = 'Delete trips and their students, locations and events in chunks, optionally by day range and school'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -11,33 +11,60 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip confirmation prompt'
         )
+        parser.add_argument('--start', type=date.fromisoformat, help='First scheduled day to delete (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last scheduled day to delete (YYYY-MM-DD)')
+        parser.add_argument('--school', type=int, action='append', help='Only this school (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Trips deleted per transaction')
+        parser.add_argument('--archive', help='Directory to write every chunk to as gzip NDJSON before deleting it')
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the progress of an interrupted run with the same filters'
+        )
 
     def handle(self, *args, **options):
+        if options['start'] and options['end'] and options['end'] < options['start']:
+            raise CommandError('--end cannot be before --start')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
         if not options['force']:
-            confirm = input('This will delete ALL trip data. Are you sure? (yes/no): ')
+            filtered = options['start'] or options['end'] or options['school']
+            scope = 'the selected trips' if filtered else 'ALL trip data'
+            confirm = input(f'This will delete {scope}. Are you sure? (yes/no): ')
             if confirm.lower() != 'yes':
                 self.stdout.write('Operation cancelled.')
                 return
 
+        def progress(summary):
+            self.stdout.write(
+                f"Deleted {summary['trips']} trips, {summary['rows']} rows "
+                f"({summary['rows'] / max(summary['seconds'], 1e-9):,.0f} rows/s)"
+            )
+
         try:
-            with transaction.atomic():
-                # Delete in order to respect foreign key constraints
-                trip_locations_count = TripLocation.objects.all().delete()[0]
-                trip_events_count = TripEvent.objects.all().delete()[0]
-                trip_students_count = TripStudent.objects.all().delete()[0]
-                trips_count = Trip.objects.all().delete()[0]
-
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Successfully deleted:\n'
-                        f'- {trips_count} trips\n'
-                        f'- {trip_students_count} trip students\n'
-                        f'- {trip_locations_count} trip locations\n'
-                        f'- {trip_events_count} trip events'
-                    )
+            summary = purge(
+                first_day=options['start'],
+                last_day=options['end'],
+                school_ids=options['school'],
+                chunk_size=options['chunk_size'],
+                archive=options['archive'],
+                restart=options['restart'],
+                progress=progress,
+            )
+            if summary['resumed']:
+                self.stdout.write('Resumed an interrupted run')
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully deleted:\n'
+                    + ''.join(f'- {count} {label}\n' for label, count in sorted(summary['deleted'].items()))
+                    + f"{summary['rows']} rows in {summary['seconds']:.2f} s "
+                    f"({summary['rows'] / max(summary['seconds'], 1e-9):,.0f} rows/s)"
                 )
+            )
 
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'Error clearing trip data: {str(e)}')
-            )
\ No newline at end of file
+            )
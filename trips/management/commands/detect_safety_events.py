@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from trips.models import Trip
+from trips.safety import get_thresholds, replay_trip
+import time
+
+class Command(BaseCommand):
+    help = 'Replay stored trips through the driving rules and record missing OVERSPEED, HARSH_BRAKING and STATIONARY events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, action='append', help='Only replay the given trip (repeatable)')
+        parser.add_argument('--school', type=int, help='Only replay trips of one school')
+        parser.add_argument('--since', help='Only replay trips scheduled to start on or after this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.filter(status__in=['IN_PROGRESS', 'COMPLETED'])
+        if options['trip']:
+            trips = trips.filter(pk__in=options['trip'])
+        if options['school']:
+            trips = trips.filter(school_id=options['school'])
+        if options['since']:
+            trips = trips.filter(scheduled_start_time__date__gte=options['since'])
+
+        try:
+            started = time.perf_counter()
+            thresholds = {}
+            replayed = recorded = 0
+            skipped = []
+            for trip_id, school_id in trips.order_by('id').values_list('id', 'school_id'):
+                if school_id not in thresholds:
+                    thresholds[school_id] = get_thresholds(school_id)
+                count = replay_trip(trip_id, thresholds[school_id])
+                if count is None:
+                    skipped.append(trip_id)
+                    continue
+                recorded += count
+                replayed += 1
+            if skipped:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f'Skipped {len(skipped)} trips whose raw points were purged, only their simplified '
+                        f'track is left: {", ".join(map(str, skipped[:20]))}{" ..." if len(skipped) > 20 else ""}'
+                    )
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully replayed {replayed} trips, recorded {recorded} events '
+                    f'in {time.perf_counter() - started:.2f} s'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error detecting safety events: {str(e)}')
+            )
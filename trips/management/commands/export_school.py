@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from schools.models import School
+from trips.export import CHUNK_SIZE, COMPRESSIONS, export_school
+from datetime import date
+import time
+
+class Command(BaseCommand):
+    help = "Export a school's data as a tar archive of compressed NDJSON, one file per model"
+
+    def add_arguments(self, parser):
+        parser.add_argument('school', type=int, help='School id')
+        parser.add_argument('--output', help='Archive path (defaults to school-<id>.tar)')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day of trips to export (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day of trips to export (YYYY-MM-DD)')
+        parser.add_argument(
+            '--compression',
+            choices=COMPRESSIONS,
+            default='gzip',
+            help='Compression of the NDJSON files, zstd needs the zstandard package'
+        )
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        school_id = options['school']
+        if not School.objects.filter(pk=school_id).exists():
+            raise CommandError(f'School {school_id} does not exist')
+        if options['start'] and options['end'] and options['end'] < options['start']:
+            raise CommandError('--end cannot be before --start')
+        path = options['output'] or f'school-{school_id}.tar'
+
+        try:
+            started = time.perf_counter()
+            size = export_school(
+                school_id, path,
+                first_day=options['start'],
+                last_day=options['end'],
+                compression=options['compression'],
+                chunk_size=options['chunk_size'],
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully exported school {school_id} to {path} '
+                    f'({size / 1e6:.1f} MB in {time.perf_counter() - started:.2f} s)'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error exporting school: {str(e)}'))
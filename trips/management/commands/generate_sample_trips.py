@@ -1,14 +1,142 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.db import transaction
-from trips.models import Trip, TripStudent, TripLocation, TripEvent
-from schools.models import School, Route, RouteStudent
+from common.parallel import run_sharded
+from trips.materialize import TripMaterializer, build_trip, route_stops
+from trips.models import TripLocation, TripEvent
+from schools.models import School, Route
 from vehicles.models import Bus
 from accounts.models import Driver
 from datetime import timedelta, datetime
 import random
+import time
 import pytz
 
+# Indian timezone
+tz = pytz.timezone('Asia/Kolkata')
+
+# Typical school timings in India
+SCHOOL_TIMINGS = {
+    'PICKUP': {
+        'start_range': ('06:30', '07:30'),  # Pickup starts between 6:30-7:30 AM
+        'duration': timedelta(minutes=45)    # Average pickup route duration
+    },
+    'DROP': {
+        'start_range': ('14:00', '15:30'),  # Drop starts between 2:00-3:30 PM
+        'duration': timedelta(minutes=45)    # Average drop route duration
+    }
+}
+
+
+def generate_school_trips(school_id, days, today):
+    """Generate `days` days of trips for one school in one transaction, returns its summary"""
+    started = time.perf_counter()
+    routes = list(Route.objects.filter(school_id=school_id))
+    bus_ids = list(Bus.objects.filter(school_id=school_id, status='ACTIVE').values_list('id', flat=True))
+    driver_ids = list(Driver.objects.filter(school_id=school_id).values_list('id', flat=True))
+    if not (routes and bus_ids and driver_ids):
+        return {'school': school_id, 'trips': 0, 'rows': 0, 'seconds': time.perf_counter() - started}
+    stops = route_stops(routes)
+
+    with transaction.atomic(), TripMaterializer() as materializer:
+        # Generate trips for each day
+        for day_offset in range(days):
+            current_date = today - timedelta(days=day_offset)
+            is_completed = current_date < today
+
+            # Create pickup and drop trips for each route
+            for route in routes:
+                stop_ids = stops.get(route.id, [])
+                for trip_type, timing in SCHOOL_TIMINGS.items():
+                    # Generate start time
+                    start_hour, start_minute = map(int, timing['start_range'][0].split(':'))
+                    start_minute += random.randint(0, 60)  # Random minutes
+                    if start_minute >= 60:
+                        start_hour += 1
+                        start_minute -= 60
+
+                    scheduled_start = tz.localize(datetime.combine(
+                        current_date,
+                        datetime.min.time().replace(hour=start_hour, minute=start_minute)
+                    ))
+
+                    trip, trip_students = build_trip(
+                        route, trip_type, scheduled_start, timing['duration'], stop_ids,
+                        bus_id=random.choice(bus_ids),
+                        driver_id=random.choice(driver_ids),
+                        offsets=[timedelta(minutes=2 * i) for i in range(len(stop_ids))],  # 2 minutes between stops
+                    )
+                    locations = []
+
+                    # Actual times are set before the rows are written
+                    if is_completed:
+                        delay = random.randint(-5, 15)  # Random delay between -5 to +15 minutes
+                        trip.status = 'COMPLETED'
+                        trip.actual_start_time = trip.scheduled_start_time + timedelta(minutes=delay)
+                        trip.actual_end_time = trip.scheduled_end_time + timedelta(minutes=delay)
+                        for trip_student in trip_students:
+                            actual_delay = random.randint(-2, 5)  # Random delay between -2 to +5 minutes
+                            trip_student.status = 'DROPPED_OFF'
+                            trip_student.actual_time = trip_student.scheduled_time + timedelta(minutes=actual_delay)
+                        locations = generate_trip_locations(trip)
+
+                    materializer.add(trip, trip_students, locations, generate_trip_events(trip))
+
+    return {
+        'school': school_id,
+        'trips': materializer.counts['trips'],
+        'rows': sum(materializer.counts.values()),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def generate_trip_locations(trip):
+    """Generate location updates every 2 minutes for the trip duration"""
+    locations = []
+    if trip.actual_start_time and trip.actual_end_time:
+        current_time = trip.actual_start_time
+        while current_time <= trip.actual_end_time:
+            locations.append(TripLocation(
+                latitude=round(random.uniform(17.3850, 17.4950), 6),  # Example: Hyderabad coordinates
+                longitude=round(random.uniform(78.3350, 78.4950), 6),
+                timestamp=current_time,
+                speed=round(random.uniform(0, 40), 2)  # Speed between 0-40 km/h
+            ))
+            current_time += timedelta(minutes=2)
+    return locations
+
+
+def generate_trip_events(trip):
+    """Generate relevant events for the trip"""
+    # Create event timestamp based on trip status
+    event_time = trip.actual_start_time if trip.status == 'COMPLETED' else trip.scheduled_start_time
+
+    # Start event
+    events = [TripEvent(
+        event_type='START',
+        timestamp=event_time,
+        description='Trip started'
+    )]
+
+    # Random events during trip (20% chance for delay)
+    if trip.status == 'COMPLETED' and random.random() < 0.2:
+        delay_time = event_time + timedelta(minutes=random.randint(5, 30))
+        events.append(TripEvent(
+            event_type='DELAY',
+            timestamp=delay_time,
+            description='Traffic delay'
+        ))
+
+    # End event
+    end_time = trip.actual_end_time if trip.status == 'COMPLETED' else trip.scheduled_end_time
+    events.append(TripEvent(
+        event_type='END',
+        timestamp=end_time,
+        description='Trip completed'
+    ))
+    return events
+
+
 class Command(BaseCommand):
     help = 'Generate sample trip data for testing'
 
@@ -19,167 +147,38 @@ class Command(BaseCommand):
             default=7,
             help='Number of days to generate trips for'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Worker processes, one school at a time each (defaults to the number of CPUs)'
+        )
 
     def handle(self, *args, **options):
         days = options['days']
-        
-        # Indian timezone
-        tz = pytz.timezone('Asia/Kolkata')
-        
-        # Typical school timings in India
-        SCHOOL_TIMINGS = {
-            'PICKUP': {
-                'start_range': ('06:30', '07:30'),  # Pickup starts between 6:30-7:30 AM
-                'duration': timedelta(minutes=45)    # Average pickup route duration
-            },
-            'DROP': {
-                'start_range': ('14:00', '15:30'),  # Drop starts between 2:00-3:30 PM
-                'duration': timedelta(minutes=45)    # Average drop route duration
-            }
-        }
 
         try:
-            schools = School.objects.all()
-            if not schools:
+            names = dict(School.objects.order_by('id').values_list('id', 'name'))
+            if not names:
                 self.stdout.write(self.style.ERROR('No schools found. Please run generate_sample_schools first.'))
                 return
 
-            total_trips_created = 0
+            started = time.perf_counter()
             today = timezone.now().date()
-
-            with transaction.atomic():
-                # Generate trips for each day
-                for day_offset in range(days):
-                    current_date = today - timedelta(days=day_offset)
-                    
-                    for school in schools:
-                        self.stdout.write(f'Creating trips for school: {school.name} on {current_date}')
-                        
-                        routes = Route.objects.filter(school=school)
-                        buses = Bus.objects.filter(school=school, status='ACTIVE')
-                        drivers = Driver.objects.filter(school=school)
-
-                        if not (routes and buses and drivers):
-                            continue
-
-                        # Create pickup and drop trips for each route
-                        for route in routes:
-                            for trip_type, timing in SCHOOL_TIMINGS.items():
-                                # Generate start time
-                                start_hour, start_minute = map(int, timing['start_range'][0].split(':'))
-                                start_minute += random.randint(0, 60)  # Random minutes
-                                if start_minute >= 60:
-                                    start_hour += 1
-                                    start_minute -= 60
-                                
-                                scheduled_start = tz.localize(datetime.combine(
-                                    current_date,
-                                    datetime.min.time().replace(hour=start_hour, minute=start_minute)
-                                ))
-                                
-                                scheduled_end = scheduled_start + timing['duration']
-                                is_completed = current_date < today
-
-                                # Create trip
-                                trip = Trip.objects.create(
-                                    school=school,
-                                    route=route,
-                                    bus=random.choice(buses),
-                                    driver=random.choice(drivers),
-                                    trip_type=trip_type,
-                                    scheduled_start_time=scheduled_start,
-                                    scheduled_end_time=scheduled_end,
-                                    status='COMPLETED' if is_completed else 'SCHEDULED'
-                                )
-
-                                # Add actual times for completed trips
-                                if is_completed:
-                                    delay = random.randint(-5, 15)  # Random delay between -5 to +15 minutes
-                                    trip.actual_start_time = scheduled_start + timedelta(minutes=delay)
-                                    trip.actual_end_time = scheduled_end + timedelta(minutes=delay)
-                                    trip.save()
-
-                                # Create trip students
-                                route_students = RouteStudent.objects.filter(route=route)
-                                for route_student in route_students:
-                                    # Calculate scheduled time based on sequence number
-                                    time_offset = (route_student.sequence_number - 1) * 2  # 2 minutes between stops
-                                    scheduled_time = scheduled_start + timedelta(minutes=time_offset)
-
-                                    trip_student = TripStudent.objects.create(
-                                        trip=trip,
-                                        route_student=route_student,
-                                        scheduled_time=scheduled_time,
-                                        status='DROPPED_OFF' if is_completed else 'SCHEDULED'
-                                    )
-
-                                    # Add actual time for completed trips
-                                    if is_completed:
-                                        actual_delay = random.randint(-2, 5)  # Random delay between -2 to +5 minutes
-                                        trip_student.actual_time = scheduled_time + timedelta(minutes=actual_delay)
-                                        trip_student.save()
-
-                                # Generate trip locations for completed trips
-                                if is_completed:
-                                    self.generate_trip_locations(trip)
-
-                                # Generate trip events
-                                self.generate_trip_events(trip)
-
-                                total_trips_created += 1
-                                self.stdout.write(f'Created {trip_type} trip for route: {route.name}')
+            total_trips_created = 0
+            for summary in run_sharded(generate_school_trips, list(names), (days, today), options['workers']):
+                total_trips_created += summary['trips']
+                self.stdout.write(
+                    f"Created {summary['trips']} trips ({summary['rows']} rows) for school: "
+                    f"{names[summary['school']]} in {summary['seconds']:.2f} s"
+                )
 
             self.stdout.write(
-                self.style.SUCCESS(f'Successfully created {total_trips_created} trips')
+                self.style.SUCCESS(
+                    f'Successfully created {total_trips_created} trips in {time.perf_counter() - started:.2f} s'
+                )
             )
 
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'Error creating trips: {str(e)}')
             )
-
-    def generate_trip_locations(self, trip):
-        """Generate location updates every 2 minutes for the trip duration"""
-        if trip.actual_start_time and trip.actual_end_time:
-            current_time = trip.actual_start_time
-            while current_time <= trip.actual_end_time:
-                TripLocation.objects.create(
-                    trip=trip,
-                    latitude=random.uniform(17.3850, 17.4950),  # Example: Hyderabad coordinates
-                    longitude=random.uniform(78.3350, 78.4950),
-                    timestamp=current_time,
-                    speed=random.uniform(0, 40)  # Speed between 0-40 km/h
-                )
-                current_time += timedelta(minutes=2)
-
-    def generate_trip_events(self, trip):
-        """Generate relevant events for the trip"""
-        # Create event timestamp based on trip status
-        event_time = trip.actual_start_time if trip.status == 'COMPLETED' else trip.scheduled_start_time
-        
-        # Start event
-        TripEvent.objects.create(
-            trip=trip,
-            event_type='START',
-            timestamp=event_time,
-            description='Trip started'
-        )
-
-        # Random events during trip (20% chance for delay)
-        if trip.status == 'COMPLETED' and random.random() < 0.2:
-            delay_time = event_time + timedelta(minutes=random.randint(5, 30))
-            TripEvent.objects.create(
-                trip=trip,
-                event_type='DELAY',
-                timestamp=delay_time,
-                description='Traffic delay'
-            )
-
-        # End event
-        end_time = trip.actual_end_time if trip.status == 'COMPLETED' else trip.scheduled_end_time
-        TripEvent.objects.create(
-            trip=trip,
-            event_type='END',
-            timestamp=end_time,
-            description='Trip completed'
-        )
\ No newline at end of file
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from common.parallel import run_sharded
+from trips.synthetic import MAX_SEED, SCALES, generate_school, is_loaded
+from datetime import date
+import time
+
+class Command(BaseCommand):
+    help = 'Generate a reproducible synthetic dataset (schools to trip locations) at a named scale for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='S', help='Dataset size, see trips.synthetic.SCALES')
+        parser.add_argument('--seed', type=int, default=42, help=f'Random seed, 0 to {MAX_SEED}')
+        parser.add_argument(
+            '--last-day',
+            type=date.fromisoformat,
+            help='Trips end the day before this date (YYYY-MM-DD, defaults to today); fix it to reproduce a dataset'
+        )
+        parser.add_argument('--schools', type=int, help='Override the number of schools of the scale')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Worker processes, one school at a time each (defaults to the number of CPUs)'
+        )
+
+    def handle(self, *args, **options):
+        scale, seed = options['scale'], options['seed']
+        if not 0 <= seed <= MAX_SEED:
+            raise CommandError(f'--seed must be between 0 and {MAX_SEED}')
+        if is_loaded(seed):
+            raise CommandError(f'A synthetic dataset with seed {seed} is already loaded, use another seed')
+        last_day = options['last_day'] or timezone.localdate()
+        schools = options['schools'] or SCALES[scale]['schools']
+
+        try:
+            self.stdout.write(f'Generating scale {scale} with seed {seed}: {schools} schools, {SCALES[scale]}')
+            started = time.perf_counter()
+            totals = {'students': 0, 'trips': 0, 'locations': 0, 'rows': 0}
+            for summary in run_sharded(generate_school, list(range(schools)), (scale, seed, last_day), options['workers']):
+                for key in totals:
+                    totals[key] += summary[key]
+                self.stdout.write(
+                    f"School {summary['school']}: {summary['trips']} trips, {summary['locations']} locations "
+                    f"({summary['rows']} rows) in {summary['seconds']:.2f} s"
+                )
+
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Successfully generated {totals['students']} students, {totals['trips']} trips and "
+                    f"{totals['locations']} locations ({totals['rows'] / elapsed:,.0f} rows/s) in {elapsed:.2f} s"
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error generating synthetic data: {str(e)}'))
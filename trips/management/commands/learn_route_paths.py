@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from trips.mapmatch import MIN_PATH_TRACKS, learn_and_match
+from trips.models import Trip
+import time
+
+class Command(BaseCommand):
+    help = 'Learn the reference path of each route from its completed trips and map-match those trips onto it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', type=int, action='append', help='Only learn the given route (repeatable)')
+        parser.add_argument('--school', type=int, help='Only learn routes of one school')
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.filter(status='COMPLETED')
+        if options['route']:
+            trips = trips.filter(route_id__in=options['route'])
+        if options['school']:
+            trips = trips.filter(school_id=options['school'])
+        pairs = trips.order_by('route_id', 'trip_type').values_list('route_id', 'trip_type').distinct()
+
+        try:
+            started = time.perf_counter()
+            learned = matched = skipped = 0
+            for route_id, trip_type in pairs:
+                path, count = learn_and_match(route_id, trip_type)
+                if path is None:
+                    skipped += 1
+                    continue
+                learned += 1
+                matched += count
+                self.stdout.write(
+                    f'Route {route_id} {trip_type}: {path.length_m / 1000:.2f} km from {path.track_count} tracks, '
+                    f'{count} trips matched'
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully learned {learned} paths and matched {matched} trips '
+                    f'in {time.perf_counter() - started:.2f} s '
+                    f'({skipped} skipped with fewer than {MIN_PATH_TRACKS} tracks)'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error learning route paths: {str(e)}')
+            )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from trips.segments import learn
+import time
+
+class Command(BaseCommand):
+    help = 'Fold completed trips into the learned stop-to-stop travel time distributions (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the distributions from every completed trip')
+
+    def handle(self, *args, **options):
+        try:
+            started = time.perf_counter()
+            trips, segments = learn(full=options['full'])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully learned {trips} trips into {segments} segment rows '
+                    f'in {time.perf_counter() - started:.2f} s'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error learning segment times: {str(e)}')
+            )
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from trips.live import LiveHub, Subscriber
+import asyncio
+import random
+import resource
+import statistics
+import time
+
+class Command(BaseCommand):
+    help = 'Load test the live tracking fan-out with many concurrent subscribers on one event loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000, help='Number of concurrent subscribers')
+        parser.add_argument('--trips', type=int, default=300, help='Number of trips publishing positions')
+        parser.add_argument('--schools', type=int, default=20, help='Number of schools the trips belong to')
+        parser.add_argument('--rounds', type=int, default=20, help='Position updates published per trip')
+        parser.add_argument('--interval', type=float, default=0.25, help='Seconds between publishing rounds')
+        parser.add_argument('--slow-fraction', type=float, default=0.05, help='Share of subscribers with a slow connection')
+        parser.add_argument('--slow-delay', type=float, default=1.0, help='Seconds a slow subscriber needs per frame')
+
+    def handle(self, *args, **options):
+        result = asyncio.run(self.run(options))
+        fast = sorted(result['latencies'])
+
+        self.stdout.write(f"Subscribers:        {options['subscribers']:,}")
+        self.stdout.write(f"Messages published: {result['published']:,} ({result['publish_rate']:,.0f}/s publish throughput)")
+        self.stdout.write(f"Frames delivered:   {result['delivered']:,}")
+        self.stdout.write(f"Coalesced updates:  {result['coalesced']:,} (slow clients)")
+        if fast:
+            self.stdout.write(
+                f"Fast client latency p50 {statistics.median(fast) * 1000:.1f} ms, "
+                f"p99 {fast[int(len(fast) * 0.99)] * 1000:.1f} ms, max {fast[-1] * 1000:.1f} ms"
+            )
+        self.stdout.write(f"Peak RSS:           {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+        self.stdout.write(self.style.SUCCESS('Load test finished'))
+
+    async def run(self, options):
+        hub = LiveHub()
+        hub.attach(asyncio.get_running_loop())
+        published_at = {}
+        latencies = []
+        delivered = 0
+
+        def make_send(slow):
+            async def send(message):
+                nonlocal delivered
+                delivered += 1
+                if slow:
+                    await asyncio.sleep(options['slow_delay'])
+                else:
+                    latencies.append(time.perf_counter() - published_at[message['text']])
+            return send
+
+        trips = [(trip_id, trip_id % options['schools']) for trip_id in range(options['trips'])]
+        subscribers = []
+        for i in range(options['subscribers']):
+            subscriber = Subscriber(make_send(random.random() < options['slow_fraction']))
+            if i % 50 == 0:
+                # Roughly one school admin dashboard per fifty parents
+                hub.subscribe(subscriber, ('school', random.randrange(options['schools'])))
+            else:
+                hub.subscribe(subscriber, ('trip', random.randrange(options['trips'])))
+            subscribers.append(subscriber)
+        writers = [asyncio.create_task(subscriber.run()) for subscriber in subscribers]
+
+        published = 0
+        publish_time = 0.0
+        for round_number in range(options['rounds']):
+            started = time.perf_counter()
+            for trip_id, school_id in trips:
+                data = {
+                    'latitude': 17.4 + random.random() / 10,
+                    'longitude': 78.4 + random.random() / 10,
+                    'speed': random.uniform(0, 40),
+                    'round': round_number,
+                }
+                text = hub.publish('position', trip_id, school_id, data)
+                if text:
+                    published_at[text] = started
+                published += 1
+            publish_time += time.perf_counter() - started
+            await asyncio.sleep(options['interval'])
+
+        await asyncio.sleep(options['interval'])
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+
+        return {
+            'published': published,
+            'publish_rate': published / publish_time if publish_time else 0,
+            'delivered': delivered,
+            'coalesced': sum(subscriber.coalesced for subscriber in subscribers),
+            'latencies': latencies,
+        }
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from trips.partitions import (
+    INTERVALS, PARTITIONED_TABLES, ensure_partitions, expired_partitions,
+    is_partitioned, remove_partition, split_default_partition,
+)
+
+class Command(BaseCommand):
+    help = 'Create upcoming TripLocation/TripEvent partitions and detach or drop expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            default=getattr(settings, 'TRIP_PARTITION_PREMAKE', 3),
+            help='Number of future periods to keep partitions ready for'
+        )
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=getattr(settings, 'TRIP_PARTITION_RETENTION_DAYS', None),
+            help='Remove partitions whose whole range is older than this (default: keep everything)'
+        )
+        parser.add_argument(
+            '--interval',
+            choices=INTERVALS,
+            default=getattr(settings, 'TRIP_PARTITION_INTERVAL', 'month'),
+            help='Partition period, must match the existing partitions'
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop expired partitions instead of detaching them'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list the partitions that would be removed'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Table partitioning requires PostgreSQL')
+
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table):
+                self.stdout.write(self.style.WARNING(f'{table} is not partitioned, run migrate first'))
+                continue
+
+            if not options['dry_run']:
+                created = split_default_partition(table, options['interval'])
+                created += ensure_partitions(table, options['ahead'], options['interval'])
+                for name in created:
+                    self.stdout.write(f'Created partition {name}')
+
+            if options['retention_days'] is None:
+                continue
+
+            action = 'Dropped' if options['drop'] else 'Detached'
+            for name in expired_partitions(table, options['retention_days']):
+                if options['dry_run']:
+                    self.stdout.write(f'Would remove partition {name}')
+                    continue
+                remove_partition(table, name, drop=options['drop'])
+                self.stdout.write(f'{action} partition {name}')
+
+        self.stdout.write(self.style.SUCCESS('Partition maintenance finished'))
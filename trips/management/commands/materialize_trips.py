@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from schools.models import School
+from common.parallel import run_sharded
+from trips.materialize import materialize_school
+import time
+
+class Command(BaseCommand):
+    help = 'Create the Trip rows of the rolling horizon from the trip templates, school by school in parallel (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='First day to materialize (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--days', type=int, help='Number of days, defaults to TRIP_MATERIALIZATION_HORIZON_DAYS')
+        parser.add_argument('--school', type=int, action='append', help='Only materialize the given school (repeatable)')
+        parser.add_argument('--workers', type=int, help='Worker processes, defaults to the number of CPUs')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            first_day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+        else:
+            first_day = timezone.localdate()
+        days = options['days'] or getattr(settings, 'TRIP_MATERIALIZATION_HORIZON_DAYS', 3)
+        days = [first_day + timedelta(days=offset) for offset in range(days)]
+
+        schools = School.objects.order_by('id')
+        if options['school']:
+            schools = schools.filter(pk__in=options['school'])
+        names = dict(schools.values_list('id', 'name'))
+
+        try:
+            started = time.perf_counter()
+            trips = trip_students = 0
+            for summary in run_sharded(materialize_school, list(names), (days,), options['workers']):
+                trips += summary['trips']
+                trip_students += summary['trip_students']
+                self.stdout.write(
+                    f"{names[summary['school']]}: {summary['trips']} trips, {summary['trip_students']} students, "
+                    f"{len(summary['rejected'])} skipped in {summary['seconds']:.2f} s"
+                )
+                for trip_type, route_id, scheduled_start, resources in summary['rejected']:
+                    self.stdout.write(self.style.WARNING(
+                        f'  Skipped {trip_type} trip of route {route_id} at {scheduled_start}: '
+                        + ', '.join(f'{resource} already booked' for resource in resources)
+                    ))
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully created {trips} trips with {trip_students} students for {len(names)} schools '
+                    f'in {time.perf_counter() - started:.2f} s'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error creating trips: {str(e)}')
+            )
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from trips.models import Trip, TripLocation
+from trips.tracks import pack_trip, purge_raw_locations
+
+class Command(BaseCommand):
+    help = 'Simplify raw TripLocation rows of completed trips into compact TripTrack records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, action='append', help='Only pack the given trip (repeatable)')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=getattr(settings, 'TRIP_TRACK_TOLERANCE_M', 5.0),
+            help='Simplification tolerance in metres (0 keeps every point)'
+        )
+        parser.add_argument(
+            '--repack',
+            action='store_true',
+            help='Also rebuild tracks of trips that are already packed'
+        )
+        parser.add_argument(
+            '--purge-raw',
+            action='store_true',
+            help='Delete raw rows of packed trips older than the retention window'
+        )
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=getattr(settings, 'TRIP_RAW_LOCATION_RETENTION_DAYS', 7),
+            help='Days to keep raw rows after a trip ended'
+        )
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.filter(status='COMPLETED')
+        if options['trip']:
+            trips = trips.filter(pk__in=options['trip'])
+        elif not options['repack']:
+            trips = trips.filter(track__isnull=True)
+        trip_ids = (
+            TripLocation.objects.filter(trip__in=trips)
+            .order_by('trip_id')
+            .values_list('trip_id', flat=True)
+            .distinct()
+        )
+
+        packed_trips = raw_points = kept_points = 0
+        try:
+            for trip_id in list(trip_ids):
+                track = pack_trip(trip_id, tolerance=options['tolerance'])
+                packed_trips += 1
+                raw_points += track.raw_point_count
+                kept_points += track.point_count
+                self.stdout.write(
+                    f'Packed trip {trip_id}: {track.raw_point_count} -> {track.point_count} points '
+                    f'({track.compression_ratio:.1f}x)'
+                )
+
+            ratio = raw_points / kept_points if kept_points else 0
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully packed {packed_trips} trips: {raw_points} -> {kept_points} points ({ratio:.1f}x)'
+                )
+            )
+
+            if options['purge_raw']:
+                deleted = purge_raw_locations(options['retention_days'])
+                self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} raw locations past retention'))
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error packing trip tracks: {str(e)}')
+            )
@@ -0,0 +1,47 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from trips.analytics import bus_distances, summarize_trip
+from trips.models import Trip
+import time
+
+class Command(BaseCommand):
+    help = 'Compute TripSummary rows for completed trips and report kilometres per bus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trip', type=int, action='append', help='Only summarize the given trip (repeatable)')
+        parser.add_argument('--resummarize', action='store_true', help='Also recompute trips that already have a summary')
+        parser.add_argument('--report-month', help='Print kilometres per bus for a month (YYYY-MM) afterwards')
+        parser.add_argument('--school', type=int, help='Limit the report to one school')
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.filter(status='COMPLETED')
+        if options['trip']:
+            trips = trips.filter(pk__in=options['trip'])
+        elif not options['resummarize']:
+            trips = trips.filter(summary__isnull=True)
+
+        summarized = 0
+        try:
+            started = time.perf_counter()
+            for trip_id in trips.order_by('id').values_list('id', flat=True):
+                if summarize_trip(trip_id) is not None:
+                    summarized += 1
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully summarized {summarized} trips in {time.perf_counter() - started:.2f} s')
+            )
+
+            if options['report_month']:
+                month = datetime.strptime(options['report_month'], '%Y-%m')
+                start = timezone.make_aware(month)
+                end = timezone.make_aware(month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1))
+                for row in bus_distances(start, end, options['school']):
+                    self.stdout.write(
+                        f"{row['registration_number']:<16} {row['trips']:>4} trips "
+                        f"{row['distance_km']:>9.1f} km {row['moving_hours']:>6.1f} h moving"
+                    )
+
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error summarizing trips: {str(e)}')
+            )
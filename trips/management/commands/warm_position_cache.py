@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from trips import positions
+
+class Command(BaseCommand):
+    help = 'Load the latest position of every in-progress trip into the position cache'
+
+    def handle(self, *args, **options):
+        count = positions.warm()
+        self.stdout.write(self.style.SUCCESS(f'Cached latest positions for {count} trips'))
@@ -0,0 +1,333 @@
+"""
+Map matching of GPS points onto the reference path of a route.
+
+A RoutePath is learned per route and trip type from the tracks of recent
+completed trips: every track is resampled to the same number of points by
+arc length, tracks far from the most central one (detours) are dropped and
+the path is the point-wise median of the rest.
+
+Matching is a hidden Markov model over the path segments (Newson & Krumm):
+the candidates of a point are its projections on the CANDIDATES nearest
+segments, emission is Gaussian in the distance to the segment, transition
+favours moving along the path by about as much as the straight distance
+between the fixes and forbids going back by more than BACKTRACK_M. Batch
+matching runs Viterbi over the whole trip, live matching keeps only the
+scores of the last fix and reports its most likely candidate. Points
+further than SEARCH_RADIUS_M from the path are left unmatched and break
+the chain.
+"""
+import threading
+
+import numpy as np
+from django.db import transaction
+
+from common.geo import from_local_xy, haversine, to_local_xy
+
+from . import positions
+from .models import RoutePath, Trip, TripSummary
+from .simplify import douglas_peucker
+from .tracks import load_trip_points
+
+PATH_HISTORY_TRIPS = 20
+MIN_PATH_TRACKS = 3
+PATH_SPACING_M = 10.0  # resampling step of the learned path
+MAX_PATH_POINTS = 5000
+PATH_TOLERANCE_M = 2.0  # simplification of the stored path
+OUTLIER_FACTOR = 3.0  # tracks further than this times the median spread are detours
+GPS_SIGMA_M = 10.0
+TRANSITION_BETA_M = 20.0
+BACKTRACK_M = 30.0
+CANDIDATES = 4
+SEARCH_RADIUS_M = 60.0
+CHUNK_POINTS = 1000  # points projected onto the path at once
+
+
+def match_key(trip_id):
+    return f'match:{trip_id}'
+
+
+def encode_path(latitudes, longitudes):
+    return np.concatenate([latitudes, longitudes]).astype('<f8').tobytes()
+
+
+def decode_path(data):
+    values = np.frombuffer(bytes(data), dtype='<f8')
+    half = len(values) // 2
+    return values[:half], values[half:]
+
+
+def resample(x, y, count):
+    """`count` points evenly spaced along the polyline (x, y)"""
+    measure = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    at = np.linspace(0, measure[-1], count)
+    return np.interp(at, measure, x), np.interp(at, measure, y)
+
+
+def learn_path(route_id, trip_type, history=PATH_HISTORY_TRIPS, min_tracks=MIN_PATH_TRACKS):
+    """Learn and store the RoutePath of a route, returns None when there are too few tracks"""
+    trip_ids = (
+        Trip.objects.filter(route_id=route_id, trip_type=trip_type, status='COMPLETED')
+        .order_by('-scheduled_start_time')
+        .values_list('id', flat=True)[:history]
+    )
+    tracks = []
+    for trip_id in trip_ids:
+        _, _, latitudes, longitudes, _ = load_trip_points(trip_id)
+        if len(latitudes) >= 2:
+            tracks.append((latitudes, longitudes))
+    if len(tracks) < min_tracks:
+        return None
+
+    origin = (tracks[0][0][0], tracks[0][1][0])
+    projected = [to_local_xy(latitudes, longitudes, origin=origin) for latitudes, longitudes in tracks]
+    lengths = [np.hypot(np.diff(x), np.diff(y)).sum() for x, y in projected]
+    count = int(np.clip(np.median(lengths) / PATH_SPACING_M, 2, MAX_PATH_POINTS))
+    xs, ys = (np.array(values) for values in zip(*(resample(x, y, count) for x, y in projected)))
+
+    # Mean distance between every pair of tracks, point by point
+    spread = np.hypot(xs[:, None, :] - xs[None, :, :], ys[:, None, :] - ys[None, :, :]).mean(axis=2)
+    centre = int(np.argmin(spread.sum(axis=1)))
+    distances = spread[centre]
+    keep = distances <= OUTLIER_FACTOR * max(float(np.median(distances)), GPS_SIGMA_M)
+    x = np.median(xs[keep], axis=0)
+    y = np.median(ys[keep], axis=0)
+
+    simplified = douglas_peucker(x, y, PATH_TOLERANCE_M)
+    x, y = x[simplified], y[simplified]
+    latitudes, longitudes = from_local_xy(x, y, origin)
+    path, _ = RoutePath.objects.update_or_create(
+        route_id=route_id,
+        trip_type=trip_type,
+        defaults={
+            'point_count': len(latitudes),
+            'length_m': float(np.hypot(np.diff(x), np.diff(y)).sum()),
+            'track_count': int(keep.sum()),
+            'data': encode_path(latitudes, longitudes),
+        },
+    )
+    return path
+
+
+class PathMatcher:
+    """Segments of a reference path in a local plane, ready for projections"""
+
+    def __init__(self, latitudes, longitudes):
+        self.origin = (float(latitudes[0]), float(longitudes[0]))
+        x, y = to_local_xy(latitudes, longitudes, origin=self.origin)
+        self.start_x, self.start_y = x[:-1], y[:-1]
+        self.dx, self.dy = np.diff(x), np.diff(y)
+        self.lengths = np.hypot(self.dx, self.dy)
+        self.length_sq = np.maximum(self.lengths ** 2, 1e-9)
+        self.measures = np.concatenate(([0.0], np.cumsum(self.lengths)))[:-1]
+        self.length_m = float(self.lengths.sum())
+        self.k = min(CANDIDATES, len(self.lengths))
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(*decode_path(path.data))
+
+    def to_xy(self, latitudes, longitudes):
+        return to_local_xy(latitudes, longitudes, origin=self.origin)
+
+    def to_degrees(self, x, y):
+        return from_local_xy(x, y, self.origin)
+
+    def candidates(self, x, y):
+        """
+        Projections of points (x, y) on their nearest segments, as (n, k) arrays:
+        (distance to the segment, measure along the path, snapped x, snapped y)
+        """
+        results = []
+        for start in range(0, len(x), CHUNK_POINTS):
+            px = np.asarray(x[start:start + CHUNK_POINTS])[:, None]
+            py = np.asarray(y[start:start + CHUNK_POINTS])[:, None]
+            t = np.clip(((px - self.start_x) * self.dx + (py - self.start_y) * self.dy) / self.length_sq, 0, 1)
+            sx = self.start_x + t * self.dx
+            sy = self.start_y + t * self.dy
+            distances = np.hypot(px - sx, py - sy)
+            nearest = np.argpartition(distances, self.k - 1, axis=1)[:, :self.k]
+            distances, t, sx, sy = (np.take_along_axis(values, nearest, axis=1) for values in (distances, t, sx, sy))
+            results.append((distances, self.measures[nearest] + t * self.lengths[nearest], sx, sy))
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    @staticmethod
+    def emission(distances):
+        return np.where(distances <= SEARCH_RADIUS_M, -0.5 * (distances / GPS_SIGMA_M) ** 2, -np.inf)
+
+    @staticmethod
+    def transition(previous_measures, measures, straight):
+        """(k, k) log probabilities of moving from each previous candidate to each candidate"""
+        along = measures[None, :] - previous_measures[:, None]
+        return np.where(along >= -BACKTRACK_M, -np.abs(along - straight) / TRANSITION_BETA_M, -np.inf)
+
+    def match(self, latitudes, longitudes):
+        """
+        Snap a sequence of points, returns (latitudes, longitudes, measures)
+        with NaN for the points left unmatched
+        """
+        count = len(latitudes)
+        matched = np.full((3, count), np.nan)
+        if not count:
+            return tuple(matched)
+        x, y = self.to_xy(latitudes, longitudes)
+        distances, measures, sx, sy = self.candidates(x, y)
+        emissions = self.emission(distances)
+        straight = np.concatenate(([0.0], np.hypot(np.diff(x), np.diff(y))))
+
+        chosen = np.full(count, -1)
+        backpointers = np.zeros((count, self.k), dtype=np.int64)
+        scores = None
+        chain_start = 0
+        for i in range(count):
+            if scores is not None:
+                total = scores[:, None] + self.transition(measures[i - 1], measures[i], straight[i]) + emissions[i][None, :]
+                backpointers[i] = np.argmax(total, axis=0)
+                new_scores = total[backpointers[i], np.arange(self.k)]
+                if np.isfinite(new_scores).any():
+                    scores = new_scores
+                    continue
+                self.backtrack(scores, backpointers, chain_start, i - 1, chosen)
+            # Start a new chain here, or leave the point unmatched
+            scores = emissions[i] if np.isfinite(emissions[i]).any() else None
+            chain_start = i
+        if scores is not None:
+            self.backtrack(scores, backpointers, chain_start, count - 1, chosen)
+
+        rows = np.flatnonzero(chosen >= 0)
+        columns = chosen[rows]
+        matched[0][rows], matched[1][rows] = self.to_degrees(sx[rows, columns], sy[rows, columns])
+        matched[2][rows] = measures[rows, columns]
+        return tuple(matched)
+
+    @staticmethod
+    def backtrack(scores, backpointers, first, last, chosen):
+        state = int(np.argmax(scores))
+        for i in range(last, first - 1, -1):
+            chosen[i] = state
+            state = backpointers[i, state]
+
+
+def matched_distance(matcher, latitudes, longitudes):
+    """Distance in metres travelled along the path, straight lines where points are unmatched"""
+    _, _, measures = matcher.match(latitudes, longitudes)
+    steps = np.diff(measures)
+    on_path = ~np.isnan(steps)
+    straight = haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    # Along the path the steps add up to the progress, jitter back and forth cancels out
+    return float(max(steps[on_path].sum(), 0.0) + straight[~on_path].sum())
+
+
+def get_matcher(route_id, trip_type):
+    path = RoutePath.objects.filter(route_id=route_id, trip_type=trip_type).only('data').first()
+    return None if path is None else PathMatcher.from_path(path)
+
+
+def match_trip(trip_id, matcher=None):
+    """
+    Snap the stored points of a completed trip and store the distance along
+    the path on its TripSummary. Returns the distance, None without a path or points.
+    """
+    if matcher is None:
+        route_id, trip_type = Trip.objects.values_list('route_id', 'trip_type').get(pk=trip_id)
+        matcher = get_matcher(route_id, trip_type)
+    if matcher is None:
+        return None
+    _, _, latitudes, longitudes, _ = load_trip_points(trip_id)
+    if len(latitudes) < 2:
+        return None
+    distance = matched_distance(matcher, latitudes, longitudes)
+    TripSummary.objects.filter(trip_id=trip_id).update(matched_distance_m=distance)
+    return distance
+
+
+def learn_and_match(route_id, trip_type):
+    """Relearn the path of a route and rematch its completed trips, returns (path, trips matched)"""
+    with transaction.atomic():
+        path = learn_path(route_id, trip_type)
+    if path is None:
+        return None, 0
+    matcher = PathMatcher.from_path(path)
+    trip_ids = Trip.objects.filter(route_id=route_id, trip_type=trip_type, status='COMPLETED').values_list('id', flat=True)
+    matched = sum(1 for trip_id in trip_ids if match_trip(trip_id, matcher) is not None)
+    return path, matched
+
+
+class LiveMatch:
+    """Online matching state of one trip: the scores of the candidates of the last fix"""
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.scores = None
+        self.measures = None
+        self.last_xy = None
+
+    def update(self, latitude, longitude):
+        """Take a fix, returns (latitude, longitude, measure) of its most likely snap or None"""
+        matcher = self.matcher
+        x, y = matcher.to_xy([latitude], [longitude])
+        distances, measures, sx, sy = matcher.candidates(x, y)
+        emissions = matcher.emission(distances[0])
+        scores = None
+        if self.scores is not None:
+            straight = float(np.hypot(x[0] - self.last_xy[0], y[0] - self.last_xy[1]))
+            total = self.scores[:, None] + matcher.transition(self.measures, measures[0], straight) + emissions[None, :]
+            scores = total.max(axis=0)
+        if scores is None or not np.isfinite(scores).any():
+            scores = emissions  # first fix or the chain broke
+        if not np.isfinite(scores).any():
+            self.scores = None
+            return None
+        # Keep scores small, only their differences matter
+        self.scores = scores - scores.max()
+        self.measures = measures[0]
+        self.last_xy = (x[0], y[0])
+        best = int(np.argmax(scores))
+        snapped_latitude, snapped_longitude = matcher.to_degrees(sx[0, best], sy[0, best])
+        return float(snapped_latitude), float(snapped_longitude), float(measures[0, best])
+
+
+class MatchEngine:
+    """Per-process registry of LiveMatch states, fed by the ingestion pipeline"""
+
+    def __init__(self):
+        self.trips = {}
+        self._lock = threading.Lock()
+
+    def get(self, trip_id):
+        state = self.trips.get(trip_id, False)
+        if state is False:
+            route_id, trip_type = Trip.objects.values_list('route_id', 'trip_type').get(pk=trip_id)
+            matcher = get_matcher(route_id, trip_type)
+            state = None if matcher is None else LiveMatch(matcher)  # None: route has no path yet
+            with self._lock:
+                state = self.trips.setdefault(trip_id, state)
+        return state
+
+    def on_points(self, trip_id, locations):
+        state = self.get(trip_id)
+        if state is None:
+            return None
+        snapped = None
+        for location in locations:
+            snapped = state.update(float(location.latitude), float(location.longitude)) or snapped
+        if snapped is not None:
+            positions.get_store().set(match_key(trip_id), {
+                'latitude': round(snapped[0], 6),
+                'longitude': round(snapped[1], 6),
+                'progress_m': round(snapped[2], 1),
+                'path_length_m': round(state.matcher.length_m, 1),
+                'timestamp': locations[-1].timestamp.isoformat(),
+            }, timeout=None)
+        return snapped
+
+    def forget(self, trip_id):
+        self.trips.pop(trip_id, None)
+        positions.get_store().delete(match_key(trip_id))
+
+
+engine = MatchEngine()
+
+
+def get_matched_position(trip_id):
+    """Last snapped position of an in-progress trip and its progress along the path"""
+    return positions.get_store().get(match_key(trip_id))
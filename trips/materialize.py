@@ -0,0 +1,312 @@
+"""
+Bulk creation of Trips with their TripStudents, and for generated data their
+TripLocations and TripEvents.
+
+A TripMaterializer collects unsaved objects in memory and writes them with
+bulk_create, one INSERT per table for every `batch_size` trips instead of
+one per row. Actual times must be set on the objects before they are added;
+there is no second save(). Bulk inserts send no post_save, so materialized
+rows never reach the live engines or the track packer.
+
+Recurring trips are TripTemplates. Only a rolling horizon of a few days is
+turned into Trip rows (materialize_horizon, run daily); routes without a
+template get the default TRIP_SCHEDULE with their ACTIVE default bus.
+Trips already stored for a template or route and day are never recreated
+and trips that would double-book a bus or driver are skipped
+(trips.conflicts). Dates beyond the horizon are answered from the
+templates by schedule_between() without writing anything.
+
+A district is materialized school by school across a process pool
+(materialize_school with common.parallel.run_sharded). Buses and drivers belong to one school, so schools are
+independent shards; each worker has its own database connection and
+commits one transaction per school.
+"""
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from schools.models import Route, RouteStudent
+
+from .conflicts import ConflictIndex, trip_window
+from .models import Trip, TripEvent, TripLocation, TripStudent, TripTemplate
+from .segments import segment_times
+
+BATCH_SIZE = 500  # trips per write
+STOP_INTERVAL = timedelta(minutes=2)  # between stops without a learned travel time
+DEFAULT_SCHEDULE = {
+    'PICKUP': ('07:00', 45),  # start time, duration in minutes
+    'DROP': ('14:30', 45),
+}
+
+
+class TripMaterializer:
+    """
+    Queue unsaved trips with add() and write them in batches, use as a
+    context manager or call flush() once done. Children get their trip on write.
+
+    With a ConflictIndex as `conflicts`, trips that double-book their bus or
+    driver (against stored trips or trips queued earlier) are not queued but
+    kept in `rejected` as (trip, [(resource, trip id)]); queued trips are
+    indexed under negative keys.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, conflicts=None):
+        self.batch_size = batch_size
+        self.conflicts = conflicts
+        self.pending = []  # (Trip, [TripStudent], [TripLocation], [TripEvent])
+        self.rejected = []
+        self.queued = 0
+        self.counts = {'trips': 0, 'trip_students': 0, 'locations': 0, 'events': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, trip, trip_students=(), locations=(), events=()):
+        """Queue a trip, returns None if it was rejected as a double booking"""
+        if self.conflicts is not None:
+            found = self.conflicts.trip_conflicts(trip)
+            if found:
+                self.rejected.append((trip, found))
+                return None
+            start, end = trip_window(trip.scheduled_start_time, trip.scheduled_end_time)
+            self.conflicts.add(-(self.queued + 1), trip.bus_id, trip.driver_id, start, end)
+        self.queued += 1
+        self.pending.append((trip, list(trip_students), list(locations), list(events)))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return trip
+
+    def flush(self):
+        if not self.pending:
+            return
+        trip_students, locations, events = [], [], []
+        with transaction.atomic():
+            trips = Trip.objects.bulk_create([entry[0] for entry in self.pending])
+            for trip, *children in self.pending:
+                for target, objects in zip((trip_students, locations, events), children):
+                    for obj in objects:
+                        obj.trip = trip
+                    target.extend(objects)
+            TripStudent.objects.bulk_create(trip_students, batch_size=5000)
+            TripLocation.objects.bulk_create(locations, batch_size=5000)
+            TripEvent.objects.bulk_create(events, batch_size=5000)
+        self.counts['trips'] += len(trips)
+        self.counts['trip_students'] += len(trip_students)
+        self.counts['locations'] += len(locations)
+        self.counts['events'] += len(events)
+        self.pending = []
+
+
+def stop_offsets(stop_ids, trip_type, start):
+    """Offsets from the trip start of each stop, from learned travel times where known"""
+    offsets = [timedelta(0)]
+    for previous, stop_id in zip(stop_ids, stop_ids[1:]):
+        seconds = segment_times.median(previous, stop_id, trip_type, start + offsets[-1])
+        offsets.append(offsets[-1] + (STOP_INTERVAL if seconds is None else timedelta(seconds=seconds)))
+    return offsets
+
+
+def build_trip(route, trip_type, scheduled_start, duration, stop_ids, bus_id, driver_id=None, offsets=None, now=None):
+    """Unsaved SCHEDULED Trip and its TripStudents; `route` needs only id and school_id"""
+    now = now or timezone.now()
+    trip = Trip(
+        school_id=route.school_id,
+        route_id=route.id,
+        bus_id=bus_id,
+        driver_id=driver_id,
+        trip_type=trip_type,
+        scheduled_start_time=scheduled_start,
+        scheduled_end_time=scheduled_start + duration,
+        created_at=now,
+        updated_at=now,
+    )
+    if offsets is None:
+        offsets = stop_offsets(stop_ids, trip_type, scheduled_start)
+    trip_students = [
+        TripStudent(
+            route_student_id=stop_id,
+            scheduled_time=scheduled_start + offset,
+            created_at=now,
+            updated_at=now,
+        )
+        for stop_id, offset in zip(stop_ids, offsets)
+    ]
+    return trip, trip_students
+
+
+def get_schedule():
+    schedule = getattr(settings, 'TRIP_SCHEDULE', DEFAULT_SCHEDULE)
+    return {
+        trip_type: (datetime.strptime(start, '%H:%M').time(), timedelta(minutes=minutes))
+        for trip_type, (start, minutes) in schedule.items()
+    }
+
+
+def route_stops(routes):
+    """{route id: [RouteStudent ids in sequence order]}"""
+    stops = {}
+    rows = (
+        RouteStudent.objects.filter(route__in=routes, is_deleted=False)
+        .order_by('route_id', 'sequence_number')
+        .values_list('route_id', 'id')
+    )
+    for route_id, stop_id in rows.iterator(chunk_size=10000):
+        stops.setdefault(route_id, []).append(stop_id)
+    return stops
+
+
+def day_bounds(first_day, last_day):
+    start = timezone.make_aware(datetime.combine(first_day, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), datetime.min.time()))
+    return start, end
+
+
+def plan_trips(days, school_ids=None, with_students=True):
+    """
+    Unsaved (Trip, [TripStudent]) pairs that TripTemplates call for on `days`
+    (local dates) and are not stored yet, whatever their status. Routes without
+    any template get the default TRIP_SCHEDULE with their ACTIVE default bus.
+    Without `with_students` the TripStudent lists are empty, which is much
+    cheaper for looking far ahead.
+    """
+    days = sorted(days)
+    if not days:
+        return []
+    templates = TripTemplate.objects.filter(is_active=True, is_deleted=False, route__is_deleted=False)
+    routes = Route.objects.filter(is_deleted=False, default_bus__status='ACTIVE').exclude(
+        id__in=TripTemplate.objects.filter(is_active=True, is_deleted=False).values('route_id')
+    )
+    if school_ids is not None:
+        templates = templates.filter(school_id__in=school_ids)
+        routes = routes.filter(school_id__in=school_ids)
+    templates = list(templates.select_related('route').only(
+        'route__id', 'route__school_id', 'bus_id', 'driver_id', 'trip_type', 'weekdays', 'start_time',
+        'duration_minutes', 'valid_from', 'valid_until', 'is_active', 'is_deleted',
+    ))
+    routes = list(routes.only('id', 'school_id', 'default_bus_id'))
+    route_ids = {route.id for route in routes} | {template.route_id for template in templates}
+    stops = route_stops(route_ids)
+
+    start, end = day_bounds(days[0], days[-1])
+    stored_templates = set()
+    stored_routes = set()
+    rows = Trip.objects.filter(
+        route_id__in=route_ids, scheduled_start_time__gte=start, scheduled_start_time__lt=end
+    ).values_list('template_id', 'route_id', 'trip_type', 'scheduled_start_time')
+    for template_id, route_id, trip_type, scheduled_start in rows.iterator(chunk_size=10000):
+        day = timezone.localdate(scheduled_start)
+        stored_templates.add((template_id, day))
+        stored_routes.add((route_id, trip_type, day))
+
+    now = timezone.now()
+    schedule = get_schedule()
+    planned = []
+
+    def plan(route, trip_type, start_time, duration, bus_id, driver_id, template_id, day):
+        scheduled_start = timezone.make_aware(datetime.combine(day, start_time))
+        stop_ids = stops[route.id] if with_students else []
+        trip, trip_students = build_trip(
+            route, trip_type, scheduled_start, duration, stop_ids, bus_id, driver_id, now=now
+        )
+        trip.template_id = template_id
+        planned.append((trip, trip_students))
+
+    for day in days:
+        for template in templates:
+            if template.runs_on(day) and (template.id, day) not in stored_templates and stops.get(template.route_id):
+                plan(
+                    template.route, template.trip_type, template.start_time,
+                    timedelta(minutes=template.duration_minutes), template.bus_id, template.driver_id, template.id, day,
+                )
+        for trip_type, (start_time, duration) in schedule.items():
+            for route in routes:
+                if (route.id, trip_type, day) not in stored_routes and stops.get(route.id):
+                    plan(route, trip_type, start_time, duration, route.default_bus_id, None, None, day)
+    return planned
+
+
+def materialize_days(days, school_ids=None, materializer=None):
+    """
+    Create the SCHEDULED trips of `days` (local dates) that do not exist yet.
+    Returns the number of trips queued, they are written when the materializer flushes.
+    """
+    own = materializer is None
+    materializer = materializer or TripMaterializer(conflicts=ConflictIndex())
+    planned = plan_trips(days, school_ids)
+    if materializer.conflicts is not None and planned:
+        start, end = day_bounds(min(days), max(days))
+        materializer.conflicts.fill(
+            start, end,
+            bus_ids={trip.bus_id for trip, _ in planned},
+            driver_ids={trip.driver_id for trip, _ in planned if trip.driver_id},
+        )
+    queued = sum(1 for trip, trip_students in planned if materializer.add(trip, trip_students) is not None)
+    if own:
+        materializer.flush()
+    return queued
+
+
+def materialize_horizon(today=None, horizon_days=None, school_ids=None, materializer=None):
+    """Materialize `today` and the following days up to TRIP_MATERIALIZATION_HORIZON_DAYS in total"""
+    today = today or timezone.localdate()
+    if horizon_days is None:
+        horizon_days = getattr(settings, 'TRIP_MATERIALIZATION_HORIZON_DAYS', 3)
+    return materialize_days(
+        [today + timedelta(days=offset) for offset in range(horizon_days)], school_ids, materializer
+    )
+
+
+def materialize_school(school_id, days):
+    """Materialize `days` for one school in one transaction, returns its summary"""
+    started = time.perf_counter()
+    with transaction.atomic():
+        materializer = TripMaterializer(conflicts=ConflictIndex())
+        materialize_days(days, [school_id], materializer)
+        materializer.flush()
+    return {
+        'school': school_id,
+        'trips': materializer.counts['trips'],
+        'trip_students': materializer.counts['trip_students'],
+        'rejected': [
+            (trip.trip_type, trip.route_id, trip.scheduled_start_time, [resource for resource, _ in conflicts])
+            for trip, conflicts in materializer.rejected
+        ],
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def trip_as_dict(trip):
+    return {
+        'id': trip.pk,
+        'template': trip.template_id,
+        'route': trip.route_id,
+        'bus': trip.bus_id,
+        'driver': trip.driver_id,
+        'trip_type': trip.trip_type,
+        'status': trip.status,
+        'scheduled_start_time': trip.scheduled_start_time.isoformat(),
+        'scheduled_end_time': trip.scheduled_end_time.isoformat() if trip.scheduled_end_time else None,
+        'materialized': trip.pk is not None,
+    }
+
+
+def schedule_between(first_day, last_day, school_ids=None):
+    """
+    Trips of the days from `first_day` to `last_day`: stored ones as they are,
+    the rest as the templates would create them (id None, not persisted)
+    """
+    start, end = day_bounds(first_day, last_day)
+    stored = Trip.objects.filter(scheduled_start_time__gte=start, scheduled_start_time__lt=end)
+    if school_ids is not None:
+        stored = stored.filter(school_id__in=school_ids)
+    days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+    trips = list(stored) + [trip for trip, _ in plan_trips(days, school_ids, with_students=False)]
+    trips.sort(key=lambda trip: (trip.scheduled_start_time, trip.route_id))
+    return [trip_as_dict(trip) for trip in trips]
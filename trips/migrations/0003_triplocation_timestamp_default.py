@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0002_alter_tripsafetycheck_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="triplocation",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from trips.partitions import PARTITIONED_TABLES, rebuild_table
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in PARTITIONED_TABLES:
+        rebuild_table(schema_editor, table, partitioned=True)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in PARTITIONED_TABLES:
+        rebuild_table(schema_editor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0004_triptrack"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:14
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def count_existing_points(apps, schema_editor):
+    # Tracks packed before simplification stored every raw point
+    TripTrack = apps.get_model("trips", "TripTrack")
+    TripTrack.objects.update(raw_point_count=F("point_count"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0005_partition_triplocation_tripevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="triptrack",
+            name="raw_point_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="triptrack",
+            name="tolerance",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(count_existing_points, migrations.RunPython.noop),
+    ]
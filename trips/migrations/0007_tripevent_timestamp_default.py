@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0006_triptrack_simplification"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tripevent",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
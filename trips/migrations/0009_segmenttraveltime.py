@@ -0,0 +1,98 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("schools", "0005_geocoding"),
+        ("trips", "0008_tripsummary"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SegmentTravelTime",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("is_active", models.BooleanField(default=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                ("remarks", models.TextField(blank=True, null=True)),
+                (
+                    "trip_type",
+                    models.CharField(
+                        choices=[("PICKUP", "Pick Up"), ("DROP", "Drop Off")],
+                        max_length=10,
+                    ),
+                ),
+                ("time_bucket", models.PositiveSmallIntegerField()),
+                ("sample_count", models.PositiveIntegerField(default=0)),
+                ("histogram", models.BinaryField()),
+                ("p50_seconds", models.FloatField(blank=True, null=True)),
+                ("p90_seconds", models.FloatField(blank=True, null=True)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        editable=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="%(class)s_created",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "from_stop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="schools.routestudent",
+                    ),
+                ),
+                (
+                    "route",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="segment_times",
+                        to="schools.route",
+                    ),
+                ),
+                (
+                    "to_stop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="schools.routestudent",
+                    ),
+                ),
+                (
+                    "updated_by",
+                    models.ForeignKey(
+                        editable=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="%(class)s_updated",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {
+                    ("from_stop", "to_stop", "trip_type", "time_bucket")
+                },
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("schools", "0005_geocoding"),
+        ("trips", "0009_segmenttraveltime"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tripevent",
+            name="event_type",
+            field=models.CharField(
+                choices=[
+                    ("START", "Trip Started"),
+                    ("END", "Trip Ended"),
+                    ("PICKUP", "Student Pick Up"),
+                    ("DROP", "Student Drop Off"),
+                    ("DELAY", "Delay"),
+                    ("BREAKDOWN", "Vehicle Breakdown"),
+                    ("ACCIDENT", "Accident"),
+                    ("OVERSPEED", "Overspeed"),
+                    ("HARSH_BRAKING", "Harsh Braking"),
+                    ("STATIONARY", "Stationary Too Long"),
+                    ("OTHER", "Other"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.CreateModel(
+            name="SafetyThresholds",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("is_active", models.BooleanField(default=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                ("remarks", models.TextField(blank=True, null=True)),
+                ("speed_limit_kmh", models.FloatField(blank=True, null=True)),
+                ("overspeed_seconds", models.FloatField(blank=True, null=True)),
+                ("harsh_braking_ms2", models.FloatField(blank=True, null=True)),
+                ("stationary_minutes", models.FloatField(blank=True, null=True)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        editable=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="%(class)s_created",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "school",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="safety_thresholds",
+                        to="schools.school",
+                    ),
+                ),
+                (
+                    "updated_by",
+                    models.ForeignKey(
+                        editable=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="%(class)s_updated",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Safety thresholds",
+            },
+        ),
+    ]
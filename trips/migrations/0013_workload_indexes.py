@@ -0,0 +1,79 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+BRIN_INDEX = "triplocation_time_brin"
+
+
+def create_brin_index(apps, schema_editor):
+    # Rows arrive roughly in time order, so a BRIN index stays tiny and still prunes time ranges
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {BRIN_INDEX} ON trips_triplocation USING brin ("timestamp") '
+        "WITH (autosummarize = on)"
+    )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {BRIN_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_driver_school"),
+        ("schools", "0005_geocoding"),
+        ("trips", "0012_triptemplate"),
+        ("vehicles", "0003_alter_bus_school"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                fields=["school", "scheduled_start_time", "status"],
+                name="trip_school_start_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                condition=models.Q(("status", "IN_PROGRESS")),
+                fields=["bus", "-actual_start_time"],
+                name="trip_in_progress_bus_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                condition=models.Q(("status", "COMPLETED")),
+                fields=["route", "trip_type"],
+                name="trip_completed_route_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tripevent",
+            index=models.Index(
+                fields=["trip", "event_type", "timestamp"],
+                name="tripevent_trip_type_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="triplocation",
+            index=models.Index(
+                fields=["trip", "timestamp"], name="triplocation_trip_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tripstudent",
+            index=models.Index(
+                fields=["trip", "status"], name="tripstudent_trip_status_idx"
+            ),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0013_workload_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="triptrack",
+            name="last_location_id",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
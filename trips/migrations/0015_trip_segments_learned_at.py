@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+def mark_learned_trips(apps, schema_editor):
+    # Trips folded in before this field existed must not be counted again
+    JobCheckpoint = apps.get_model("common", "JobCheckpoint")
+    Trip = apps.get_model("trips", "Trip")
+    checkpoint = JobCheckpoint.objects.filter(name="segment-travel-times").first()
+    if checkpoint is not None and checkpoint.position is not None:
+        Trip.objects.filter(
+            status="COMPLETED", updated_at__lte=checkpoint.position
+        ).update(segments_learned_at=checkpoint.position)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("common", "0001_initial"),
+        ("trips", "0014_triptrack_last_location_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="segments_learned_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_learned_trips, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 # trips/models.py
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 from common.models import BaseMixin
 from vehicles.models import Bus
 from accounts.models import Driver
@@ -29,9 +31,27 @@ class Trip(BaseMixin):
     scheduled_end_time = models.DateTimeField(null=True, blank=True)
     actual_end_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='SCHEDULED')
+    template = models.ForeignKey('TripTemplate', on_delete=models.SET_NULL, related_name='trips', null=True, blank=True)
+    segments_learned_at = models.DateTimeField(null=True, blank=True, editable=False)  # see trips.segments
 
     class Meta:
         ordering = ['-scheduled_start_time']
+        indexes = [
+            # A school's trips in a time window: exports, purges, conflict checks, schedules
+            models.Index(fields=['school', 'scheduled_start_time', 'status'], name='trip_school_start_status_idx'),
+            # Few trips are running at a time: GPS ingestion by bus, live positions
+            models.Index(
+                fields=['bus', '-actual_start_time'],
+                condition=Q(status='IN_PROGRESS'),
+                name='trip_in_progress_bus_idx',
+            ),
+            # Learning from past trips of a route: segment times, route paths
+            models.Index(
+                fields=['route', 'trip_type'],
+                condition=Q(status='COMPLETED'),
+                name='trip_completed_route_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.get_trip_type_display()} - {self.route.name} - {self.scheduled_start_time}"
@@ -46,6 +66,54 @@ class Trip(BaseMixin):
         if self.status != 'SCHEDULED' and not self.driver:
             raise ValidationError("A driver must be assigned before the trip can be started")
 
+        from .conflicts import trip_conflicts
+        conflicts = trip_conflicts(self)
+        if conflicts:
+            others = Trip.objects.select_related('route').in_bulk([trip_id for _, trip_id in conflicts])
+            raise ValidationError([
+                f"{self.bus if resource == 'bus' else self.driver} is already assigned to an overlapping trip: {others[trip_id]}"
+                for resource, trip_id in conflicts
+            ])
+
+class TripTemplate(BaseMixin):
+    # Recurring trip, turned into Trip rows a few days ahead by trips.materialize
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='trip_templates')
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='trip_templates')
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='trip_templates')
+    driver = models.ForeignKey(Driver, on_delete=models.SET_NULL, related_name='trip_templates', null=True, blank=True)
+    trip_type = models.CharField(max_length=10, choices=Trip.TRIP_TYPES)
+    weekdays = models.CharField(max_length=7, default='12345', help_text='ISO weekday numbers, 12345 is Monday to Friday')
+    start_time = models.TimeField()
+    duration_minutes = models.PositiveIntegerField(default=45)
+    valid_from = models.DateField(null=True, blank=True)
+    valid_until = models.DateField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['route', 'trip_type', 'start_time']
+
+    def __str__(self):
+        return f"{self.get_trip_type_display()} - {self.route.name} - {self.start_time:%H:%M} ({self.weekdays})"
+
+    def runs_on(self, day):
+        return (
+            self.is_active and not self.is_deleted
+            and str(day.isoweekday()) in self.weekdays
+            and (self.valid_from is None or day >= self.valid_from)
+            and (self.valid_until is None or day <= self.valid_until)
+        )
+
+    def clean(self):
+        if not self.weekdays or any(c not in '1234567' for c in self.weekdays):
+            raise ValidationError("Weekdays must be ISO weekday numbers, 1 (Monday) to 7 (Sunday)")
+        if self.bus.school != self.school:
+            raise ValidationError("Bus must belong to the same school")
+        if self.driver and self.driver.school != self.school:
+            raise ValidationError("Driver must belong to the same school")
+        if self.route.school != self.school:
+            raise ValidationError("Route must belong to the same school")
+        if self.valid_from and self.valid_until and self.valid_until < self.valid_from:
+            raise ValidationError("Valid until cannot be before valid from")
+
 class TripStudent(BaseMixin):
     STATUS_CHOICES = [
         ('SCHEDULED', 'Scheduled'),
@@ -63,6 +131,9 @@ class TripStudent(BaseMixin):
     
     class Meta:
         ordering = ['route_student__sequence_number']
+        indexes = [
+            models.Index(fields=['trip', 'status'], name='tripstudent_trip_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.route_student.student.name} - {self.trip.get_trip_type_display()}"
@@ -75,11 +146,16 @@ class TripLocation(BaseMixin):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='locations')
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # device fix time, not insert time
     speed = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)  # in km/h
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # The points of a trip in time order: tracks, replay, latest position
+            models.Index(fields=['trip', 'timestamp'], name='triplocation_trip_time_idx'),
+            # PostgreSQL also has a BRIN index on timestamp, created in migration 0013
+        ]
 
     def __str__(self):
         return f"{self.trip} - {self.timestamp}"
@@ -93,18 +169,124 @@ class TripEvent(BaseMixin):
         ('DELAY', 'Delay'),
         ('BREAKDOWN', 'Vehicle Breakdown'),
         ('ACCIDENT', 'Accident'),
+        ('OVERSPEED', 'Overspeed'),
+        ('HARSH_BRAKING', 'Harsh Braking'),
+        ('STATIONARY', 'Stationary Too Long'),
         ('OTHER', 'Other'),
     ]
 
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='events')
     event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     description = models.TextField()
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['trip', 'event_type', 'timestamp'], name='tripevent_trip_type_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} - {self.trip} - {self.timestamp}"
+
+class TripTrack(BaseMixin):
+    # All points of a completed trip packed into one row, see trips.tracks for the layout
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, related_name='track')
+    start_time = models.DateTimeField()
+    point_count = models.PositiveIntegerField()
+    raw_point_count = models.PositiveIntegerField(default=0)
+    last_location_id = models.BigIntegerField(null=True, blank=True)  # newest raw row packed into the track
+    tolerance = models.FloatField(null=True, blank=True)  # simplification tolerance in metres
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"Track - {self.trip} ({self.point_count} points)"
+
+    @property
+    def compression_ratio(self):
+        """Raw points per stored point"""
+        return self.raw_point_count / self.point_count if self.point_count else None
+
+    def decode(self):
+        from .tracks import decode_track
+        return decode_track(self.data)
+
+
+class TripSummary(BaseMixin):
+    # Odometry and driving figures of a trip, computed once by trips.analytics
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, related_name='summary')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    point_count = models.PositiveIntegerField()
+    distance_m = models.FloatField()
+    duration_seconds = models.FloatField()
+    moving_seconds = models.FloatField()
+    idle_seconds = models.FloatField()
+    max_speed_kmh = models.FloatField(null=True, blank=True)
+    avg_speed_kmh = models.FloatField(null=True, blank=True)  # over moving time
+    harsh_acceleration_count = models.PositiveIntegerField(default=0)
+    harsh_braking_count = models.PositiveIntegerField(default=0)
+    matched_distance_m = models.FloatField(null=True, blank=True)  # along the route's path, see trips.mapmatch
+
+    class Meta:
+        verbose_name_plural = 'Trip summaries'
+        ordering = ['-start_time']
+
+    def __str__(self):
+        return f"Summary - {self.trip} ({self.distance_km:.1f} km)"
+
+    @property
+    def distance_km(self):
+        return self.distance_m / 1000
+
+
+class SegmentTravelTime(BaseMixin):
+    # Travel time distribution between consecutive stops, learned by trips.segments
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='segment_times')
+    from_stop = models.ForeignKey(RouteStudent, on_delete=models.CASCADE, related_name='+')
+    to_stop = models.ForeignKey(RouteStudent, on_delete=models.CASCADE, related_name='+')
+    trip_type = models.CharField(max_length=10, choices=Trip.TRIP_TYPES)
+    time_bucket = models.PositiveSmallIntegerField()  # time of day of departure, in TRIP_SEGMENT_BUCKET_MINUTES steps
+    sample_count = models.PositiveIntegerField(default=0)
+    histogram = models.BinaryField()  # uint32 counts per HISTOGRAM_EDGES bin
+    p50_seconds = models.FloatField(null=True, blank=True)
+    p90_seconds = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['from_stop', 'to_stop', 'trip_type', 'time_bucket']
+
+    def __str__(self):
+        return f"{self.route} {self.from_stop_id}->{self.to_stop_id} ({self.trip_type}, bucket {self.time_bucket})"
+
+
+class SafetyThresholds(BaseMixin):
+    # Per-school limits of the driving rules in trips.safety, empty fields use the TRIP_SAFETY_* settings
+    school = models.OneToOneField(School, on_delete=models.CASCADE, related_name='safety_thresholds')
+    speed_limit_kmh = models.FloatField(null=True, blank=True)
+    overspeed_seconds = models.FloatField(null=True, blank=True)  # time over the limit before it is reported
+    harsh_braking_ms2 = models.FloatField(null=True, blank=True)  # deceleration, as a positive number
+    stationary_minutes = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'Safety thresholds'
+
+    def __str__(self):
+        return f"Safety thresholds - {self.school}"
+
+
+class RoutePath(BaseMixin):
+    # Reference polyline of a route learned from its completed trips, see trips.mapmatch
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='paths')
+    trip_type = models.CharField(max_length=10, choices=Trip.TRIP_TYPES)
+    point_count = models.PositiveIntegerField()
+    length_m = models.FloatField()
+    track_count = models.PositiveIntegerField()  # tracks the path was learned from
+    data = models.BinaryField()  # float64 latitudes followed by float64 longitudes
+
+    class Meta:
+        unique_together = ['route', 'trip_type']
 
     def __str__(self):
-        return f"{self.get_event_type_display()} - {self.trip} - {self.timestamp}"
\ No newline at end of file
+        return f"Path - {self.route} ({self.get_trip_type_display()}, {self.length_m / 1000:.1f} km)"
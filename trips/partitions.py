@@ -0,0 +1,238 @@
+"""
+Monthly (or daily) range partitioning of the time-series trip tables on
+PostgreSQL. Partitions are named <table>_pYYYY_MM or <table>_pYYYY_MM_DD and
+every partitioned table also has a <table>_default partition that catches rows
+outside the prepared ranges.
+"""
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+PARTITIONED_TABLES = ['trips_triplocation', 'trips_tripevent']
+PARTITION_KEY = 'timestamp'
+INTERVALS = ('month', 'day')
+
+BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def get_interval():
+    return getattr(settings, 'TRIP_PARTITION_INTERVAL', 'month')
+
+
+def period_start(moment, interval):
+    """Start of the month/day containing `moment`, in UTC"""
+    moment = moment.astimezone(dt_timezone.utc)
+    if interval == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(start, interval):
+    if interval == 'day':
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table, start, interval):
+    suffix = start.strftime('%Y_%m_%d' if interval == 'day' else '%Y_%m')
+    return f'{table}_p{suffix}'
+
+
+def is_partitioned(table, using=connection):
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace",
+            [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(table, using=connection):
+    """[(name, lower bound, upper bound)] of range partitions, default partition excluded"""
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass ORDER BY c.relname",
+            [table],
+        )
+        partitions = []
+        for name, bound in cursor.fetchall():
+            match = BOUND_RE.search(bound)
+            if match:
+                lower, upper = (datetime.fromisoformat(value) for value in match.groups())
+                partitions.append((name, lower, upper))
+        return partitions
+
+
+def create_partition(table, start, interval, using=connection):
+    """
+    Create and attach the partition for the period starting at `start`.
+    Rows already sitting in the default partition for that period are moved
+    into the new partition first, otherwise PostgreSQL refuses the attach.
+    Returns the partition name, or None if the range is already covered.
+    """
+    end = next_period(start, interval)
+    for _, lower, upper in list_partitions(table, using):
+        if lower < end and start < upper:
+            return None
+
+    name = partition_name(table, start, interval)
+    qn = using.ops.quote_name
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS)')
+        # In time order, like rows arriving live, so BRIN ranges of the new partition stay narrow
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {qn(table + "_default")} '
+            f'WHERE {qn(PARTITION_KEY)} >= %s AND {qn(PARTITION_KEY)} < %s RETURNING *) '
+            f'INSERT INTO {qn(name)} SELECT * FROM moved ORDER BY {qn(PARTITION_KEY)}',
+            [start, end],
+        )
+        cursor.execute(
+            f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)',
+            [start, end],
+        )
+    return name
+
+
+def ensure_partitions(table, ahead, interval=None, now=None, using=connection):
+    """Make sure partitions exist from the current period up to `ahead` periods in the future"""
+    interval = interval or get_interval()
+    start = period_start(now or datetime.now(dt_timezone.utc), interval)
+    created = []
+    for _ in range(ahead + 1):
+        name = create_partition(table, start, interval, using)
+        if name:
+            created.append(name)
+        start = next_period(start, interval)
+    return created
+
+
+def split_default_partition(table, interval=None, using=connection):
+    """Give every period that has rows in the default partition its own partition"""
+    interval = interval or get_interval()
+    qn = using.ops.quote_name
+    with using.cursor() as cursor:
+        cursor.execute(
+            f'SELECT min({qn(PARTITION_KEY)}), max({qn(PARTITION_KEY)}) FROM {qn(table + "_default")}'
+        )
+        first, last = cursor.fetchone()
+    created = []
+    if first is None:
+        return created
+    start = period_start(first, interval)
+    while start <= last:
+        name = create_partition(table, start, interval, using)
+        if name:
+            created.append(name)
+        start = next_period(start, interval)
+    return created
+
+
+def expired_partitions(table, retention_days, now=None, using=connection):
+    """Partitions whose whole range is older than the retention window"""
+    cutoff = (now or datetime.now(dt_timezone.utc)) - timedelta(days=retention_days)
+    return [name for name, _, upper in list_partitions(table, using) if upper <= cutoff]
+
+
+def remove_partition(table, name, drop=False, using=connection):
+    """Detach a partition, keeping it as a standalone table unless `drop` is set"""
+    qn = using.ops.quote_name
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+        if drop:
+            cursor.execute(f'DROP TABLE {qn(name)}')
+
+
+def _table_definitions(cursor, table):
+    """Foreign keys and secondary indexes of a table, as recreatable SQL"""
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = 'public' AND tablename = %s",
+        [table],
+    )
+    indexes = [
+        (name, definition) for name, definition in cursor.fetchall()
+        if not name.endswith('_pkey')
+    ]
+    return constraints, indexes
+
+
+def rebuild_table(schema_editor, table, partitioned, interval=None, ahead=3):
+    """
+    Swap `table` for a copy that is (or is no longer) range partitioned on the
+    partition key. Data, foreign keys, indexes and the id sequence are carried
+    over. Used by the migrations that switch partitioning on and off.
+    """
+    using = schema_editor.connection
+    qn = using.ops.quote_name
+    interval = interval or get_interval()
+    old = f'{table}_unpartitioned' if partitioned else f'{table}_partitioned'
+
+    with using.cursor() as cursor:
+        constraints, indexes = _table_definitions(cursor, table)
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+            [table],
+        )
+        primary_key = cursor.fetchone()[0]
+
+        # Free the table and primary key names for the replacement table
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        cursor.execute(f'ALTER TABLE {qn(old)} RENAME CONSTRAINT {qn(primary_key)} TO {qn(old + "_pkey")}')
+        if partitioned:
+            # Partitioned tables need the partition key in the primary key, and
+            # PostgreSQL 16 has no identity columns on them, so use a plain sequence
+            cursor.execute(f'ALTER TABLE {qn(old)} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+            cursor.execute(
+                f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS) '
+                f'PARTITION BY RANGE ({qn(PARTITION_KEY)})'
+            )
+            cursor.execute(
+                f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} '
+                f'PRIMARY KEY (id, {qn(PARTITION_KEY)})'
+            )
+            cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+            # Prepare the partitions before copying so rows are written only once
+            cursor.execute(f'SELECT min({qn(PARTITION_KEY)}), max({qn(PARTITION_KEY)}) FROM {qn(old)}')
+            first, last = cursor.fetchone()
+            if first is not None:
+                start = period_start(first, interval)
+                while start <= last:
+                    create_partition(table, start, interval, using)
+                    start = next_period(start, interval)
+            ensure_partitions(table, ahead, interval, using=using)
+        else:
+            cursor.execute(f'ALTER TABLE {qn(old)} ALTER COLUMN id DROP DEFAULT')
+            cursor.execute(f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS)')
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} PRIMARY KEY (id)')
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        cursor.execute(f'DROP TABLE {qn(old)} CASCADE')
+
+        if partitioned:
+            sequence = f'{table}_id_seq'
+            cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+            cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        else:
+            cursor.execute(f'ALTER TABLE {qn(table)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(id), 0) + 1, false) FROM {qn(table)}",
+            [table],
+        )
+
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+        # Captured before the rename, so the definitions already target the new table
+        for _, definition in indexes:
+            cursor.execute(definition)
@@ -0,0 +1,94 @@
+"""
+Latest known position per bus and per trip, kept in a Django cache so that
+"where is the bus now" never has to scan TripLocation. The cache alias is
+configured in settings.CACHES (in-process LocMemCache by default, any
+Redis-compatible server through django.core.cache.backends.redis.RedisCache).
+"""
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import TripLocation
+
+WARMED_KEY = 'positions:warmed'
+
+
+def get_store():
+    return caches[getattr(settings, 'TRIP_POSITION_CACHE', 'positions')]
+
+
+def bus_key(bus_id):
+    return f'bus:{bus_id}'
+
+
+def trip_key(trip_id):
+    return f'trip:{trip_id}'
+
+
+def serialize_location(location, trip_id, bus_id, school_id):
+    return {
+        'trip': trip_id,
+        'bus': bus_id,
+        'school': school_id,
+        'latitude': float(location.latitude),
+        'longitude': float(location.longitude),
+        'speed': None if location.speed is None else float(location.speed),
+        'timestamp': location.timestamp.astimezone(dt_timezone.utc).isoformat(),
+    }
+
+
+def record_position(trip_id, bus_id, school_id, location, store=None):
+    """Store `location` as the latest position unless a newer one is already known"""
+    store = store or get_store()
+    position = serialize_location(location, trip_id, bus_id, school_id)
+    current = store.get(trip_key(trip_id))
+    # Timestamps are all UTC ISO 8601, so they compare correctly as strings
+    if current and current['timestamp'] > position['timestamp']:
+        return current
+    store.set_many({bus_key(bus_id): position, trip_key(trip_id): position}, timeout=None)
+    return position
+
+
+def forget_trip(trip_id, store=None):
+    """Drop a finished trip, the bus keeps its last known position"""
+    (store or get_store()).delete(trip_key(trip_id))
+
+
+def warm(store=None):
+    """Load the latest point of every in-progress trip from the database"""
+    store = store or get_store()
+    latest = (
+        TripLocation.objects.filter(trip__status='IN_PROGRESS')
+        .select_related('trip')
+        .only('latitude', 'longitude', 'speed', 'timestamp', 'trip__bus_id', 'trip__school_id')
+        .order_by('trip_id', '-timestamp')
+        .distinct('trip_id')
+    )
+    count = 0
+    for location in latest:
+        record_position(location.trip_id, location.trip.bus_id, location.trip.school_id, location, store)
+        count += 1
+    store.set(WARMED_KEY, True, timeout=None)
+    return count
+
+
+def _warmed_store():
+    store = get_store()
+    if not store.get(WARMED_KEY):
+        warm(store)
+    return store
+
+
+def get_bus_position(bus_id):
+    return _warmed_store().get(bus_key(bus_id))
+
+
+def get_trip_position(trip_id):
+    return _warmed_store().get(trip_key(trip_id))
+
+
+def get_bus_positions(bus_ids):
+    """{bus_id: position} for the given buses, buses without a position are left out"""
+    found = _warmed_store().get_many([bus_key(bus_id) for bus_id in bus_ids])
+    return {position['bus']: position for position in found.values()}
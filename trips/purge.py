@@ -0,0 +1,154 @@
+"""
+Chunked purge of trips and everything hanging off them (TripStudents,
+TripLocations, TripEvents, tracks, summaries), optionally limited to a range
+of scheduled days and to some schools.
+
+Trips are taken in primary key order, `chunk_size` at a time, and each chunk
+is deleted with plain DELETE ... WHERE <fk> IN (...) statements, children
+first, in its own transaction: locks are short, WAL is written in small
+pieces and nothing is loaded into Python but the trip ids. The dependent
+tables come from the model relations, so new children of Trip are purged
+without changes here. No pre_delete/post_delete signals are sent.
+
+Progress is kept in a JobCheckpoint named after the filters and committed
+with every chunk, so an interrupted purge started again with the same
+filters carries on after the last deleted trip with its running totals.
+With an archive directory every chunk is first written there as a gzip
+NDJSON file (dumpdata object format, trips.export), named after its first
+and last trip id so a chunk redone after an interruption overwrites its file.
+"""
+import hashlib
+import json
+import os
+import time
+
+from django.db import connection, models, transaction
+
+from common.models import JobCheckpoint
+
+from .export import write_member
+from .materialize import day_bounds
+from .models import Trip
+
+CHUNK_SIZE = 1000  # trips per transaction
+CHECKPOINT_PREFIX = 'purge-trips-'
+
+
+def checkpoint_name(first_day=None, last_day=None, school_ids=None):
+    filters = {
+        'first_day': first_day and first_day.isoformat(),
+        'last_day': last_day and last_day.isoformat(),
+        'schools': sorted(school_ids) if school_ids is not None else None,
+    }
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:16]
+    return CHECKPOINT_PREFIX + digest, filters
+
+
+def trips_to_purge(first_day=None, last_day=None, school_ids=None):
+    trips = Trip.objects.all()
+    if first_day is not None:
+        trips = trips.filter(scheduled_start_time__gte=day_bounds(first_day, first_day)[0])
+    if last_day is not None:
+        trips = trips.filter(scheduled_start_time__lt=day_bounds(last_day, last_day)[1])
+    if school_ids is not None:
+        trips = trips.filter(school_id__in=school_ids)
+    return trips
+
+
+def dependents(model):
+    """[(model, foreign key column)] of the tables whose rows go with a row of `model`, deepest first"""
+    found = []
+    for relation in model._meta.related_objects:
+        if relation.on_delete is not models.CASCADE or relation.many_to_many:
+            raise ValueError(
+                f'{relation.related_model._meta.label}.{relation.field.name} does not cascade, '
+                f'purge {model._meta.label} through the ORM instead'
+            )
+        if relation.related_model._meta.related_objects:
+            raise ValueError(f'{relation.related_model._meta.label} has dependents of its own')
+        found.append((relation.related_model, relation.field.column))
+    return found
+
+
+def delete_chunk(ids):
+    """Delete the trips `ids` and their dependent rows, returns {model label: rows deleted}"""
+    placeholders = ', '.join(['%s'] * len(ids))
+    counts = {}
+    with connection.cursor() as cursor:
+        for model, column in dependents(Trip) + [(Trip, Trip._meta.pk.column)]:
+            cursor.execute(
+                f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)} '
+                f'WHERE {connection.ops.quote_name(column)} IN ({placeholders})',
+                ids,
+            )
+            counts[model._meta.label] = cursor.rowcount
+    return counts
+
+
+def archive_chunk(directory, ids):
+    """Write the trips `ids` and their dependent rows to one gzip NDJSON file in `directory`"""
+    path = os.path.join(directory, f'trips-{ids[0]}-{ids[-1]}.ndjson.gz')
+    partial = path + '.partial'
+    with open(partial, 'wb') as output:
+        # One gzip member per model; gzip readers read them as one stream
+        write_member(output, Trip, Trip.objects.filter(pk__in=ids), 'gzip')
+        for model, column in dependents(Trip):
+            field = next(field for field in model._meta.concrete_fields if field.column == column)
+            write_member(output, model, model.objects.filter(**{f'{field.attname}__in': ids}), 'gzip')
+    os.replace(partial, path)
+    return path
+
+
+def purge(first_day=None, last_day=None, school_ids=None, chunk_size=CHUNK_SIZE, archive=None,
+          restart=False, progress=None):
+    """
+    Delete the matching trips chunk by chunk, resuming an interrupted run with
+    the same filters unless `restart`. `progress` is called with the running
+    summary after every chunk. Returns the summary:
+    {'trips': .., 'rows': .., 'deleted': {model label: rows}, 'seconds': .., 'resumed': bool}
+    """
+    name, filters = checkpoint_name(first_day, last_day, school_ids)
+    checkpoint, created = JobCheckpoint.objects.get_or_create(name=name, defaults={'state': {}})
+    if restart or created:
+        checkpoint.state = {'filters': filters, 'last_id': 0, 'deleted': {}, 'seconds': 0.0}
+        checkpoint.save()
+    state = checkpoint.state
+    summary = {
+        'trips': state['deleted'].get(Trip._meta.label, 0),
+        'rows': sum(state['deleted'].values()),
+        'deleted': dict(state['deleted']),
+        'seconds': state['seconds'],
+        'resumed': not (restart or created),
+    }
+    if archive:
+        os.makedirs(archive, exist_ok=True)
+
+    trips = trips_to_purge(first_day, last_day, school_ids).order_by('pk').values_list('pk', flat=True)
+    while True:
+        started = time.perf_counter()
+        ids = list(trips.filter(pk__gt=state['last_id'])[:chunk_size])
+        if not ids:
+            break
+        if archive:
+            archive_chunk(archive, ids)
+        with transaction.atomic():
+            counts = delete_chunk(ids)
+            for label, count in counts.items():
+                state['deleted'][label] = state['deleted'].get(label, 0) + count
+            state['last_id'] = ids[-1]
+            state['seconds'] += time.perf_counter() - started
+            checkpoint.state = state
+            checkpoint.save(update_fields=['state', 'updated_at'])
+
+        summary.update(
+            trips=state['deleted'].get(Trip._meta.label, 0),
+            rows=sum(state['deleted'].values()),
+            deleted=dict(state['deleted']),
+            seconds=state['seconds'],
+        )
+        if progress is not None:
+            progress(summary)
+
+    # Done: the next run with these filters starts over
+    checkpoint.delete()
+    return summary
@@ -0,0 +1,264 @@
+"""
+Streaming driving rules over TripLocation points: overspeed for longer than
+a set time, harsh braking and stationary too long. Thresholds come from the
+school's SafetyThresholds, else the TRIP_SAFETY_* settings.
+
+A TripMonitor keeps the last seconds of speeds in a small ring buffer plus
+a few episode counters, so each point costs the same however long the trip
+is. A rule fires once per episode and the episode has to end (speed back
+under the limit, bus moving again) before it fires again. Events are
+stamped with the time their episode started; events already stored for a
+trip are skipped, so replaying a trip (backfill) never duplicates them.
+Backfill replays raw TripLocations only: a packed TripTrack has lost the
+speed samples of straight stretches, so it would miss episodes live
+detection caught.
+"""
+import math
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from common.geo import distance_m
+
+from .analytics import MAX_PLAUSIBLE_SPEED_KMH, MIN_ACCELERATION_GAP_SECONDS
+from .models import SafetyThresholds, Trip, TripEvent, TripTrack
+from .tracks import raw_trip_points
+
+RULE_EVENT_TYPES = ('OVERSPEED', 'HARSH_BRAKING', 'STATIONARY')
+BRAKING_WINDOW_SECONDS = 4.0
+WINDOW_SIZE = 32  # points kept for the braking window, devices report at most a few per second
+OVERSPEED_HYSTERESIS_KMH = 5.0  # an overspeed episode ends this far under the limit
+STATIONARY_RADIUS_M = 30.0
+MAX_GAP_SECONDS = 120.0  # a longer silence breaks the speed history
+
+
+def get_thresholds(school_id):
+    defaults = {
+        'speed_limit_kmh': getattr(settings, 'TRIP_SAFETY_SPEED_LIMIT_KMH', 50.0),
+        'overspeed_seconds': getattr(settings, 'TRIP_SAFETY_OVERSPEED_SECONDS', 15.0),
+        'harsh_braking_ms2': getattr(settings, 'TRIP_SAFETY_HARSH_BRAKING_MS2', 3.5),
+        'stationary_minutes': getattr(settings, 'TRIP_SAFETY_STATIONARY_MINUTES', 10.0),
+    }
+    row = SafetyThresholds.objects.filter(school_id=school_id, is_active=True).values(*defaults).first() or {}
+    return {name: default if row.get(name) is None else row[name] for name, default in defaults.items()}
+
+
+class RingBuffer:
+    """Fixed number of (time, value) pairs, the oldest is overwritten when full"""
+
+    def __init__(self, size):
+        self.size = size
+        self.times = [0.0] * size
+        self.values = [0.0] * size
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            index = (self.start + i) % self.size
+            yield self.times[index], self.values[index]
+
+    def append(self, time, value):
+        if self.count == self.size:
+            self.start = (self.start + 1) % self.size
+            self.count -= 1
+        index = (self.start + self.count) % self.size
+        self.times[index] = time
+        self.values[index] = value
+        self.count += 1
+
+    def drop_before(self, time):
+        while self.count and self.times[self.start] < time:
+            self.start = (self.start + 1) % self.size
+            self.count -= 1
+
+    def clear(self):
+        self.start = self.count = 0
+
+
+class TripMonitor:
+    """Rule state of one trip, fed points in time order"""
+
+    def __init__(self, trip_id, speed_limit_kmh, overspeed_seconds, harsh_braking_ms2, stationary_minutes):
+        self.trip_id = trip_id
+        self.speed_limit_kmh = speed_limit_kmh
+        self.overspeed_seconds = overspeed_seconds
+        self.harsh_braking_ms2 = harsh_braking_ms2
+        self.stationary_seconds = stationary_minutes * 60
+        self.speeds = RingBuffer(WINDOW_SIZE)
+        self.last = None  # (time, latitude, longitude)
+        self.overspeed = None  # [start time, latitude, longitude, top speed, reported]
+        self.braking = False
+        self.stationary = None  # [start time, latitude, longitude, reported]
+
+    @classmethod
+    def for_trip(cls, trip_id, school_id):
+        return cls(trip_id, **get_thresholds(school_id))
+
+    def update(self, time, latitude, longitude, speed=None):
+        """
+        Take a point (epoch seconds, degrees, km/h or None), returns the
+        findings it completes as [(event type, start time, latitude, longitude, description)]
+        """
+        if self.last is not None and time <= self.last[0]:
+            return []  # late or repeated point
+        if speed is None or math.isnan(speed):
+            speed = self.derived_speed(time, latitude, longitude)
+        if self.last is not None and time - self.last[0] > MAX_GAP_SECONDS:
+            self.speeds.clear()
+            self.overspeed = None
+        self.last = (time, latitude, longitude)
+
+        findings = []
+        self.check_stationary(time, latitude, longitude, findings)
+        if speed is not None:
+            self.check_overspeed(time, latitude, longitude, speed, findings)
+            self.check_braking(time, latitude, longitude, speed, findings)
+        return findings
+
+    def derived_speed(self, time, latitude, longitude):
+        if self.last is None:
+            return None
+        last_time, last_latitude, last_longitude = self.last
+        speed = distance_m(last_latitude, last_longitude, latitude, longitude) / (time - last_time) * 3.6
+        return speed if speed <= MAX_PLAUSIBLE_SPEED_KMH else None
+
+    def check_overspeed(self, time, latitude, longitude, speed, findings):
+        episode = self.overspeed
+        if speed > self.speed_limit_kmh:
+            if episode is None:
+                episode = self.overspeed = [time, latitude, longitude, speed, False]
+            episode[3] = max(episode[3], speed)
+            if not episode[4] and time - episode[0] >= self.overspeed_seconds:
+                episode[4] = True
+                findings.append(('OVERSPEED', episode[0], episode[1], episode[2], (
+                    f'Overspeed: {episode[3]:.0f} km/h for {time - episode[0]:.0f} s '
+                    f'(limit {self.speed_limit_kmh:.0f} km/h)'
+                )))
+        elif episode is not None and speed <= self.speed_limit_kmh - OVERSPEED_HYSTERESIS_KMH:
+            self.overspeed = None
+
+    def check_braking(self, time, latitude, longitude, speed, findings):
+        self.speeds.append(time, speed)
+        self.speeds.drop_before(time - BRAKING_WINDOW_SECONDS)
+        peak_time, peak_speed = max(self.speeds, key=lambda item: item[1])
+        gap = time - peak_time
+        harsh = gap >= MIN_ACCELERATION_GAP_SECONDS and (peak_speed - speed) / 3.6 / gap >= self.harsh_braking_ms2
+        if harsh and not self.braking:
+            findings.append(('HARSH_BRAKING', peak_time, latitude, longitude, (
+                f'Harsh braking: {peak_speed:.0f} to {speed:.0f} km/h in {gap:.1f} s'
+            )))
+        self.braking = harsh
+
+    def check_stationary(self, time, latitude, longitude, findings):
+        episode = self.stationary
+        if episode is None or distance_m(episode[1], episode[2], latitude, longitude) > STATIONARY_RADIUS_M:
+            self.stationary = [time, latitude, longitude, False]
+            return
+        if not episode[3] and time - episode[0] >= self.stationary_seconds:
+            episode[3] = True
+            findings.append(('STATIONARY', episode[0], episode[1], episode[2], (
+                f'Stationary for {(time - episode[0]) / 60:.0f} min'
+            )))
+
+
+def to_datetime(time):
+    return datetime.fromtimestamp(time, tz=dt_timezone.utc)
+
+
+def new_findings(trip_id, findings):
+    """Drop findings already stored as TripEvents of the same type within a second"""
+    if not findings:
+        return []
+    times = [to_datetime(finding[1]) for finding in findings]
+    stored = {}
+    for event_type, timestamp in TripEvent.objects.filter(
+        trip_id=trip_id,
+        event_type__in=RULE_EVENT_TYPES,
+        timestamp__gte=min(times) - timedelta(seconds=1),
+        timestamp__lte=max(times) + timedelta(seconds=1),
+    ).values_list('event_type', 'timestamp'):
+        stored.setdefault(event_type, []).append(timestamp.timestamp())
+    return [
+        finding for finding in findings
+        if not any(abs(finding[1] - time) < 1 for time in stored.get(finding[0], ()))
+    ]
+
+
+def build_event(trip_id, finding):
+    event_type, time, latitude, longitude, description = finding
+    return TripEvent(
+        trip_id=trip_id,
+        event_type=event_type,
+        timestamp=to_datetime(time),
+        description=description,
+        latitude=round(latitude, 6),
+        longitude=round(longitude, 6),
+    )
+
+
+class SafetyEngine:
+    """Per-process registry of TripMonitors, fed by the ingestion pipeline"""
+
+    def __init__(self):
+        self.trips = {}
+        self._lock = threading.Lock()
+
+    def get(self, trip_id, school_id):
+        monitor = self.trips.get(trip_id)
+        if monitor is None:
+            monitor = TripMonitor.for_trip(trip_id, school_id)
+            with self._lock:
+                monitor = self.trips.setdefault(trip_id, monitor)
+        return monitor
+
+    def on_points(self, trip_id, school_id, locations):
+        monitor = self.get(trip_id, school_id)
+        findings = []
+        for location in locations:
+            findings.extend(monitor.update(
+                location.timestamp.timestamp(),
+                float(location.latitude),
+                float(location.longitude),
+                None if location.speed is None else float(location.speed),
+            ))
+        findings = new_findings(trip_id, findings)
+        # One at a time so post_save broadcasts them, they are rare
+        for finding in findings:
+            build_event(trip_id, finding).save()
+        return findings
+
+    def forget(self, trip_id):
+        self.trips.pop(trip_id, None)
+
+
+engine = SafetyEngine()
+
+
+def replay_trip(trip_id, thresholds=None):
+    """
+    Run the raw points of a trip through a fresh TripMonitor and insert the
+    events not stored yet. Returns the number inserted, or None when the
+    raw points are gone and only the simplified track is left (skipped).
+    """
+    if thresholds is None:
+        thresholds = get_thresholds(Trip.objects.values_list('school_id', flat=True).get(pk=trip_id))
+    start_time, offsets, latitudes, longitudes, speeds = raw_trip_points(trip_id)
+    if start_time is None:
+        return None if TripTrack.objects.filter(trip_id=trip_id).exists() else 0
+    monitor = TripMonitor(trip_id, **thresholds)
+    epoch = start_time.timestamp()
+    findings = []
+    for offset, latitude, longitude, speed in zip(
+        offsets.tolist(), latitudes.tolist(), longitudes.tolist(), speeds.tolist()
+    ):
+        findings.extend(monitor.update(epoch + offset, latitude, longitude, speed))
+    with transaction.atomic():
+        events = [build_event(trip_id, finding) for finding in new_findings(trip_id, findings)]
+        TripEvent.objects.bulk_create(events, batch_size=1000)
+    return len(events)
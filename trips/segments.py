@@ -0,0 +1,225 @@
+"""
+Travel times between consecutive stops, learned from TripStudent.actual_time.
+
+For every (route, from stop, to stop, trip type, time-of-day bucket) a fixed
+histogram of observed seconds is kept in SegmentTravelTime. Histograms with
+the same bins simply add up, so learn() only reads the completed trips
+saved since its last run (JobCheckpoint 'segment-travel-times') and merges
+their counts into the stored rows. The watermark is the trip's updated_at,
+not its end time, so a trip marked COMPLETED late still gets learned. Each
+learned trip gets Trip.segments_learned_at and is skipped when it is saved
+again, so no trip is counted twice. Percentiles are interpolated inside the
+bins.
+
+`segment_times` is an in-process snapshot of all rows for ETA and scheduling
+code; it is loaded on first use and reloaded after SNAPSHOT_TTL seconds.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from common.models import JobCheckpoint
+
+from .models import SegmentTravelTime, Trip, TripStudent
+
+CHECKPOINT = 'segment-travel-times'
+# Bin edges in seconds, geometric from 5 s to 2 h; values outside land in the first/last bin
+HISTOGRAM_EDGES = np.geomspace(5, 7200, 48)
+BIN_COUNT = len(HISTOGRAM_EDGES) + 1
+MAX_SEGMENT_SECONDS = 4 * 3600  # longer gaps are a paused trip or bad data
+MIN_SAMPLES = 3  # below this a time-of-day bucket defers to the all-day distribution
+SNAPSHOT_TTL = 3600
+SETTLE_TIME = timedelta(minutes=30)  # after the last save of a trip, leave time for late stop updates
+CHUNK_SIZE = 5000  # trips per query and update
+
+
+def bucket_minutes():
+    return getattr(settings, 'TRIP_SEGMENT_BUCKET_MINUTES', 60)
+
+
+def time_bucket(moment):
+    local = timezone.localtime(moment)
+    return (local.hour * 60 + local.minute) // bucket_minutes()
+
+
+def encode_histogram(counts):
+    return np.asarray(counts, dtype='<u4').tobytes()
+
+
+def decode_histogram(data):
+    return np.frombuffer(bytes(data), dtype='<u4').astype(np.int64) if data else np.zeros(BIN_COUNT, dtype=np.int64)
+
+
+def percentile(counts, q):
+    """Approximate q-th percentile (0-100) in seconds from histogram counts"""
+    total = counts.sum()
+    if not total:
+        return None
+    target = total * q / 100
+    cumulative = np.cumsum(counts)
+    index = int(np.searchsorted(cumulative, target))
+    index = min(index, len(counts) - 1)
+    low = HISTOGRAM_EDGES[index - 1] if index > 0 else HISTOGRAM_EDGES[0] / 2
+    high = HISTOGRAM_EDGES[index] if index < len(HISTOGRAM_EDGES) else HISTOGRAM_EDGES[-1] * 2
+    before = cumulative[index - 1] if index > 0 else 0
+    fraction = (target - before) / counts[index] if counts[index] else 0.5
+    # Bins are geometric, so interpolate geometrically too
+    return float(low * (high / low) ** fraction)
+
+
+def collect(trip_filter):
+    """{(route, from stop, to stop, trip type, bucket): histogram counts} for the matching trips"""
+    rows = (
+        TripStudent.objects.filter(trip__in=trip_filter, actual_time__isnull=False)
+        .order_by('trip_id', 'actual_time')
+        .values_list('trip_id', 'trip__route_id', 'trip__trip_type', 'route_student_id', 'actual_time')
+    )
+    samples = defaultdict(list)
+    previous = None
+    for trip_id, route_id, trip_type, stop_id, actual_time in rows.iterator(chunk_size=5000):
+        if previous is not None and previous[0] == trip_id:
+            seconds = (actual_time - previous[2]).total_seconds()
+            if 0 < seconds <= MAX_SEGMENT_SECONDS:
+                key = (route_id, previous[1], stop_id, trip_type, time_bucket(previous[2]))
+                samples[key].append(seconds)
+        previous = (trip_id, stop_id, actual_time)
+
+    return {
+        key: np.bincount(np.searchsorted(HISTOGRAM_EDGES, values), minlength=BIN_COUNT)
+        for key, values in samples.items()
+    }
+
+
+def merge(histograms):
+    """Add histogram counts to the stored rows, creating missing ones"""
+    if not histograms:
+        return 0
+    now = timezone.now()
+    existing = {}
+    stop_ids = {key[1] for key in histograms}
+    for row in SegmentTravelTime.objects.select_for_update().filter(from_stop_id__in=stop_ids):
+        existing[(row.route_id, row.from_stop_id, row.to_stop_id, row.trip_type, row.time_bucket)] = row
+
+    to_create, to_update = [], []
+    for key, counts in histograms.items():
+        row = existing.get(key)
+        if row is None:
+            route_id, from_stop_id, to_stop_id, trip_type, bucket = key
+            row = SegmentTravelTime(
+                route_id=route_id, from_stop_id=from_stop_id, to_stop_id=to_stop_id,
+                trip_type=trip_type, time_bucket=bucket, created_at=now,
+            )
+            to_create.append(row)
+        else:
+            counts = counts + decode_histogram(row.histogram)
+            to_update.append(row)
+        row.histogram = encode_histogram(counts)
+        row.sample_count = int(counts.sum())
+        row.p50_seconds = percentile(counts, 50)
+        row.p90_seconds = percentile(counts, 90)
+        row.updated_at = now
+
+    SegmentTravelTime.objects.bulk_create(to_create, batch_size=1000)
+    SegmentTravelTime.objects.bulk_update(
+        to_update, ['histogram', 'sample_count', 'p50_seconds', 'p90_seconds', 'updated_at'], batch_size=1000
+    )
+    return len(to_create) + len(to_update)
+
+
+def learn(full=False, now=None):
+    """
+    Fold the completed trips saved since the last run into the stored distributions.
+    With `full` the distributions are rebuilt from every completed trip.
+    Returns (trips learned, segment rows written).
+    """
+    now = now or timezone.now()
+    until = now - SETTLE_TIME
+    with transaction.atomic():
+        checkpoint, _ = JobCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+        if full:
+            SegmentTravelTime.objects.all().delete()
+            checkpoint.position = None
+
+        trips = Trip.objects.filter(status='COMPLETED', updated_at__lte=until)
+        if not full:
+            trips = trips.filter(segments_learned_at__isnull=True)
+            if checkpoint.position is not None:
+                trips = trips.filter(updated_at__gt=checkpoint.position)
+        trip_ids = list(trips.order_by().values_list('id', flat=True))
+
+        histograms = {}
+        for start in range(0, len(trip_ids), CHUNK_SIZE):
+            chunk = trip_ids[start:start + CHUNK_SIZE]
+            for key, counts in collect(chunk).items():
+                histograms[key] = histograms[key] + counts if key in histograms else counts
+            Trip.objects.filter(pk__in=chunk).update(segments_learned_at=now)
+        written = merge(histograms)
+        checkpoint.position = until
+        checkpoint.state = {'trips': len(trip_ids), 'segments': written}
+        checkpoint.save()
+    segment_times.invalidate()
+    return len(trip_ids), written
+
+
+class SegmentTimes:
+    """In-memory snapshot of the learned distributions"""
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.by_bucket = {}  # (from stop, to stop, trip type, bucket) -> (p50, p90, samples)
+        self.all_day = {}  # (from stop, to stop, trip type) -> (p50, p90, samples)
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def load(self):
+        by_bucket = {}
+        all_day_counts = {}
+        rows = SegmentTravelTime.objects.values_list(
+            'from_stop_id', 'to_stop_id', 'trip_type', 'time_bucket', 'p50_seconds', 'p90_seconds',
+            'sample_count', 'histogram',
+        )
+        for from_stop, to_stop, trip_type, bucket, p50, p90, samples, histogram in rows.iterator(chunk_size=5000):
+            by_bucket[(from_stop, to_stop, trip_type, bucket)] = (p50, p90, samples)
+            key = (from_stop, to_stop, trip_type)
+            counts = decode_histogram(histogram)
+            all_day_counts[key] = all_day_counts[key] + counts if key in all_day_counts else counts
+        self.by_bucket = by_bucket
+        self.all_day = {
+            key: (percentile(counts, 50), percentile(counts, 90), int(counts.sum()))
+            for key, counts in all_day_counts.items()
+        }
+        self.loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            with self._lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+                    self.load()
+
+    def lookup(self, from_stop_id, to_stop_id, trip_type, when=None):
+        """
+        (p50 seconds, p90 seconds, samples) for a stop pair departing at `when`,
+        the all-day distribution if the bucket has too few samples, None if never seen
+        """
+        self._fresh()
+        if when is not None:
+            found = self.by_bucket.get((from_stop_id, to_stop_id, trip_type, time_bucket(when)))
+            if found is not None and found[2] >= MIN_SAMPLES:
+                return found
+        return self.all_day.get((from_stop_id, to_stop_id, trip_type))
+
+    def median(self, from_stop_id, to_stop_id, trip_type, when=None):
+        found = self.lookup(from_stop_id, to_stop_id, trip_type, when)
+        return None if found is None else found[0]
+
+
+segment_times = SegmentTimes()
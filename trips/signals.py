@@ -0,0 +1,110 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import positions
+from .eta import FINISHED_STATUSES, engine as eta_engine
+from .geofence import engine as geofence_engine
+from .live import hub
+from .mapmatch import engine as match_engine, match_trip
+from .safety import engine as safety_engine
+from .models import Trip, TripEvent, TripStudent
+from .analytics import summarize_trip
+from .tracks import pack_trip
+
+# Sent with send_robust for every batch of GPS points accepted by the ingestion
+# pipeline, once the points are queued for writing, a failing receiver is logged.
+# Arguments: trip_id, bus_id, school_id, locations (unsaved TripLocation list)
+points_ingested = Signal()
+
+
+@receiver(points_ingested)
+def update_latest_position(sender, trip_id, bus_id, school_id, locations, **kwargs):
+    """Keep the latest-position cache current, locations arrive sorted by time"""
+    positions.record_position(trip_id, bus_id, school_id, locations[-1])
+
+
+@receiver(points_ingested)
+def broadcast_position(sender, trip_id, bus_id, school_id, locations, **kwargs):
+    if hub.is_running:
+        data = positions.serialize_location(locations[-1], trip_id, bus_id, school_id)
+        hub.publish_threadsafe('position', trip_id, school_id, data)
+
+
+@receiver(points_ingested)
+def detect_arrivals(sender, trip_id, bus_id, school_id, locations, **kwargs):
+    """Mark students picked up or dropped off when the bus dwells at their stop"""
+    geofence_engine.on_points(trip_id, locations)
+
+
+@receiver(points_ingested)
+def update_etas(sender, trip_id, bus_id, school_id, locations, **kwargs):
+    eta_engine.on_points(trip_id, locations)
+
+
+@receiver(points_ingested)
+def match_to_path(sender, trip_id, bus_id, school_id, locations, **kwargs):
+    """Snap the bus onto the route's learned path"""
+    match_engine.on_points(trip_id, locations)
+
+
+@receiver(points_ingested)
+def check_driving(sender, trip_id, bus_id, school_id, locations, **kwargs):
+    """Overspeed, harsh braking and stationary rules"""
+    safety_engine.on_points(trip_id, school_id, locations)
+
+
+@receiver(post_save, sender=TripStudent)
+def finish_stop(sender, instance, raw=False, **kwargs):
+    if not raw and instance.status in FINISHED_STATUSES:
+        geofence_engine.remove_stop(instance.trip_id, instance.pk)
+        eta_engine.mark_finished(instance.trip_id, instance.pk)
+
+
+@receiver(post_save, sender=TripEvent)
+def broadcast_event(sender, instance, created, raw=False, **kwargs):
+    if raw or not created or not hub.is_running:
+        return
+    school_id = Trip.objects.filter(pk=instance.trip_id).values_list('school_id', flat=True).first()
+    data = {
+        'event_type': instance.event_type,
+        'description': instance.description,
+        'timestamp': instance.timestamp.isoformat(),
+        'latitude': None if instance.latitude is None else float(instance.latitude),
+        'longitude': None if instance.longitude is None else float(instance.longitude),
+    }
+    transaction.on_commit(lambda: hub.publish_threadsafe('event', instance.trip_id, school_id, data))
+
+
+@receiver(post_save, sender=Trip)
+def forget_finished_trip(sender, instance, raw=False, **kwargs):
+    if not raw and instance.status in ('COMPLETED', 'CANCELLED'):
+        positions.forget_trip(instance.pk)
+        eta_engine.forget(instance.pk)
+        geofence_engine.forget(instance.pk)
+        safety_engine.forget(instance.pk)
+        match_engine.forget(instance.pk)
+
+
+@receiver(pre_save, sender=Trip)
+def remember_stored_status(sender, instance, raw=False, **kwargs):
+    """Status before this save, so post_save receivers can act on transitions only"""
+    instance._stored_status = None
+    if not raw and instance.pk is not None:
+        instance._stored_status = Trip.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Trip)
+def pack_completed_trip(sender, instance, raw=False, **kwargs):
+    """Simplify a trip's points into its TripTrack, summarize and map-match it when the trip is completed"""
+    if raw or instance.status != 'COMPLETED' or getattr(instance, '_stored_status', None) == 'COMPLETED':
+        return  # later saves of a completed trip, e.g. an edited remark, must not redo this
+
+    def pack():
+        from .ingestion import location_buffer
+        location_buffer.flush()  # points still waiting in the buffer belong in the track
+        summarize_trip(instance.pk)  # from the raw rows, before they are purged
+        match_trip(instance.pk)
+        pack_trip(instance.pk)
+
+    transaction.on_commit(pack)
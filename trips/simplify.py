@@ -0,0 +1,50 @@
+"""
+Douglas-Peucker simplification of GPS tracks. Points are projected to a local
+plane in metres and every kept point is within `tolerance` metres of the
+simplified polyline. The distance computation for each split is vectorized,
+only the recursion stack is Python.
+"""
+import numpy as np
+
+from common.geo import to_local_xy
+
+
+def douglas_peucker(x, y, tolerance):
+    """Boolean mask of the points to keep from the polyline (x, y)"""
+    count = len(x)
+    keep = np.zeros(count, dtype=bool)
+    if count <= 2:
+        keep[:] = True
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px, py = x[first + 1:last], y[first + 1:last]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            distances = np.hypot(px - x[first], py - y[first])
+        else:
+            # Distance to the segment, not the infinite line, so loops are not cut off
+            t = np.clip(((px - x[first]) * dx + (py - y[first]) * dy) / length_sq, 0, 1)
+            distances = np.hypot(px - (x[first] + t * dx), py - (y[first] + t * dy))
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplify_track(latitudes, longitudes, tolerance):
+    """Boolean mask of the track points to keep for a tolerance in metres"""
+    if len(latitudes) <= 2 or not tolerance:
+        return np.ones(len(latitudes), dtype=bool)
+    x, y = to_local_xy(latitudes, longitudes)
+    return douglas_peucker(x, y, tolerance)
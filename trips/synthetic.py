@@ -0,0 +1,427 @@
+"""
+Seeded synthetic datasets for benchmarks and load tests, at the named SCALES.
+
+A dataset is a district of schools with their admins, drivers, parents,
+students, buses, routes and stops, and `days` of completed trips with their
+TripStudents, TripEvents and TripLocations ending the day before `last_day`.
+Every school is generated from its own NumPy Generator seeded with (seed,
+school number), so a seed and last_day give the same rows whatever the
+number of workers. Values are drawn as arrays per school rather than per
+row, rows are written with bulk_create and TripStudents and TripLocations,
+the bulk of the data, with COPY on PostgreSQL.
+
+Buses drive L-shaped legs between the stops of a route (a crude street
+grid) at a per-trip speed, stop at every stop for a while and report a
+noisy GPS fix every `interval` seconds, so the learned segment times, route
+paths and safety rules have something sensible to work on.
+
+Rows carry the DATASET_MARKER remark of their seed, and phone numbers,
+student ids, registration and license numbers embed the seed and school
+number, so datasets of different seeds can share a database.
+"""
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Driver, Parent, Profile, User, UserTypes
+from common.geo import from_local_xy
+from schools.models import Route, RouteStudent, School, SchoolAdmin, Student
+from schools.routing import optimize_order
+from vehicles.models import Bus, BusDocument
+
+from .materialize import TripMaterializer, build_trip
+from .models import TripEvent, TripLocation, TripStudent
+
+SCALES = {
+    # TripLocations: about schools x routes x 2 x days x 5700 / interval, trips take 1.5 h with 50 stops
+    'S': {'schools': 5, 'students': 200, 'routes': 4, 'days': 5, 'interval': 30},  # ~40 thousand
+    'M': {'schools': 25, 'students': 400, 'routes': 8, 'days': 7, 'interval': 30},  # ~500 thousand
+    'L': {'schools': 100, 'students': 600, 'routes': 12, 'days': 7, 'interval': 15},  # ~6 million
+    'XL': {'schools': 500, 'students': 800, 'routes': 16, 'days': 5, 'interval': 15},  # ~30 million
+}
+MAX_SEED = 999  # seeds are embedded in identifiers as three digits
+DATASET_MARKER = 'synthetic:{seed}'
+
+# (latitude, longitude) of the metro areas schools are spread around
+CITIES = [
+    ('Hyderabad', 'Telangana', 17.3850, 78.4867), ('Mumbai', 'Maharashtra', 19.0760, 72.8777),
+    ('Bangalore', 'Karnataka', 12.9716, 77.5946), ('Delhi', 'Delhi', 28.6139, 77.2090),
+    ('Chennai', 'Tamil Nadu', 13.0827, 80.2707), ('Pune', 'Maharashtra', 18.5204, 73.8567),
+]
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Vihaan', 'Arjun', 'Sai', 'Reyansh', 'Krishna', 'Ishaan', 'Rohan',
+    'Kabir', 'Ananya', 'Diya', 'Aadhya', 'Saanvi', 'Pari', 'Anika', 'Navya', 'Myra', 'Sara',
+    'Ira', 'Riya', 'Kiara', 'Meera', 'Priya', 'Rahul', 'Amit', 'Sunita', 'Deepa', 'Vikram',
+]
+LAST_NAMES = [
+    'Sharma', 'Verma', 'Gupta', 'Reddy', 'Rao', 'Iyer', 'Nair', 'Patel', 'Shah', 'Mehta',
+    'Singh', 'Kumar', 'Das', 'Bose', 'Joshi', 'Kulkarni', 'Pillai', 'Menon', 'Chopra', 'Malhotra',
+]
+SCHOOL_PREFIXES = ['Delhi', 'Kendriya', 'St.', 'Holy', 'Modern', 'DAV', 'Bharatiya', 'Saraswati', 'Vidya', 'National']
+SCHOOL_SUFFIXES = ['Public School', 'International School', 'Vidyalaya', 'Academy', 'High School', 'Model School']
+GRADES = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X', 'XI', 'XII']
+SECTIONS = ['A', 'B', 'C', 'D']
+BUS_MAKES = [('Tata', 'Starbus'), ('Ashok Leyland', 'Sunshine'), ('Force', 'Traveller'), ('Eicher', 'Skyline')]
+
+STUDENT_SPREAD_M = 1500.0  # standard deviation of home locations around the school
+GUARDIAN_SHARE = 0.8  # guardians per student, the rest are siblings
+PARENT_SHARE = 0.7  # guardians registered as Parent users
+ABSENT_SHARE = 0.05
+PLANNED_SPEED_KMH = 20.0  # used for the scheduled stop times
+DWELL_SECONDS = 30.0  # at every stop
+GPS_NOISE_M = 5.0
+DELAY_EVENT_MINUTES = 10  # a later start records a DELAY event
+TIMETABLE = {'PICKUP': (6 * 60 + 30, 45), 'DROP': (14 * 60, 60)}  # earliest local start in minutes, spread
+VISIT_COLUMNS = ['trip_id', 'route_student_id', 'scheduled_time', 'actual_time', 'status', 'remarks']
+LOCATION_COLUMNS = ['trip_id', 'latitude', 'longitude', 'timestamp', 'speed', 'remarks']
+MIXIN_COLUMNS = ['created_at', 'updated_at', 'is_active', 'is_deleted']
+
+
+def marker(seed):
+    return DATASET_MARKER.format(seed=seed)
+
+
+def is_loaded(seed):
+    return School.objects.filter(remarks=marker(seed)).exists()
+
+
+def phone(seed, role, school_number, index):
+    """'+91' and 13 digits, unique per seed, role, school number and index"""
+    return f'+91{seed:03d}{role}{school_number:04d}{index:05d}'
+
+
+def person_names(rng, count):
+    first = rng.integers(len(FIRST_NAMES), size=count).tolist()
+    last = rng.integers(len(LAST_NAMES), size=count).tolist()
+    return [(FIRST_NAMES[i], LAST_NAMES[j]) for i, j in zip(first, last)]
+
+
+def leg_path(x, y):
+    """Waypoints of L-shaped legs through the points (x, y), and the index of each point among them"""
+    path_x, path_y, stop_index = [x[0]], [y[0]], [0]
+    for i in range(1, len(x)):
+        path_x.extend((x[i], x[i]))
+        path_y.extend((y[i - 1], y[i]))
+        stop_index.append(len(path_x) - 1)
+    return np.array(path_x), np.array(path_y), stop_index
+
+
+def pickup_order(x, y, indexes):
+    """`indexes` of homes at (x, y) in pick-up order, an optimized street-grid path ending at the school (0, 0)"""
+    x = np.concatenate(([0.0], x))
+    y = np.concatenate(([0.0], y))
+    matrix = np.abs(x[:, None] - x[None, :]) + np.abs(y[:, None] - y[None, :])
+    order = np.array(optimize_order(matrix, 0)[1:]) - 1
+    return indexes[order[::-1]]
+
+
+def drive(path_x, path_y, stop_index, speed_ms, dwell):
+    """
+    Knots of distance travelled against seconds from the start for a bus
+    driving the path at `speed_ms` and waiting `dwell` seconds at the stops.
+    Returns (knot seconds, knot metres, cumulative metres of the path, arrival seconds of the stops)
+    """
+    along = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(path_x), np.diff(path_y)))))
+    knot_seconds, knot_metres, arrivals = [0.0], [0.0], [0.0]
+    clock = dwell
+    knot_seconds.append(clock)
+    knot_metres.append(0.0)
+    for previous, index in zip(stop_index, stop_index[1:]):
+        clock += (along[index] - along[previous]) / speed_ms
+        arrivals.append(clock)
+        knot_seconds.append(clock)
+        knot_metres.append(along[index])
+        clock += dwell
+        knot_seconds.append(clock)
+        knot_metres.append(along[index])
+    return np.array(knot_seconds), np.array(knot_metres), along, arrivals
+
+
+def track(rng, path_x, path_y, along, knot_seconds, knot_metres, interval, origin):
+    """Fix times (seconds from the start), latitudes, longitudes and km/h speeds every `interval` seconds"""
+    seconds = np.arange(0.0, knot_seconds[-1] + interval, interval)
+    metres = np.interp(seconds, knot_seconds, knot_metres)
+    x = np.interp(metres, along, path_x) + rng.normal(0, GPS_NOISE_M, len(seconds))
+    y = np.interp(metres, along, path_y) + rng.normal(0, GPS_NOISE_M, len(seconds))
+    latitudes, longitudes = from_local_xy(x, y, origin)
+    speeds = np.gradient(metres, seconds) * 3.6 if len(seconds) > 1 else np.zeros(1)
+    speeds = np.clip(speeds + rng.normal(0, 1.5, len(seconds)) * (speeds > 0), 0, 999)
+    return seconds, latitudes, longitudes, speeds
+
+
+def copy_rows(model, columns, rows):
+    """
+    Write `rows` (tuples of `columns` attnames) of `model`, with COPY on
+    PostgreSQL and bulk_create elsewhere. BaseMixin fields are filled in.
+    Returns the number written.
+    """
+    now = timezone.now()
+    if connection.vendor != 'postgresql':
+        model.objects.bulk_create([
+            model(**dict(zip(columns, row)), created_at=now, updated_at=now) for row in rows
+        ], batch_size=5000)
+        return len(rows)
+    names = ', '.join(connection.ops.quote_name(column) for column in (*columns, *MIXIN_COLUMNS))
+    with connection.cursor() as cursor:
+        with cursor.copy(f'COPY {model._meta.db_table} ({names}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row((*row, now, now, True, False))
+    return len(rows)
+
+
+def generate_school(number, scale, seed, last_day):
+    """Generate school `number` of a dataset in one transaction, returns its summary"""
+    started = time.perf_counter()
+    size = SCALES[scale]
+    rng = np.random.default_rng([seed, number])
+    now = timezone.now()
+    tag = marker(seed)
+    password = make_password(None)
+
+    with transaction.atomic():
+        city, state, city_latitude, city_longitude = CITIES[number % len(CITIES)]
+        origin = (city_latitude + rng.normal(0, 0.08), city_longitude + rng.normal(0, 0.08))
+        domain = f'school{number}.s{seed}.example.com'
+        school = School.objects.create(
+            name=f'{SCHOOL_PREFIXES[rng.integers(len(SCHOOL_PREFIXES))]} '
+                 f'{SCHOOL_SUFFIXES[rng.integers(len(SCHOOL_SUFFIXES))]} {number}',
+            address=f'{number} Main Road', city=city, state=state, zip_code=f'{500000 + number}',
+            latitude=round(origin[0], 6), longitude=round(origin[1], 6),
+            contact_number=phone(seed, 0, number, 0), email=f'info@{domain}', website=f'https://www.{domain}',
+            established_date=last_day - timedelta(days=int(rng.integers(365, 50 * 365))), remarks=tag,
+        )
+
+        # Homes around the school, guardians with one or more children
+        count = size['students']
+        home_x = rng.normal(0, STUDENT_SPREAD_M, count)
+        home_y = rng.normal(0, STUDENT_SPREAD_M, count)
+        home_latitudes, home_longitudes = from_local_xy(home_x, home_y, origin)
+        guardian_count = max(1, int(count * GUARDIAN_SHARE))
+        guardians = np.concatenate((
+            np.arange(min(count, guardian_count)), rng.integers(guardian_count, size=max(0, count - guardian_count))
+        ))
+        guardian_names = person_names(rng, guardian_count)
+        registered = rng.random(guardian_count) < PARENT_SHARE
+
+        # Users: the admin, one driver per route and the registered parents
+        routes = size['routes']
+        driver_names = person_names(rng, routes)
+        admin_first, admin_last = person_names(rng, 1)[0]
+        users = [User(
+            phone=phone(seed, 1, number, 0), email=f'admin@{domain}', user_type=UserTypes.SCHOOL_ADMIN,
+            first_name=admin_first, last_name=admin_last, is_staff=True, password=password,
+        )]
+        users += [
+            User(phone=phone(seed, 2, number, i), user_type=UserTypes.DRIVER, first_name=first, last_name=last,
+                 password=password)
+            for i, (first, last) in enumerate(driver_names)
+        ]
+        parent_indexes = np.flatnonzero(registered).tolist()
+        users += [
+            User(phone=phone(seed, 3, number, i), user_type=UserTypes.PARENT, first_name=guardian_names[i][0],
+                 last_name=guardian_names[i][1], password=password)
+            for i in parent_indexes
+        ]
+        users = User.objects.bulk_create(users)
+        admin, drivers, parent_users = users[0], users[1:routes + 1], users[routes + 1:]
+
+        Profile.objects.create(
+            user=admin, address=school.address, city=city, state=state, zip_code=school.zip_code,
+            latitude=school.latitude, longitude=school.longitude, bio=f'Principal at {school.name}',
+        )
+        SchoolAdmin.objects.bulk_create([SchoolAdmin(
+            user=admin, school=school, designation='Principal', is_primary_admin=True,
+            created_at=now, updated_at=now, remarks=tag,
+        )])
+        parents = Parent.objects.bulk_create([
+            Parent(user=user, city=city, state=state, created_at=now, updated_at=now, remarks=tag)
+            for user in parent_users
+        ])
+        parent_ids = dict(zip(parent_indexes, (parent.id for parent in parents)))
+
+        ages = rng.integers(5 * 365, 18 * 365, size=count).tolist()
+        grades = rng.integers(len(GRADES), size=count).tolist()
+        sections = rng.integers(len(SECTIONS), size=count).tolist()
+        genders = rng.integers(2, size=count).tolist()
+        first_names = rng.integers(len(FIRST_NAMES), size=count).tolist()
+        students = Student.objects.bulk_create([
+            Student(
+                school=school,
+                parent_id=parent_ids.get(guardian),
+                roll_number=f'{GRADES[grades[i]]}{SECTIONS[sections[i]]}{i + 1:03d}',
+                student_id=f'S{seed:03d}{number:04d}{i:05d}',
+                name=f'{FIRST_NAMES[first_names[i]]} {guardian_names[guardian][1]}',
+                grade=GRADES[grades[i]],
+                section=SECTIONS[sections[i]],
+                date_of_birth=last_day - timedelta(days=ages[i]),
+                gender=('Male', 'Female')[genders[i]],
+                guardian_name=' '.join(guardian_names[guardian]),
+                guardian_relation='Parent',
+                guardian_phone=phone(seed, 3, number, guardian),
+                address=f'{i + 1} Cross Road, {city}',
+                city=city,
+                state=state,
+                latitude=round(float(home_latitudes[i]), 6),
+                longitude=round(float(home_longitudes[i]), 6),
+                created_at=now,
+                updated_at=now,
+                remarks=tag,
+            )
+            for i, guardian in enumerate(guardians.tolist())
+        ])
+
+        drivers = Driver.objects.bulk_create([
+            Driver(
+                user=user, school=school, date_of_birth=last_day - timedelta(days=int(rng.integers(25 * 365, 55 * 365))),
+                blood_group='O+', emergency_contact=phone(seed, 4, number, i),
+                license_number=f'DL{seed:03d}{number:04d}{i:04d}', license_type='COMMERCIAL',
+                license_issue_date=last_day - timedelta(days=int(rng.integers(365, 3650))),
+                license_expiry_date=last_day + timedelta(days=int(rng.integers(365, 3650))),
+                license_issuing_authority=f'RTO {city}', years_of_experience=int(rng.integers(3, 20)),
+                license_document='driver_documents/licenses/synthetic.pdf',
+                created_at=now, updated_at=now, remarks=tag,
+            )
+            for i, user in enumerate(drivers)
+        ])
+        makes = rng.integers(len(BUS_MAKES), size=routes).tolist()
+        buses = Bus.objects.bulk_create([
+            Bus(
+                registration_number=f'SY{seed:03d}-{number:04d}-{i:03d}', school=school,
+                capacity=int(max(20, -(-count // routes // 10) * 10)), make=BUS_MAKES[makes[i]][0],
+                model=BUS_MAKES[makes[i]][1], year=int(rng.integers(2015, 2025)), fuel_type='DIESEL',
+                status='ACTIVE', insurance_expiry=last_day + timedelta(days=365),
+                fitness_certificate_expiry=last_day + timedelta(days=365),
+                created_at=now, updated_at=now, remarks=tag,
+            )
+            for i in range(routes)
+        ])
+        BusDocument.objects.bulk_create([
+            BusDocument(
+                bus=bus, document_type=document_type, document_number=f'{bus.registration_number}-{document_type}',
+                issue_date=last_day - timedelta(days=180), expiry_date=last_day + timedelta(days=365),
+                document_file='bus_documents/synthetic.pdf', created_at=now, updated_at=now, remarks=tag,
+            )
+            for bus in buses for document_type, _ in BusDocument.DOCUMENT_TYPES
+        ])
+
+        # Routes are sectors around the school
+        angles = np.arctan2(home_y, home_x)
+        by_angle = np.argsort(angles, kind='stable')
+        sectors = np.array_split(by_angle, routes)
+        route_rows = Route.objects.bulk_create([
+            Route(name=f'Route {i + 1}', school=school, default_bus=buses[i], created_at=now, updated_at=now, remarks=tag)
+            for i in range(routes)
+        ])
+        ordered = [pickup_order(home_x[sector], home_y[sector], sector) for sector in sectors]
+        stops = RouteStudent.objects.bulk_create([
+            RouteStudent(
+                route=route, student=students[index], sequence_number=sequence,
+                pickup_address=students[index].address, drop_address=students[index].address,
+                pickup_latitude=students[index].latitude, pickup_longitude=students[index].longitude,
+                drop_latitude=students[index].latitude, drop_longitude=students[index].longitude,
+                created_at=now, updated_at=now, remarks=tag,
+            )
+            for route, sector in zip(route_rows, ordered) for sequence, index in enumerate(sector.tolist(), 1)
+        ], batch_size=5000)
+        stop_ids = []
+        position = 0
+        for sector in ordered:
+            stop_ids.append([stop.id for stop in stops[position:position + len(sector)]])
+            position += len(sector)
+
+        visits = []  # (Trip, [TripStudent])
+        locations = []  # (Trip, fix seconds, latitudes, longitudes, speeds)
+        with TripMaterializer() as materializer:
+            for route_index, route in enumerate(route_rows):
+                sector = ordered[route_index]
+                if not len(sector):
+                    continue
+                for trip_type, (earliest, spread) in TIMETABLE.items():
+                    # Pickups end at the school, drops start there
+                    x = np.concatenate((home_x[sector], [0.0]))
+                    y = np.concatenate((home_y[sector], [0.0]))
+                    route_stops = list(stop_ids[route_index])
+                    if trip_type == 'DROP':
+                        x, y, route_stops = x[::-1], y[::-1], route_stops[::-1]
+                    path_x, path_y, stop_index = leg_path(x, y)
+                    start_minutes = earliest + int(rng.integers(spread))
+                    plan_seconds, _, _, plan_arrivals = drive(
+                        path_x, path_y, stop_index, PLANNED_SPEED_KMH / 3.6, DWELL_SECONDS
+                    )
+                    student_stops = slice(0, -1) if trip_type == 'PICKUP' else slice(1, None)
+
+                    for day_offset in range(size['days'], 0, -1):
+                        day = last_day - timedelta(days=day_offset)
+                        scheduled_start = timezone.make_aware(
+                            datetime.combine(day, datetime.min.time()) + timedelta(minutes=start_minutes)
+                        )
+                        trip, trip_students = build_trip(
+                            route, trip_type, scheduled_start, timedelta(seconds=float(plan_seconds[-1])),
+                            route_stops, bus_id=buses[route_index].id, driver_id=drivers[route_index].id,
+                            offsets=[timedelta(seconds=float(s)) for s in plan_arrivals[student_stops]], now=now,
+                        )
+                        speed = PLANNED_SPEED_KMH * rng.lognormal(0, 0.15) / 3.6
+                        knot_seconds, knot_metres, along, arrivals = drive(
+                            path_x, path_y, stop_index, speed, DWELL_SECONDS * rng.uniform(0.5, 1.5)
+                        )
+                        delay = max(-300.0, rng.normal(120, 240))
+                        actual_start = scheduled_start + timedelta(seconds=delay)
+                        trip.status = 'COMPLETED'
+                        trip.actual_start_time = actual_start
+                        trip.actual_end_time = actual_start + timedelta(seconds=float(knot_seconds[-1]))
+                        trip.remarks = tag
+                        absent = rng.random(len(trip_students)) < ABSENT_SHARE
+                        for trip_student, arrival, is_absent in zip(trip_students, arrivals[student_stops], absent):
+                            if is_absent:
+                                trip_student.status = 'ABSENT'
+                            else:
+                                trip_student.status = 'PICKED_UP' if trip_type == 'PICKUP' else 'DROPPED_OFF'
+                                trip_student.actual_time = actual_start + timedelta(seconds=float(arrival))
+                        events = [
+                            TripEvent(event_type='START', timestamp=trip.actual_start_time, description='Trip started'),
+                            TripEvent(event_type='END', timestamp=trip.actual_end_time, description='Trip completed'),
+                        ]
+                        if delay >= DELAY_EVENT_MINUTES * 60:
+                            events.append(TripEvent(
+                                event_type='DELAY', timestamp=trip.actual_start_time,
+                                description=f'Started {delay / 60:.0f} min late',
+                            ))
+                        for event in events:
+                            event.created_at = event.updated_at = now
+                            event.remarks = tag
+                        materializer.add(trip, (), (), events)
+                        visits.append((trip, trip_students))
+                        locations.append((trip, *track(
+                            rng, path_x, path_y, along, knot_seconds, knot_metres, size['interval'], origin
+                        )))
+
+        # The two big tables go through COPY once the trips have ids
+        visit_count = copy_rows(TripStudent, VISIT_COLUMNS, [
+            (trip.id, visit.route_student_id, visit.scheduled_time, visit.actual_time, visit.status, tag)
+            for trip, trip_students in visits for visit in trip_students
+        ])
+        location_count = copy_rows(TripLocation, LOCATION_COLUMNS, [
+            (trip.id, round(latitude, 6), round(longitude, 6),
+             trip.actual_start_time + timedelta(seconds=second), round(speed, 2), tag)
+            for trip, seconds, latitudes, longitudes, speeds in locations
+            for second, latitude, longitude, speed in zip(
+                seconds.tolist(), latitudes.tolist(), longitudes.tolist(), speeds.tolist()
+            )
+        ])
+
+    return {
+        'school': number,
+        'students': count,
+        'trips': materializer.counts['trips'],
+        'locations': location_count,
+        'rows': (
+            1 + len(users) + len(students) + len(buses) + len(stops)
+            + sum(materializer.counts.values()) + visit_count + location_count
+        ),
+        'seconds': time.perf_counter() - started,
+    }
+
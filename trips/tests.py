@@ -1,3 +1,765 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import random
+import tarfile
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User, UserTypes
+from common.geo import from_local_xy, to_local_xy
+from common.fixtures import load
+from common.models import JobCheckpoint
+from schools.models import Route, School, Student
+from vehicles.models import Bus
+
+from .analytics import summarize_trip
+from .conflicts import IntervalTree, sweep_conflicts, trip_conflicts
+from .export import archive_chunks, school_querysets
+from .mapmatch import PathMatcher, encode_path, get_matcher, match_trip
+from .ingestion import IngestionError, LocationBuffer, location_buffer, parse_points
+from .models import RoutePath, Trip, TripEvent, TripLocation, TripStudent, TripSummary, TripTrack
+from .partitions import PARTITIONED_TABLES, split_default_partition
+from .purge import checkpoint_name, purge, trips_to_purge
+from .segments import learn
+from .synthetic import generate_school, is_loaded, marker
+from .simplify import douglas_peucker, simplify_track
+from .tracks import decode_track, encode_track, pack_trip, purge_raw_locations, track_as_dict
+
+SEED = 7
+LAST_DAY = date(2025, 3, 1)
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+def create_trip(status='IN_PROGRESS', registration_number='KA01AB1234'):
+    school = School.objects.create(
+        name='Test School', contact_number='+919999999999', email='school@example.com',
+        established_date=date(2000, 1, 1),
+    )
+    bus = Bus.objects.create(
+        registration_number=registration_number, school=school, capacity=40, make='Tata', model='Starbus', year=2020,
+        fuel_type='DIESEL', insurance_expiry=date(2030, 1, 1), fitness_certificate_expiry=date(2030, 1, 1),
+    )
+    route = Route.objects.create(name='Route 1', school=school, default_bus=bus)
+    now = timezone.now()
+    return Trip.objects.create(
+        school=school, route=route, bus=bus, trip_type='PICKUP', status=status,
+        scheduled_start_time=now, actual_start_time=now,
+    )
+
+
+class IngestLocationsTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip()
+        self.token = self.trip.bus.issue_device_token()
+        self.payload = json.dumps({
+            'bus': self.trip.bus.registration_number,
+            'points': [{'latitude': 12.97, 'longitude': 77.59, 'speed': 30, 'timestamp': '2025-03-01T08:00:00Z'}],
+        })
+
+    def post(self, token=None, payload=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token is not None else {}
+        return self.client.post(
+            reverse('trips:ingest_locations'), payload or self.payload, content_type='application/json', **headers
+        )
+
+    def test_points_need_the_device_token(self):
+        with mock.patch.object(location_buffer, 'extend') as extend:
+            self.assertEqual(self.post().status_code, 401)
+            self.assertEqual(self.post('not-the-token').status_code, 401)
+            extend.assert_not_called()
+
+            response = self.post(self.token)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'trip': self.trip.pk, 'accepted': 1})
+        extend.assert_called_once()
+
+    def test_failing_receiver_does_not_lose_points(self):
+        with mock.patch.object(location_buffer, 'extend') as extend, \
+                mock.patch('trips.signals.safety_engine.on_points', side_effect=RuntimeError('broken')):
+            with self.assertLogs('trips.ingestion', 'ERROR'):
+                response = self.post(self.token)
+        self.assertEqual(response.status_code, 202)
+        extend.assert_called_once()
+
+    def test_bus_without_a_token_accepts_nothing(self):
+        Bus.objects.filter(pk=self.trip.bus_id).update(device_token_hash='')
+        with mock.patch.object(location_buffer, 'extend') as extend:
+            self.assertEqual(self.post('').status_code, 401)
+            self.assertEqual(self.post(self.token).status_code, 401)
+        extend.assert_not_called()
+
+    def test_unknown_bus_looks_like_a_wrong_token(self):
+        payload = json.dumps({'bus': 'XX00XX0000', 'points': []})
+        self.assertEqual(self.post(self.token, payload).status_code, 401)
+
+
+class TripTrackViewTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip()
+        TripLocation.objects.create(
+            trip=self.trip, latitude=Decimal('12.970000'), longitude=Decimal('77.590000'), timestamp=timezone.now()
+        )
+        self.url = reverse('trips:trip_track', args=[self.trip.pk])
+
+    def test_track_needs_access_to_the_school(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url, {'matched': '1'}).status_code, 403)
+        self.client.force_login(User.objects.create_user(
+            phone='+919999999991', password='secret', user_type=UserTypes.PARENT
+        ))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user(
+            email='staff@example.com', phone='+919999999992', password='secret', user_type=UserTypes.ADMIN,
+            is_staff=True,
+        ))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['latitude'], [12.97])
+
+    def test_unknown_trip(self):
+        self.assertEqual(self.client.get(reverse('trips:trip_track', args=[self.trip.pk + 1000])).status_code, 404)
+
+
+class IntervalTreeTests(SimpleTestCase):
+    def test_matches_a_linear_scan(self):
+        rng = random.Random(SEED)
+        intervals = []
+        tree = IntervalTree()
+        for key in range(300):
+            start = rng.randrange(1000)
+            intervals.append((start, start + rng.randrange(1, 60), key))
+            tree.add(*intervals[-1])
+        for _ in range(200):
+            start = rng.randrange(1000)
+            end = start + rng.randrange(1, 60)
+            expected = {key for low, high, key in intervals if low < end and high > start}
+            self.assertEqual(set(tree.overlapping(start, end)), expected)
+
+    def test_touching_and_identical_intervals(self):
+        tree = IntervalTree()
+        tree.add(10, 20, 'a')
+        tree.add(10, 20, 'b')
+        self.assertEqual(tree.overlapping(20, 30), [])
+        self.assertEqual(tree.overlapping(0, 10), [])
+        self.assertEqual(sorted(tree.overlapping(10, 20)), ['a', 'b'])
+        self.assertEqual(tree.overlapping(19, 21, exclude='a'), ['b'])
+        tree.remove('b')
+        self.assertEqual(tree.overlapping(10, 20), ['a'])
+
+
+class SweepConflictsTests(SimpleTestCase):
+    def test_pairs(self):
+        windows = [
+            ('bus', 1, 0, 10, 1),
+            ('bus', 1, 0, 10, 2),  # identical
+            ('bus', 1, 10, 20, 3),  # touches both
+            ('bus', 1, 15, 16, 4),  # inside 3
+            ('bus', 2, 15, 16, 5),  # another bus
+            ('driver', 1, 15, 16, 6),
+        ]
+        self.assertEqual(list(sweep_conflicts(windows)), [('bus', 1, 1, 2), ('bus', 1, 3, 4)])
+
+
+class TripConflictTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip(status='SCHEDULED')
+        self.start = self.trip.scheduled_start_time
+
+    def other_trip(self, start, status='SCHEDULED', end=None):
+        return Trip(
+            school=self.trip.school, route=self.trip.route, bus=self.trip.bus, trip_type='DROP', status=status,
+            scheduled_start_time=start, scheduled_end_time=end,
+        )
+
+    def test_overlapping_trip_of_the_same_bus(self):
+        with self.assertRaisesMessage(ValidationError, 'already assigned to an overlapping trip'):
+            self.other_trip(self.start + timedelta(minutes=30)).clean()
+        with self.assertRaises(ValidationError):
+            self.other_trip(self.start).clean()
+
+    def test_trips_that_do_not_conflict(self):
+        # The stored trip lasts DEFAULT_DURATION, 45 minutes
+        self.other_trip(self.start + timedelta(minutes=45)).clean()
+        self.other_trip(self.start - timedelta(minutes=30), end=self.start).clean()
+        self.assertEqual(trip_conflicts(self.other_trip(self.start, status='CANCELLED')), [])
+
+        Trip.objects.filter(pk=self.trip.pk).update(status='CANCELLED')
+        self.other_trip(self.start).clean()
+
+    def test_saved_trip_does_not_conflict_with_itself(self):
+        self.trip.clean()
+
+
+ORIGIN = (12.97, 77.59)
+
+
+def l_shaped_path():
+    """1 km east then 1 km north of ORIGIN, a point every 100 m"""
+    steps = np.arange(0, 1001, 100.0)
+    x = np.concatenate([steps, np.full(10, 1000.0)])
+    y = np.concatenate([np.zeros(11), steps[1:]])
+    return from_local_xy(x, y, ORIGIN)
+
+
+def noisy_drive(rng, sigma=8.0):
+    """Fixes every 20 m along l_shaped_path with Gaussian noise, and their true (x, y)"""
+    along = np.arange(0, 2001, 20.0)
+    x = np.minimum(along, 1000.0)
+    y = np.maximum(along - 1000.0, 0.0)
+    latitudes, longitudes = from_local_xy(x + rng.normal(0, sigma, len(x)), y + rng.normal(0, sigma, len(y)), ORIGIN)
+    return latitudes, longitudes, x, y
+
+
+class MapMatchTests(SimpleTestCase):
+    def test_noisy_track_snaps_onto_the_path(self):
+        rng = np.random.default_rng(SEED)
+        latitudes, longitudes, x, y = noisy_drive(rng)
+        snapped_latitudes, snapped_longitudes, measures = PathMatcher(*l_shaped_path()).match(latitudes, longitudes)
+
+        self.assertFalse(np.isnan(measures).any())
+        sx, sy = to_local_xy(snapped_latitudes, snapped_longitudes, origin=ORIGIN)
+        # Every snapped point lies on one of the two legs, near where the bus really was
+        off_path = np.minimum(np.abs(sy) + np.maximum(sx - 1000, 0), np.abs(sx - 1000) + np.maximum(-sy, 0))
+        self.assertLess(off_path.max(), 0.5)
+        self.assertLess(np.hypot(sx - x, sy - y).max(), 40)
+        self.assertLess(abs(measures[-1] - 2000), 20)
+        self.assertGreater(np.diff(measures).min(), -30)  # BACKTRACK_M
+
+    def test_points_far_from_the_path_are_unmatched(self):
+        latitudes, longitudes = from_local_xy(np.array([100.0, 500, 900]), np.array([5.0, 300, 5]), ORIGIN)
+        _, _, measures = PathMatcher(*l_shaped_path()).match(latitudes, longitudes)
+        self.assertEqual(np.isnan(measures).tolist(), [False, True, False])
+
+
+class MatchTripTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip(status='COMPLETED')
+        latitudes, longitudes, _, _ = noisy_drive(np.random.default_rng(SEED))
+        start = timezone.now() - timedelta(hours=1)
+        TripLocation.objects.bulk_create([
+            TripLocation(
+                trip=self.trip, latitude=Decimal(f'{latitude:.6f}'), longitude=Decimal(f'{longitude:.6f}'),
+                timestamp=start + timedelta(seconds=5 * n),
+            )
+            for n, (latitude, longitude) in enumerate(zip(latitudes, longitudes))
+        ])
+        summarize_trip(self.trip.pk)
+
+    def test_trip_without_a_route_path(self):
+        self.assertIsNone(get_matcher(self.trip.route_id, 'PICKUP'))
+        self.assertIsNone(match_trip(self.trip.pk))
+        self.assertIsNone(TripSummary.objects.get(trip=self.trip).matched_distance_m)
+        raw = track_as_dict(self.trip.pk)
+        self.assertEqual(track_as_dict(self.trip.pk, matched=True), raw)
+
+    def test_trip_is_matched_onto_its_route_path(self):
+        latitudes, longitudes = l_shaped_path()
+        RoutePath.objects.create(
+            route=self.trip.route, trip_type='PICKUP', point_count=len(latitudes), length_m=2000, track_count=3,
+            data=encode_path(latitudes, longitudes),
+        )
+        distance = match_trip(self.trip.pk)
+        self.assertLess(abs(distance - 2000), 20)
+        # Noise makes the raw distance longer than the road
+        self.assertGreater(TripSummary.objects.get(trip=self.trip).distance_m, distance)
+        self.assertAlmostEqual(TripSummary.objects.get(trip=self.trip).matched_distance_m, distance)
+        matched = track_as_dict(self.trip.pk, matched=True)
+        x, y = to_local_xy(matched['latitude'], matched['longitude'], origin=ORIGIN)
+        self.assertLess(np.minimum(np.abs(y), np.abs(x - 1000)).max(), 1)
+
+
+class TrackCodecTests(SimpleTestCase):
+    def test_round_trip(self):
+        offsets = [0, 1.4, 30, 30, 65565]
+        latitudes = [12.9716, 12.971612, -33.8688, 89.999999, 0]
+        longitudes = [77.5946, 77.594611, 151.2093, -179.999999, 0]
+        speeds = [0, 45.678, float('nan'), 400, -3]
+        decoded = decode_track(encode_track(offsets, latitudes, longitudes, speeds))
+        self.assertEqual(decoded[0].tolist(), [0, 1, 30, 30, 65565])
+        np.testing.assert_allclose(decoded[1], latitudes, atol=5e-7)
+        np.testing.assert_allclose(decoded[2], longitudes, atol=5e-7)
+        np.testing.assert_allclose(decoded[3], [0, 45.68, np.nan, 327.67, 0])
+
+    def test_empty_track(self):
+        self.assertEqual([len(array) for array in decode_track(encode_track([], [], [], []))], [0, 0, 0, 0])
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            encode_track([0, 70000], [0, 0], [0, 0], [0, 0])
+        with self.assertRaises(ValueError):
+            encode_track([10, 0], [0, 0], [0, 0], [0, 0])
+        with self.assertRaisesMessage(ValueError, 'Unsupported track format'):
+            decode_track(b'XXXX' + encode_track([0], [0], [0], [0])[4:])
+
+
+class DouglasPeuckerTests(SimpleTestCase):
+    def test_straight_line_keeps_its_ends(self):
+        x = np.arange(10.0)
+        self.assertEqual(douglas_peucker(x, x * 2, 0.1).tolist(), [True] + [False] * 8 + [True])
+
+    def test_points_off_the_line(self):
+        x = np.array([0.0, 1, 2, 3, 4])
+        y = np.array([0.0, 0.05, 3, 0.05, 0])
+        self.assertEqual(douglas_peucker(x, y, 1).tolist(), [True, False, True, False, True])
+        self.assertTrue(douglas_peucker(x, y, 0.01).all())
+        self.assertEqual(douglas_peucker(x, y, 10).tolist(), [True, False, False, False, True])
+
+    def test_loop_back_to_the_start(self):
+        # Distance to the segment, a return trip is not collapsed onto its ends
+        x = np.array([0.0, 50, 100, 50, 0])
+        y = np.array([0.0, 0, 0, 0, 0.1])
+        self.assertTrue(douglas_peucker(x, y, 1)[2])
+
+    def test_tolerance_in_metres(self):
+        # About 11 m north of the line between the two ends
+        latitudes = np.array([12.97, 12.9701, 12.97])
+        longitudes = np.array([77.59, 77.595, 77.60])
+        self.assertEqual(simplify_track(latitudes, longitudes, 5).tolist(), [True, True, True])
+        self.assertEqual(simplify_track(latitudes, longitudes, 20).tolist(), [True, False, True])
+        self.assertTrue(simplify_track(latitudes, longitudes, 0).all())
+
+
+class PackTripTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip()
+        self.start = timezone.now() - timedelta(days=10)
+
+    def add_points(self, *minutes):
+        TripLocation.objects.bulk_create([
+            TripLocation(
+                trip=self.trip, latitude=Decimal('12.970000') + Decimal(minute) / 100, longitude=Decimal('77.590000'),
+                timestamp=self.start + timedelta(minutes=minute),
+            )
+            for minute in minutes
+        ])
+
+    def test_late_points_are_merged_once(self):
+        self.add_points(0, 1, 2)
+        self.assertEqual(pack_trip(self.trip.pk, tolerance=0).raw_point_count, 3)
+        TripLocation.objects.filter(trip=self.trip).delete()
+
+        self.add_points(3)
+        for _ in range(2):
+            track = pack_trip(self.trip.pk, tolerance=0)
+            self.assertEqual((track.raw_point_count, track.point_count), (4, 4))
+            self.assertEqual(len(track.decode()[0]), 4)
+
+    def test_points_more_than_a_gap_apart(self):
+        # A straight line over 20 hours, the middle point is only needed to keep gaps storable
+        self.add_points(0, 600, 1200)
+        track = pack_trip(self.trip.pk, tolerance=1000)
+        self.assertEqual(track.decode()[0].tolist(), [0, 36000, 72000])
+
+        # A reading with a clock far off the rest of the trip is dropped
+        TripLocation.objects.filter(trip=self.trip).delete()
+        track.delete()
+        self.add_points(-2000, 0, 1)
+        with self.assertLogs('trips.tracks', 'WARNING'):
+            track = pack_trip(self.trip.pk, tolerance=0)
+        self.assertEqual(track.start_time, self.start)
+        self.assertEqual(track.decode()[0].tolist(), [0, 60])
+
+    def test_raw_rows_of_old_packed_trips_are_purged(self):
+        self.add_points(0, 1)
+        pack_trip(self.trip.pk, tolerance=0)
+        unpacked = Trip.objects.create(
+            school=self.trip.school, route=self.trip.route, bus=self.trip.bus, trip_type='DROP', status='COMPLETED',
+            actual_end_time=self.start,
+        )
+        TripLocation.objects.create(
+            trip=unpacked, latitude=Decimal('12.970000'), longitude=Decimal('77.590000'), timestamp=self.start
+        )
+        now = timezone.now()
+
+        # Still in progress
+        self.assertEqual(purge_raw_locations(7, now), 0)
+        Trip.objects.filter(pk=self.trip.pk).update(status='COMPLETED', actual_end_time=now - timedelta(days=3))
+        self.assertEqual(purge_raw_locations(7, now), 0)
+        self.assertEqual(purge_raw_locations(2, now), 2)
+        self.assertFalse(TripLocation.objects.filter(trip=self.trip).exists())
+        self.assertTrue(TripLocation.objects.filter(trip=unpacked).exists())
+        self.assertEqual(self.trip.track.point_count, 2)
+
+    def test_repack_while_raw_rows_are_kept(self):
+        self.add_points(0, 1)
+        pack_trip(self.trip.pk, tolerance=0)
+        self.add_points(2)
+        track = pack_trip(self.trip.pk, tolerance=0)
+        self.assertEqual((track.raw_point_count, track.point_count), (3, 3))
+
+
+class TripCompletionTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip()
+
+    def test_only_the_transition_packs_the_trip(self):
+        with mock.patch('trips.signals.pack_trip') as pack, mock.patch('trips.signals.summarize_trip'), \
+                mock.patch('trips.signals.match_trip'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trip.save()
+            pack.assert_not_called()
+
+            self.trip.status = 'COMPLETED'
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trip.save()
+            pack.assert_called_once_with(self.trip.pk)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trip.save()
+            pack.assert_called_once()
+
+    def test_summary_after_purge_comes_from_the_track(self):
+        start = timezone.now() - timedelta(hours=1)
+        TripLocation.objects.bulk_create([
+            TripLocation(
+                trip=self.trip, latitude=Decimal('12.970000') + Decimal(minute) / 1000,
+                longitude=Decimal('77.590000'), timestamp=start + timedelta(minutes=minute),
+            )
+            for minute in range(5)
+        ])
+        pack_trip(self.trip.pk, tolerance=0)
+        TripLocation.objects.filter(trip=self.trip).exclude(timestamp=start).delete()
+        self.assertEqual(summarize_trip(self.trip.pk).point_count, 5)
+
+
+class ParsePointsTests(SimpleTestCase):
+    def point(self, speed):
+        return [{'latitude': 12.97, 'longitude': 77.59, 'speed': speed}]
+
+    def test_speed_must_fit_the_column(self):
+        for speed in (1000, 999.999, -1, float('nan'), float('inf'), '1e400'):
+            with self.subTest(speed=speed), self.assertRaises(IngestionError):
+                parse_points(self.point(speed), 1)
+        self.assertEqual(parse_points(self.point(999.99), 1)[0].speed, Decimal('999.99'))
+
+    def test_speed_is_optional(self):
+        self.assertIsNone(parse_points([{'latitude': 12.97, 'longitude': 77.59}], 1)[0].speed)
+        with self.assertRaisesMessage(IngestionError, 'numeric latitude and longitude'):
+            parse_points([{'latitude': 'north', 'longitude': 77.59}], 1)
+
+
+class LocationBufferTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip()
+        self.other = Trip.objects.create(
+            school=self.trip.school, route=self.trip.route, bus=self.trip.bus, trip_type='DROP', status='IN_PROGRESS'
+        )
+        self.buffer = LocationBuffer(max_points=100, max_age=3600)
+
+    def tearDown(self):
+        if self.buffer._timer is not None:
+            self.buffer._timer.cancel()
+        self.buffer._pending = []
+
+    def location(self, trip, latitude=Decimal('12.970000')):
+        return TripLocation(
+            trip=trip, latitude=latitude, longitude=Decimal('77.590000'), speed=Decimal('30.00'),
+            timestamp=timezone.now(),
+        )
+
+    def test_rows_the_database_rejects_only_drop_their_trip(self):
+        self.buffer.extend([self.location(self.trip), self.location(self.other, latitude=None)])
+        with self.assertLogs('trips.ingestion', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(TripLocation.objects.filter(trip=self.trip).count(), 1)
+        self.assertFalse(TripLocation.objects.filter(trip=self.other).exists())
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_batch_is_requeued_while_the_database_is_unavailable(self):
+        self.buffer.extend([self.location(self.trip), self.location(self.other)])
+        with mock.patch.object(TripLocation.objects, 'bulk_create', side_effect=OperationalError('gone')):
+            with self.assertLogs('trips.ingestion', 'WARNING'):
+                self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(TripLocation.objects.filter(trip__in=[self.trip, self.other]).count(), 2)
+
+
+class PurgeTests(TestCase):
+    def setUp(self):
+        self.trip = create_trip()
+        self.other_school_trip = create_trip(registration_number='KA01AB9999')
+        self.day = date(2025, 3, 1)
+        self.trips = [
+            self.add_trip(self.trip, self.day, hour) for hour in (7, 15)
+        ] + [self.add_trip(self.trip, self.day + timedelta(days=1), 7)]
+        self.other_school = self.add_trip(self.other_school_trip, self.day, 7)
+
+    def add_trip(self, like, day, hour):
+        start = timezone.make_aware(datetime(day.year, day.month, day.day, hour))
+        trip = Trip.objects.create(
+            school=like.school, route=like.route, bus=like.bus, trip_type='PICKUP', status='COMPLETED',
+            scheduled_start_time=start,
+        )
+        TripLocation.objects.create(
+            trip=trip, latitude=Decimal('12.970000'), longitude=Decimal('77.590000'), timestamp=start
+        )
+        TripEvent.objects.create(trip=trip, event_type='START', description='Started', timestamp=start)
+        TripTrack.objects.create(trip=trip, start_time=start, point_count=1, data=b'')
+        return trip
+
+    def remaining(self):
+        trips = [trip.pk for trip in self.trips + [self.other_school]]
+        return set(Trip.objects.filter(pk__in=trips).values_list('pk', flat=True))
+
+    def test_only_matching_trips_and_their_rows_are_deleted(self):
+        summary = purge(self.day, self.day, [self.trip.school_id], chunk_size=1)
+        self.assertEqual(summary['trips'], 2)
+        self.assertEqual(summary['deleted']['trips.TripLocation'], 2)
+        self.assertEqual(summary['deleted']['trips.TripEvent'], 2)
+        self.assertEqual(self.remaining(), {self.trips[2].pk, self.other_school.pk})
+        purged = [trip.pk for trip in self.trips[:2]]
+        for model in (TripLocation, TripEvent, TripTrack):
+            self.assertFalse(model.objects.filter(trip__in=purged).exists())
+            self.assertEqual(model.objects.filter(trip__in=self.remaining()).count(), 2)
+        name, _ = checkpoint_name(self.day, self.day, [self.trip.school_id])
+        self.assertFalse(JobCheckpoint.objects.filter(name=name).exists())
+
+    def test_interrupted_purge_resumes(self):
+        def stop(summary):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            purge(self.day, self.day, chunk_size=1, progress=stop)
+        self.assertEqual(len(self.remaining()), 3)
+        checkpoint = JobCheckpoint.objects.get(name=checkpoint_name(self.day, self.day)[0])
+        self.assertEqual(checkpoint.state['last_id'], self.trips[0].pk)
+
+        summary = purge(self.day, self.day, chunk_size=1)
+        self.assertTrue(summary['resumed'])
+        self.assertEqual(summary['trips'], 3)
+        self.assertEqual(self.remaining(), {self.trips[2].pk})
+
+    def test_archive_loads_back(self):
+        before = list(TripLocation.objects.order_by('pk').values_list('pk', 'trip_id', 'timestamp', 'latitude'))
+        with tempfile.TemporaryDirectory() as directory:
+            purge(archive=directory, chunk_size=2)
+            self.assertEqual(Trip.objects.count(), 0)
+            paths = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+            self.assertEqual(len(paths), 3)
+            counts, _ = load(paths)
+        self.assertEqual(counts['trips.Trip'], 6)
+        self.assertEqual(
+            list(TripLocation.objects.order_by('pk').values_list('pk', 'trip_id', 'timestamp', 'latitude')), before
+        )
+        self.assertEqual(TripEvent.objects.count(), 4)
+        self.assertEqual(TripTrack.objects.count(), 4)
+
+
+class SchoolExportTests(TestCase):
+    def test_referenced_users_are_exported_without_their_password(self):
+        trip = create_trip()
+        user = User.objects.create_user(phone='+919999999990', password='secret', user_type=UserTypes.SCHOOL_ADMIN)
+        trip.save(user=user)
+        archive = tarfile.open(fileobj=io.BytesIO(b''.join(archive_chunks(trip.school_id))))
+        manifest = json.load(archive.extractfile('manifest.json'))
+        self.assertEqual(manifest['models']['accounts.user']['rows'], 1)
+        with gzip.open(archive.extractfile(manifest['models']['accounts.user']['file'])) as member:
+            exported = json.loads(member.readline())
+        self.assertEqual(exported['pk'], user.pk)
+        self.assertEqual(exported['fields']['password'], '!')
+
+
+class SegmentLearningTests(TestCase):
+    def test_trip_completed_late_is_learned(self):
+        trip = create_trip()
+        trip.actual_end_time = timezone.now() - timedelta(days=2)
+        trip.save()
+        self.assertEqual(learn(), (0, 0))
+
+        # Marked completed after the watermark, though it ended before it
+        trip.status = 'COMPLETED'
+        trip.save()
+        self.assertEqual(learn(now=timezone.now() + timedelta(hours=1))[0], 1)
+        self.assertEqual(learn(now=timezone.now() + timedelta(hours=2))[0], 0)
+
+    def test_learned_trip_saved_again_is_not_counted_twice(self):
+        trip = create_trip(status='COMPLETED')
+        self.assertEqual(learn(now=timezone.now() + timedelta(hours=1))[0], 1)
+        trip.refresh_from_db()
+        trip.save()
+        self.assertEqual(learn(now=timezone.now() + timedelta(hours=2))[0], 0)
+        self.assertEqual(learn(full=True, now=timezone.now() + timedelta(hours=3))[0], 1)
+
+
+class SyntheticDataTests(TestCase):
+    def contents(self, seed, number):
+        """The generated rows of one school, without ids and insert times"""
+        school = School.objects.get(remarks=marker(seed), zip_code=str(500000 + number))
+        trips = Trip.objects.filter(school=school)
+        order = ('route__name', 'trip_type', 'scheduled_start_time')
+        return {
+            'school': (school.name, school.latitude, school.longitude),
+            'students': list(
+                Student.objects.filter(school=school).order_by('student_id')
+                .values_list('student_id', 'name', 'latitude', 'longitude')
+            ),
+            'trips': list(trips.order_by(*order).values_list(
+                *order, 'status', 'actual_start_time', 'actual_end_time', 'driver__user__phone'
+            )),
+            'visits': list(
+                TripStudent.objects.filter(trip__in=trips)
+                .order_by(*(f'trip__{field}' for field in order), 'route_student__sequence_number')
+                .values_list('route_student__student__student_id', 'scheduled_time', 'actual_time', 'status')
+            ),
+            'locations': list(
+                TripLocation.objects.filter(trip__in=trips)
+                .order_by(*(f'trip__{field}' for field in order), 'timestamp')
+                .values_list('latitude', 'longitude', 'timestamp', 'speed')
+            ),
+        }
+
+    def generate(self, seed, numbers):
+        """Contents of schools `numbers` generated in that order, rolled back afterwards"""
+        with transaction.atomic():
+            for number in numbers:
+                generate_school(number, 'S', seed, LAST_DAY)
+            contents = {number: self.contents(seed, number) for number in numbers}
+            transaction.set_rollback(True)
+        return contents
+
+    def test_same_seed_same_rows(self):
+        # Workers generate schools in any order, each school only depends on the seed and its number
+        first = self.generate(SEED, [0, 1])
+        second = self.generate(SEED, [1, 0])
+        self.assertEqual(first, second)
+        self.assertNotEqual(first[0]['locations'], first[1]['locations'])
+
+    def test_datasets_of_two_seeds_side_by_side(self):
+        summaries = [generate_school(0, 'S', seed, LAST_DAY) for seed in (SEED, SEED + 1)]
+        for seed, summary in zip((SEED, SEED + 1), summaries):
+            self.assertTrue(is_loaded(seed))
+            trips = Trip.objects.filter(school__remarks=marker(seed))
+            self.assertEqual(Student.objects.filter(school__remarks=marker(seed)).count(), summary['students'])
+            self.assertEqual(trips.count(), summary['trips'])
+            self.assertEqual(TripLocation.objects.filter(trip__in=trips).count(), summary['locations'])
+            # 4 routes, both ways, 5 days
+            self.assertEqual(summary['trips'], 40)
+            self.assertEqual(summary['students'], 200)
+        self.assertNotEqual(self.contents(SEED, 0)['students'], self.contents(SEED + 1, 0)['students'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are PostgreSQL specific')
+class QueryPlanTests(TestCase):
+    """
+    The hot queries must keep an index path on a seeded synthetic dataset.
+    A plan that falls back to a sequential scan of the table a query is
+    looking up fails the test, with the plan in the failure message.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            generate_school(number, 'M', SEED, LAST_DAY)
+        cls.trip = Trip.objects.filter(school__remarks=marker(SEED)).order_by('pk')[150]
+        # Into monthly partitions like a maintained database, rather than the default one
+        for table in PARTITIONED_TABLES:
+            split_default_partition(table)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            # Sequential scans of empty partitions (the ones created ahead of time) cost nothing;
+            # pages left behind by rolled back inserts of other tests do not count
+            cursor.execute('SELECT relname FROM pg_class WHERE relkind = %s AND reltuples > 0', ['r'])
+            cls.filled = {name for name, in cursor.fetchall()}
+
+    def assertIndexed(self, queryset, model):
+        """Fail if the plan of `queryset` reads any table (or partition) of `model` sequentially"""
+        table = model._meta.db_table
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        scans = [
+            node['Relation Name'] for node in plan_nodes(plan)
+            if node['Node Type'] == 'Seq Scan' and node['Relation Name'].startswith(table)
+            and node['Relation Name'] in self.filled
+        ]
+        if scans:
+            self.fail(f'Sequential scan of {", ".join(scans)}:\n{queryset.explain()}')
+
+    def test_trip_in_progress_by_bus(self):
+        # ingestion.ingest
+        trips = Trip.objects.filter(
+            bus__registration_number=self.trip.bus.registration_number, status='IN_PROGRESS'
+        ).order_by('-actual_start_time').values_list('id', 'bus_id', 'school_id')
+        self.assertIndexed(trips, Trip)
+
+    def test_latest_locations_of_trips_in_progress(self):
+        # positions.warm
+        locations = (
+            TripLocation.objects.filter(trip__status='IN_PROGRESS')
+            .order_by('trip_id', '-timestamp')
+            .distinct('trip_id')
+            .values_list('trip_id', 'timestamp')
+        )
+        self.assertIndexed(locations, Trip)
+        self.assertIndexed(locations, TripLocation)
+
+    def test_student_on_trip_in_progress(self):
+        # views: a student's live trip
+        students = TripStudent.objects.filter(
+            route_student__student_id=self.trip.trip_students.first().route_student.student_id,
+            trip__status='IN_PROGRESS',
+        ).values_list('id', 'trip_id')
+        self.assertIndexed(students, Trip)
+        self.assertIndexed(students, TripStudent)
+
+    def test_trips_of_school_by_day(self):
+        first_day = self.trip.scheduled_start_time.date()
+        self.assertIndexed(dict(school_querysets(self.trip.school_id, first_day, first_day))[Trip], Trip)
+        self.assertIndexed(trips_to_purge(first_day, first_day, [self.trip.school_id]), Trip)
+        # conflicts.ConflictIndex.fill for one school
+        start = self.trip.scheduled_start_time
+        trips = Trip.objects.exclude(status='CANCELLED').filter(
+            school_id__in=[self.trip.school_id],
+            scheduled_start_time__gte=start - timedelta(days=1),
+            scheduled_start_time__lt=start + timedelta(hours=2),
+        )
+        self.assertIndexed(trips.values_list('id', 'bus_id', 'driver_id'), Trip)
+
+    def test_completed_trips_of_route(self):
+        # mapmatch, segments
+        trips = Trip.objects.filter(route_id=self.trip.route_id, trip_type=self.trip.trip_type, status='COMPLETED')
+        self.assertIndexed(trips.values_list('id', flat=True), Trip)
+
+    def test_trip_locations_in_time_order(self):
+        # tracks.raw_trip_points
+        locations = TripLocation.objects.filter(trip_id=self.trip.pk).order_by('timestamp')
+        self.assertIndexed(locations.values_list('timestamp', 'latitude', 'longitude', 'speed'), TripLocation)
+
+    def test_trip_locations_of_time_range(self):
+        start = self.trip.scheduled_start_time
+        locations = TripLocation.objects.filter(timestamp__gte=start, timestamp__lt=start + timedelta(minutes=10))
+        self.assertIndexed(locations.values_list('trip_id', 'timestamp'), TripLocation)
+
+    def test_scheduled_students_of_trip(self):
+        # geofence.TripStops.load, eta
+        students = TripStudent.objects.filter(trip=self.trip, status='SCHEDULED')
+        self.assertIndexed(students.values_list('id', 'route_student_id'), TripStudent)
+
+    def test_trip_events_by_type_and_time(self):
+        # safety.new_findings
+        start = self.trip.scheduled_start_time
+        events = TripEvent.objects.filter(
+            trip_id=self.trip.pk,
+            event_type__in=['OVERSPEED', 'HARSH_BRAKING'],
+            timestamp__gte=start,
+            timestamp__lte=start + timedelta(hours=2),
+        )
+        self.assertIndexed(events.values_list('event_type', 'timestamp'), TripEvent)
@@ -0,0 +1,276 @@
+import logging
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import FloatField, Max, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Trip, TripLocation, TripTrack
+from .simplify import simplify_track
+
+logger = logging.getLogger(__name__)
+
+# Track blob layout (little endian):
+#   header  magic, version, point count
+#   int32   latitude in micro-degrees, first value absolute then deltas
+#   int32   longitude in micro-degrees, first value absolute then deltas
+#   int16   speed in 1/100 km/h, SPEED_MISSING when the device sent none
+#   uint16  seconds since the previous point, first value 0
+HEADER = struct.Struct('<4sBI')
+MAGIC = b'TRK1'
+VERSION = 1
+SPEED_MISSING = np.iinfo(np.int16).min
+SPEED_MAX = np.iinfo(np.int16).max / 100
+MICRO = 1_000_000
+MAX_GAP = np.iinfo(np.uint16).max  # seconds between two stored points
+
+
+def encode_track(timestamps, latitudes, longitudes, speeds):
+    """
+    Pack point arrays into the track blob. `timestamps` are seconds relative to
+    the first point, `speeds` may contain NaN for missing readings.
+    """
+    count = len(timestamps)
+    lat = np.rint(np.asarray(latitudes, dtype=np.float64) * MICRO).astype(np.int64)
+    lon = np.rint(np.asarray(longitudes, dtype=np.float64) * MICRO).astype(np.int64)
+
+    speed = np.asarray(speeds, dtype=np.float64)
+    speed_missing = np.isnan(speed)
+    speed = np.rint(np.clip(np.nan_to_num(speed), 0, SPEED_MAX) * 100).astype(np.int16)
+    speed[speed_missing] = SPEED_MISSING
+
+    # Offsets are rounded against the start, not per step, so rounding never drifts
+    offsets = np.rint(np.asarray(timestamps, dtype=np.float64)).astype(np.int64)
+    gaps = np.diff(offsets, prepend=offsets[:1])
+    if count and (gaps.min() < 0 or gaps.max() > MAX_GAP):
+        raise ValueError('Points must be sorted and less than 18 hours apart')
+
+    return b''.join((
+        HEADER.pack(MAGIC, VERSION, count),
+        np.diff(lat, prepend=0).astype('<i4').tobytes(),
+        np.diff(lon, prepend=0).astype('<i4').tobytes(),
+        speed.astype('<i2').tobytes(),
+        gaps.astype('<u2').tobytes(),
+    ))
+
+
+def decode_track(data):
+    """Unpack a track blob into (offsets, latitudes, longitudes, speeds) arrays"""
+    data = bytes(data)
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Unsupported track format')
+
+    offset = HEADER.size
+    arrays = []
+    for dtype in ('<i4', '<i4', '<i2', '<u2'):
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        arrays.append(array)
+    dlat, dlon, speed, gaps = arrays
+
+    latitudes = np.cumsum(dlat, dtype=np.int64) / MICRO
+    longitudes = np.cumsum(dlon, dtype=np.int64) / MICRO
+    speeds = np.where(speed == SPEED_MISSING, np.nan, speed / 100)
+    offsets = np.cumsum(gaps, dtype=np.int64)
+    return offsets, latitudes, longitudes, speeds
+
+
+def empty_points():
+    return None, np.array([], dtype=np.int64), np.array([]), np.array([]), np.array([])
+
+
+def raw_trip_points(trip_id, after_id=None):
+    """
+    (start_time, offsets, latitudes, longitudes, speeds) from the raw
+    TripLocation rows, only those inserted after row `after_id` if given.
+    """
+    rows = TripLocation.objects.filter(trip_id=trip_id)
+    if after_id is not None:
+        rows = rows.filter(id__gt=after_id)
+    # Coordinates come back as floats from the database, no Decimal or model instances
+    rows = (
+        rows.order_by('timestamp')
+        .annotate(
+            lat=Cast('latitude', FloatField()),
+            lon=Cast('longitude', FloatField()),
+            speed_kmh=Cast('speed', FloatField()),
+        )
+        .values_list('timestamp', 'lat', 'lon', 'speed_kmh')
+    )
+    rows = list(rows)
+    if not rows:
+        return empty_points()
+    timestamps, latitudes, longitudes, speeds = zip(*rows)
+    start_time = timestamps[0]
+    epoch = start_time.timestamp()
+    return (
+        start_time,
+        np.fromiter((t.timestamp() - epoch for t in timestamps), dtype=np.float64, count=len(rows)),
+        np.array(latitudes, dtype=np.float64),
+        np.array(longitudes, dtype=np.float64),
+        np.array(speeds, dtype=np.float64),  # None becomes NaN
+    )
+
+
+def track_points(track):
+    """(start_time, offsets, latitudes, longitudes, speeds) decoded from a TripTrack"""
+    return (track.start_time, *decode_track(track.data))
+
+
+def merge_points(first, second):
+    """Combine two point sets into one, sorted by time"""
+    if first[0] is None or second[0] is None:
+        return second if first[0] is None else first
+    start_time = min(first[0], second[0])
+    parts = [
+        (points[1] + (points[0] - start_time).total_seconds(), *points[2:])
+        for points in (first, second)
+    ]
+    offsets, latitudes, longitudes, speeds = (np.concatenate(arrays) for arrays in zip(*parts))
+    order = np.argsort(offsets, kind='stable')
+    return start_time, offsets[order], latitudes[order], longitudes[order], speeds[order]
+
+
+def longest_run(offsets):
+    """
+    Mask of the largest run of sorted points at most MAX_GAP seconds apart.
+    Points outside it carry a wrong device clock and cannot be stored.
+    """
+    rounded = np.rint(offsets)
+    breaks = np.flatnonzero(np.diff(rounded) > MAX_GAP) + 1
+    keep = np.zeros(len(offsets), dtype=bool)
+    bounds = np.concatenate(([0], breaks, [len(offsets)]))
+    best = int(np.argmax(np.diff(bounds)))
+    keep[bounds[best]:bounds[best + 1]] = True
+    return keep
+
+
+def bridge_gaps(offsets, keep):
+    """Also keep dropped points where the simplified track would be more than MAX_GAP seconds apart"""
+    rounded = np.rint(offsets)
+    keep = keep.copy()
+    last_kept = 0
+    for index in range(1, len(offsets) - 1):
+        if not keep[index] and rounded[index + 1] - rounded[last_kept] > MAX_GAP:
+            keep[index] = True
+        if keep[index]:
+            last_kept = index
+    return keep
+
+
+def load_trip_points(trip_id):
+    """
+    Return (start_time, offsets, latitudes, longitudes, speeds) for a trip,
+    from its packed track when there is one, otherwise from the raw rows.
+    """
+    track = TripTrack.objects.filter(trip_id=trip_id).only('start_time', 'data').first()
+    if track is not None:
+        return track_points(track)
+    return raw_trip_points(trip_id)
+
+
+def pack_trip(trip_id, tolerance=None):
+    """
+    Simplify a trip's raw TripLocation rows (see trips.simplify) into its
+    TripTrack. Raw rows are kept until purge_raw_locations removes them.
+    Safe to call repeatedly: while all raw rows behind the track are still
+    there it is rebuilt from them, once they were purged only rows inserted
+    after the last packed one are merged into it.
+    Returns the TripTrack, or None if the trip has no points.
+    """
+    if tolerance is None:
+        tolerance = getattr(settings, 'TRIP_TRACK_TOLERANCE_M', 5.0)
+
+    with transaction.atomic():
+        track = TripTrack.objects.select_for_update().filter(trip_id=trip_id).first()
+        rows = TripLocation.objects.filter(trip_id=trip_id)
+        last_location_id = rows.aggregate(last=Max('id'))['last']
+        if last_location_id is None:
+            return track
+
+        if track is not None and track.last_location_id is not None:
+            packed_rows = rows.filter(id__lte=track.last_location_id).count()
+        else:
+            packed_rows = rows.count()
+        if track is None or packed_rows >= track.raw_point_count:
+            points = raw_trip_points(trip_id)
+            raw_point_count = len(points[1])
+        else:
+            # Raw rows were purged, the track is now the only copy of them
+            if track.last_location_id is not None and last_location_id <= track.last_location_id:
+                return track
+            points = raw_trip_points(trip_id, after_id=track.last_location_id)
+            raw_point_count = track.raw_point_count + len(points[1])
+            points = merge_points(track_points(track), points)
+
+        start_time, offsets, latitudes, longitudes, speeds = points
+        run = longest_run(offsets)
+        if not run.all():
+            logger.warning('Trip %s: dropped %d points too far apart in time', trip_id, (~run).sum())
+            first = offsets[run][0]
+            start_time += timedelta(seconds=float(first))
+            offsets, latitudes, longitudes, speeds = offsets[run] - first, latitudes[run], longitudes[run], speeds[run]
+        keep = bridge_gaps(offsets, simplify_track(latitudes, longitudes, tolerance))
+        track, _ = TripTrack.objects.update_or_create(
+            trip_id=trip_id,
+            defaults={
+                'start_time': start_time,
+                'point_count': int(keep.sum()),
+                'raw_point_count': raw_point_count,
+                'last_location_id': last_location_id,
+                'tolerance': tolerance,
+                'data': encode_track(offsets[keep], latitudes[keep], longitudes[keep], speeds[keep]),
+            },
+        )
+    return track
+
+
+def purge_raw_locations(retention_days=None, now=None):
+    """
+    Delete raw TripLocation rows of packed trips that ended more than
+    `retention_days` ago. Returns the number of rows deleted.
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'TRIP_RAW_LOCATION_RETENTION_DAYS', 7)
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+    packed_trips = TripTrack.objects.filter(trip__status='COMPLETED').filter(
+        Q(trip__actual_end_time__lt=cutoff)
+        | Q(trip__actual_end_time__isnull=True, updated_at__lt=cutoff)
+    ).values('trip_id')
+    return TripLocation.objects.filter(trip_id__in=packed_trips).delete()[0]
+
+
+def track_as_dict(trip_id, matched=False):
+    """
+    Decoded track as plain lists, suitable for a JSON response. With `matched`
+    points are snapped onto the route's learned path where they match it.
+    """
+    start_time, offsets, latitudes, longitudes, speeds = load_trip_points(trip_id)
+    if start_time is None:
+        return None
+    if matched:
+        from .mapmatch import get_matcher
+        route_id, trip_type = Trip.objects.values_list('route_id', 'trip_type').get(pk=trip_id)
+        matcher = get_matcher(route_id, trip_type)
+        if matcher is not None:
+            snapped_latitudes, snapped_longitudes, _ = matcher.match(latitudes, longitudes)
+            on_path = ~np.isnan(snapped_latitudes)
+            latitudes = np.where(on_path, snapped_latitudes, latitudes)
+            longitudes = np.where(on_path, snapped_longitudes, longitudes)
+    start = start_time.timestamp()
+    return {
+        'trip': trip_id,
+        'start_time': start_time.isoformat(),
+        'timestamps': [
+            datetime.fromtimestamp(start + offset, tz=dt_timezone.utc).isoformat()
+            for offset in offsets.tolist()
+        ],
+        'latitude': latitudes.round(6).tolist(),
+        'longitude': longitudes.round(6).tolist(),
+        'speed': [None if np.isnan(s) else round(s, 2) for s in speeds.tolist()],
+    }
@@ -0,0 +1,17 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'trips'
+
+urlpatterns = [
+    path('ingest/', views.ingest_locations, name='ingest_locations'),
+    path('<int:trip_id>/track/', views.trip_track, name='trip_track'),
+    path('<int:trip_id>/position/', views.trip_position, name='trip_position'),
+    path('<int:trip_id>/etas/', views.trip_etas, name='trip_etas'),
+    path('buses/<int:bus_id>/position/', views.bus_position, name='bus_position'),
+    path('schools/<int:school_id>/positions/', views.school_positions, name='school_positions'),
+    path('schools/<int:school_id>/schedule/', views.school_schedule, name='school_schedule'),
+    path('schools/<int:school_id>/export/', views.school_export, name='school_export'),
+    path('students/<int:student_id>/position/', views.student_position, name='student_position'),
+]
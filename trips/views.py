@@ -1,3 +1,211 @@
-from django.shortcuts import render
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 
-# Create your views here.
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from schools.models import School, SchoolAdmin, Student
+from vehicles.models import Bus
+
+from . import positions
+from .eta import get_trip_etas
+from .export import COMPRESSIONS, archive_chunks, zstandard
+from .ingestion import IngestionError, ingest
+from .mapmatch import get_matched_position
+from .materialize import schedule_between
+from .models import Trip, TripStudent
+from .tracks import track_as_dict
+
+MAX_SCHEDULE_DAYS = 366
+
+
+def device_token(request):
+    """Token of an `Authorization: Bearer <token>` header, '' without one"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else ''
+
+
+@csrf_exempt  # devices authenticate with their bus token, not a session
+@require_POST
+def ingest_locations(request):
+    """
+    Device endpoint for GPS points. Expects an `Authorization: Bearer <token>`
+    header with the bus's device token (see the issue_device_token command)
+    and a JSON body of the form
+    {"bus": "<registration number>", "points": [{"latitude": .., "longitude": ..,
+    "speed": .., "timestamp": "<ISO 8601>"}, ...]}
+    """
+    try:
+        payload = json.loads(request.body)
+        registration_number = payload['bus']
+        token_hash = Bus.objects.filter(
+            registration_number=registration_number
+        ).values_list('device_token_hash', flat=True).first()
+        # Same answer for an unknown bus and a wrong token
+        if not Bus.check_device_token(token_hash, device_token(request)):
+            return JsonResponse({'error': 'Invalid device token'}, status=401)
+        trip_id, accepted = ingest(registration_number, payload.get('points'))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        message = str(e) if isinstance(e, IngestionError) else 'Invalid payload'
+        return JsonResponse({'error': message}, status=400)
+    except Trip.DoesNotExist as e:
+        return JsonResponse({'error': str(e)}, status=404)
+
+    return JsonResponse({'trip': trip_id, 'accepted': accepted}, status=202)
+
+
+@require_GET
+def trip_track(request, trip_id):
+    """Decoded track of a trip as parallel arrays, ?matched=1 snaps it onto the route's path"""
+    school_id = Trip.objects.filter(pk=trip_id).values_list('school_id', flat=True).first()
+    if school_id is None:
+        raise Http404('Unknown trip')
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    track = track_as_dict(trip_id, matched=request.GET.get('matched') == '1')
+    if track is None:
+        raise Http404('No track recorded for this trip')
+    return JsonResponse(track)
+
+
+def can_view_school(user, school_id):
+    if not user.is_authenticated:
+        return False
+    return user.is_staff or SchoolAdmin.objects.filter(user=user, school_id=school_id).exists()
+
+
+def forbidden():
+    return JsonResponse({'error': 'Not allowed'}, status=403)
+
+
+def format_eta(eta):
+    return datetime.fromtimestamp(eta, dt_timezone.utc).isoformat()
+
+
+def position_response(position):
+    if position is None:
+        return JsonResponse({'error': 'No live position'}, status=404)
+    return JsonResponse(position)
+
+
+@require_GET
+def bus_position(request, bus_id):
+    """Latest known position of a bus"""
+    school_id = Bus.objects.filter(pk=bus_id).values_list('school_id', flat=True).first()
+    if school_id is None:
+        raise Http404('Unknown bus')
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    return position_response(positions.get_bus_position(bus_id))
+
+
+@require_GET
+def trip_position(request, trip_id):
+    """Latest known position of an in-progress trip, with its position snapped onto the route's path"""
+    school_id = Trip.objects.filter(pk=trip_id).values_list('school_id', flat=True).first()
+    if school_id is None:
+        raise Http404('Unknown trip')
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    position = positions.get_trip_position(trip_id)
+    if position is not None:
+        position = {**position, 'matched': get_matched_position(trip_id)}
+    return position_response(position)
+
+
+@require_GET
+def trip_etas(request, trip_id):
+    """Estimated arrival at every remaining stop of an in-progress trip"""
+    school_id = Trip.objects.filter(pk=trip_id).values_list('school_id', flat=True).first()
+    if school_id is None:
+        raise Http404('Unknown trip')
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    etas = get_trip_etas(trip_id)
+    if etas is None:
+        return JsonResponse({'error': 'No live estimate'}, status=404)
+    return JsonResponse({'trip': trip_id, 'etas': [
+        {'trip_student': pk, 'eta': format_eta(eta)} for pk, eta in etas.items() if eta is not None
+    ]})
+
+
+@require_GET
+def school_positions(request, school_id):
+    """Dashboard view: latest known position of every bus of a school"""
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    bus_ids = Bus.objects.filter(school_id=school_id).values_list('id', flat=True)
+    found = positions.get_bus_positions(bus_ids)
+    return JsonResponse({'school': school_id, 'buses': list(found.values())})
+
+
+@require_GET
+def school_schedule(request, school_id):
+    """Trips of a date range, ?start=YYYY-MM-DD&days=N; days past the horizon come from the templates"""
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    try:
+        first_day = date.fromisoformat(request.GET['start']) if 'start' in request.GET else timezone.localdate()
+        days = int(request.GET.get('days', 7))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start or days'}, status=400)
+    if not 1 <= days <= MAX_SCHEDULE_DAYS:
+        return JsonResponse({'error': f'days must be between 1 and {MAX_SCHEDULE_DAYS}'}, status=400)
+    trips = schedule_between(first_day, first_day + timedelta(days=days - 1), [school_id])
+    return JsonResponse({'school': school_id, 'trips': trips})
+
+
+@require_GET
+def school_export(request, school_id):
+    """
+    Streamed tar archive of a school's data, one compressed NDJSON file per model,
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD limits the trips, ?compression=gzip|zstd
+    """
+    if not can_view_school(request.user, school_id):
+        return forbidden()
+    try:
+        first_day = date.fromisoformat(request.GET['start']) if 'start' in request.GET else None
+        last_day = date.fromisoformat(request.GET['end']) if 'end' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start or end'}, status=400)
+    compression = request.GET.get('compression', 'gzip')
+    if compression not in COMPRESSIONS or (compression == 'zstd' and zstandard is None):
+        return JsonResponse({'error': f'Unsupported compression {compression}'}, status=400)
+    if not School.objects.filter(pk=school_id).exists():
+        raise Http404('Unknown school')
+
+    response = StreamingHttpResponse(
+        archive_chunks(school_id, first_day, last_day, compression), content_type='application/x-tar'
+    )
+    response['Content-Disposition'] = f'attachment; filename="school-{school_id}.tar"'
+    return response
+
+
+@require_GET
+def student_position(request, student_id):
+    """Parent view: where is the bus of my child's current trip"""
+    student = Student.objects.filter(pk=student_id).select_related('parent').first()
+    if student is None:
+        raise Http404('Unknown student')
+    is_parent = (
+        request.user.is_authenticated
+        and student.parent is not None
+        and student.parent.user_id == request.user.pk
+    )
+    if not (is_parent or can_view_school(request.user, student.school_id)):
+        return forbidden()
+
+    trip_student = TripStudent.objects.filter(
+        route_student__student_id=student_id,
+        trip__status='IN_PROGRESS',
+    ).values_list('id', 'trip_id').first()
+    if trip_student is None:
+        return JsonResponse({'error': 'No trip in progress'}, status=404)
+    trip_student_id, trip_id = trip_student
+    position = positions.get_trip_position(trip_id)
+    if position is None:
+        return position_response(position)
+    eta = (get_trip_etas(trip_id) or {}).get(trip_student_id)
+    return JsonResponse({**position, 'eta': None if eta is None else format_eta(eta)})
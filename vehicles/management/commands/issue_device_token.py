@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from vehicles.models import Bus
+
+class Command(BaseCommand):
+    help = 'Issue a new GPS device token for a bus, replacing the old one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('registration_number', help='Registration number of the bus')
+
+    def handle(self, *args, **options):
+        bus = Bus.objects.filter(registration_number=options['registration_number']).first()
+        if bus is None:
+            raise CommandError(f"No bus with registration number {options['registration_number']}")
+
+        try:
+            token = bus.issue_device_token()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully issued a device token for {bus.registration_number}, '
+                    f'it is shown only once:\n{token}'
+                )
+            )
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error issuing device token: {str(e)}'))
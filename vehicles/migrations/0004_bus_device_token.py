@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vehicles", "0003_alter_bus_school"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bus",
+            name="device_token_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -1,7 +1,15 @@
+import hashlib
+import hmac
+import secrets
+
 from django.db import models
 from common.models import BaseMixin
 from django.apps import apps
 
+
+def hash_device_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
 class Bus(BaseMixin):
     FUEL_TYPES = [
         ('DIESEL', 'Diesel'),
@@ -27,6 +35,8 @@ class Bus(BaseMixin):
     next_maintenance_due = models.DateField(null=True, blank=True)
     insurance_expiry = models.DateField()
     fitness_certificate_expiry = models.DateField()
+    # SHA-256 of the token the GPS device sends, the token itself is never stored
+    device_token_hash = models.CharField(max_length=64, blank=True, editable=False)
     
     class Meta:
         verbose_name = 'Bus'
@@ -36,6 +46,18 @@ class Bus(BaseMixin):
     def __str__(self):
         return f"{self.registration_number} - {self.school.name}"
 
+    def issue_device_token(self):
+        """Replace the device token, returns the new token to configure the device with"""
+        token = secrets.token_urlsafe(32)
+        self.device_token_hash = hash_device_token(token)
+        self.save(update_fields=['device_token_hash', 'updated_at'])
+        return token
+
+    @staticmethod
+    def check_device_token(token_hash, token):
+        """Whether `token` matches a stored device token hash; a bus without a token accepts nothing"""
+        return bool(token_hash and token) and hmac.compare_digest(token_hash, hash_device_token(token))
+
 class BusDocument(BaseMixin):
     DOCUMENT_TYPES = [
         ('INSURANCE', 'Insurance'),